@@ -63,7 +63,42 @@ CREATE TABLE IF NOT EXISTS feed_items (
     user_id INTEGER NOT NULL,
     tweet_id INTEGER NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    PRIMARY KEY (id, user_id)
+    PRIMARY KEY (id, user_id),
+    UNIQUE (user_id, tweet_id)
+);
+
+-- Create feed_counts table (per-user feed size counter)
+CREATE TABLE IF NOT EXISTS feed_counts (
+    user_id INTEGER PRIMARY KEY,
+    item_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Create user_activity table (last feed read, used by the dormancy policy)
+CREATE TABLE IF NOT EXISTS user_activity (
+    user_id INTEGER PRIMARY KEY,
+    last_feed_read_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create tweet_outbox table (fan-out events waiting for the relay).
+-- Kept local to the coordinator: the relay claims rows with FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS tweet_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    tweet_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    payload JSON NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    claimed_until TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    failed_at TIMESTAMP
+);
+
+-- Create feed_spill table (users with dropped fan-out messages to reconcile).
+-- Kept local to the coordinator: reconciliation claims rows with FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS feed_spill (
+    user_id INTEGER PRIMARY KEY,
+    since TIMESTAMP NOT NULL,
+    spilled_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Create indexes before distribution
@@ -78,6 +113,8 @@ SELECT create_distributed_table('users', 'id');
 SELECT create_distributed_table('tweets', 'author_id', colocate_with => 'users');
 SELECT create_distributed_table('subscriptions', 'follower_id', colocate_with => 'users');
 SELECT create_distributed_table('feed_items', 'user_id', colocate_with => 'users');
+SELECT create_distributed_table('feed_counts', 'user_id', colocate_with => 'users');
+SELECT create_distributed_table('user_activity', 'user_id', colocate_with => 'users');
 
 -- Verify distribution
 SELECT 
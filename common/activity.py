@@ -0,0 +1,91 @@
+"""
+Dormancy policy for push fan-out.
+
+Most followers never open their feed, yet every tweet used to write a feed
+row (and, in step 6, a cache entry) for each of them. A user counts as
+active if they read their feed within ``dormant_after_days``; fan-out only
+delivers to active users. Dormant users miss those deliveries, so when they
+come back their first feed read reports them as returning and the caller
+rebuilds their feed from the tweets of the accounts they follow. Step 6
+reads and writes its Redis read log (``users:last_read``) instead of
+user_activity, so cached feed reads cost no database round trip.
+
+The policy is off by default (``dormant_after_days = 0``): once enabled,
+users without a recorded read count as dormant until they read their feed.
+
+Queue volume, feed writes and cache memory then scale with active users
+instead of total users.
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .models import UserActivity
+
+# A read only rewrites last_feed_read_at once it is older than this, so
+# feed reads do not turn into one UPDATE each
+TOUCH_INTERVAL = timedelta(hours=1)
+
+
+def dormancy_cutoff() -> Optional[datetime]:
+    """Reads older than this make a user dormant (None: policy disabled)"""
+    days = get_settings().dormant_after_days
+    if days <= 0:
+        return None
+    return datetime.utcnow() - timedelta(days=days)
+
+
+async def filter_active_users(db: AsyncSession, user_ids: Sequence[int]) -> List[int]:
+    """Keep only the users that should receive push fan-out, preserving order"""
+    cutoff = dormancy_cutoff()
+    if cutoff is None or not user_ids:
+        return list(user_ids)
+
+    result = await db.execute(
+        select(UserActivity.user_id)
+        .filter(
+            UserActivity.user_id.in_(set(user_ids)),
+            UserActivity.last_feed_read_at >= cutoff
+        )
+    )
+    active = {row[0] for row in result}
+    return [user_id for user_id in user_ids if user_id in active]
+
+
+def is_dormant(last_read: Optional[datetime]) -> bool:
+    """Whether a user who last read their feed at last_read (None: never) is dormant"""
+    cutoff = dormancy_cutoff()
+    return cutoff is not None and (last_read is None or last_read < cutoff)
+
+
+async def record_feed_read(db: AsyncSession, user_id: int) -> bool:
+    """
+    Record that the user read their feed.
+    Returns True if the user was dormant, i.e. fan-out has been skipping
+    them and their feed must be rebuilt before it is served. The read is then
+    left uncommitted for the caller to commit together with the rebuilt feed,
+    so a failed rebuild is retried on the next read; otherwise it is committed.
+    """
+    result = await db.execute(
+        select(UserActivity.last_feed_read_at).filter(UserActivity.user_id == user_id)
+    )
+    last_read = result.scalar_one_or_none()
+
+    now = datetime.utcnow()
+    if last_read is None or last_read < now - TOUCH_INTERVAL:
+        stmt = insert(UserActivity).values(user_id=user_id, last_feed_read_at=now)
+        await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[UserActivity.user_id],
+                set_={"last_feed_read_at": stmt.excluded.last_feed_read_at}
+            )
+        )
+        if is_dormant(last_read):
+            return True
+        await db.commit()
+
+    return is_dormant(last_read)
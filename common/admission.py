@@ -0,0 +1,179 @@
+"""
+Queue-depth-aware admission control for tweet creation.
+
+Worker queues are length-limited, and once full RabbitMQ drops their
+oldest messages, i.e. feed updates are silently lost. The API process polls
+the depth of every worker queue and pushes back on writers before that
+happens:
+
+- below ``soft_ratio`` of the queue limit every tweet is admitted;
+- between ``soft_ratio`` and ``hard_ratio`` tweets from authors with more
+  than ``large_fanout`` followers (the ones that fill the queues) are
+  refused with 429;
+- above ``hard_ratio`` every tweet is refused with 503.
+
+Refusals carry a Retry-After estimated from how fast the queues are
+draining. Reads are never affected. After ``stale_after_failures``
+consecutive failed polls the last depths are considered stale and every
+tweet is admitted again (fail open) until a poll succeeds.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+
+logger = logging.getLogger(__name__)
+
+ADMIT_ALL = "ok"
+ADMIT_SMALL = "soft"
+ADMIT_NONE = "hard"
+
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    def __init__(self, url: str, queue_limits: Dict[str, int], interval: float = 1.0,
+                 soft_ratio: float = 0.5, hard_ratio: float = 0.8, large_fanout: int = 10000,
+                 stale_after_failures: int = 3):
+        self.url = url
+        self.queue_limits = queue_limits
+        self.interval = interval
+        self.soft_ratio = soft_ratio
+        self.hard_ratio = hard_ratio
+        self.large_fanout = large_fanout
+        self.stale_after_failures = stale_after_failures
+        self.connection: Optional[AbstractRobustConnection] = None
+        self.channel: Optional[AbstractChannel] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.depths: Dict[str, int] = {}
+        self.fill_ratio = 0.0
+        self.drain_rate = 0.0  # messages/s, positive while queues shrink
+        self._last_poll: Optional[float] = None
+        self.poll_failures = 0  # consecutive
+
+        # Stats
+        self.rejected_soft = 0
+        self.rejected_hard = 0
+
+    async def start(self):
+        self.connection = await aio_pika.connect_robust(
+            self.url,
+            client_properties={"connection_name": "admission_control"}
+        )
+        self.channel = await self.connection.channel()
+        await self.poll()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.connection:
+            await self.connection.close()
+            self.connection = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # A failed passive declare closes the channel
+                if self.channel.is_closed:
+                    self.channel = await self.connection.channel()
+                await self.poll()
+                self.poll_failures = 0
+            except Exception as e:
+                self.poll_failures += 1
+                logger.error(f"Admission control poll failed ({self.poll_failures} in a row): {e}")
+
+    async def poll(self):
+        """Refresh queue depths, fill ratio and drain rate"""
+        depths = {}
+        for name in self.queue_limits:
+            queue = await self.channel.declare_queue(name, passive=True)
+            depths[name] = queue.declaration_result.message_count
+
+        now = time.monotonic()
+        if self._last_poll is not None and now > self._last_poll:
+            drained = sum(self.depths.values()) - sum(depths.values())
+            # Smooth over a few polls; bursts should not swing Retry-After
+            self.drain_rate = 0.7 * self.drain_rate + 0.3 * drained / (now - self._last_poll)
+        self._last_poll = now
+        self.depths = depths
+        self.fill_ratio = max(
+            (depths[name] / limit for name, limit in self.queue_limits.items() if limit),
+            default=0.0
+        )
+
+    def set_queue_limits(self, queue_limits: Dict[str, int]):
+        """Replace the watched queues (after a resize); depths of dropped queues are forgotten"""
+        self.queue_limits = queue_limits
+        self.depths = {name: depth for name, depth in self.depths.items() if name in queue_limits}
+        self.fill_ratio = max(
+            (self.depths.get(name, 0) / limit for name, limit in queue_limits.items() if limit),
+            default=0.0
+        )
+
+    @property
+    def stale(self) -> bool:
+        """Polls keep failing, so fill_ratio no longer reflects the queues"""
+        return self.poll_failures >= self.stale_after_failures
+
+    @property
+    def state(self) -> str:
+        if self.stale:
+            return ADMIT_ALL
+        if self.fill_ratio >= self.hard_ratio:
+            return ADMIT_NONE
+        if self.fill_ratio >= self.soft_ratio:
+            return ADMIT_SMALL
+        return ADMIT_ALL
+
+    def retry_after(self) -> int:
+        """Seconds until the fullest queue is back under the soft limit at the current drain rate"""
+        if self.drain_rate <= 0:
+            return MAX_RETRY_AFTER
+        excess = max(
+            (self.depths.get(name, 0) - limit * self.soft_ratio for name, limit in self.queue_limits.items()),
+            default=0
+        )
+        return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, excess / self.drain_rate)))
+
+    def check(self, fanout: int):
+        """Raise AdmissionRejected if a tweet fanning out to `fanout` followers must wait"""
+        state = self.state
+        if state == ADMIT_NONE:
+            self.rejected_hard += 1
+            raise AdmissionRejected(503, self.retry_after(), "Feed delivery is overloaded, try again later")
+        if state == ADMIT_SMALL and fanout > self.large_fanout:
+            self.rejected_soft += 1
+            raise AdmissionRejected(429, self.retry_after(), "Too many followers to deliver to right now, try again later")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "stale": self.stale,
+            "poll_failures": self.poll_failures,
+            "fill_ratio": round(self.fill_ratio, 3),
+            "drain_rate": round(self.drain_rate, 1),
+            "retry_after": self.retry_after() if self.state != ADMIT_ALL else 0,
+            "rejected_soft": self.rejected_soft,
+            "rejected_hard": self.rejected_hard,
+            "queue_depths": self.depths
+        }
@@ -0,0 +1,336 @@
+"""
+Queue-depth autoscaler for the feed worker processes.
+
+The supervisor runs a fixed number of processes, so a burst queues up until
+someone restarts it with more. The autoscaler polls the depth of every
+worker queue (a passive declare, like the workers' own metrics) and the
+supervisor's processed-message counters, and derives the consumer lag: how
+long the deepest queue takes to drain at the current throughput. It then
+adds or retires processes within ``AUTOSCALE_MIN_PROCESSES`` and
+``AUTOSCALE_MAX_PROCESSES``.
+
+Scaling has hysteresis so the pool does not flap:
+
+- a process is added only after ``AUTOSCALE_UP_POLLS`` consecutive polls with
+  a queue over ``AUTOSCALE_UP_DEPTH`` or lag over ``AUTOSCALE_UP_LAG_SECONDS``;
+- one is retired only after ``AUTOSCALE_DOWN_POLLS`` consecutive polls with
+  every queue under ``AUTOSCALE_DOWN_DEPTH`` and lag under
+  ``AUTOSCALE_DOWN_LAG_SECONDS``; readings between the two thresholds reset
+  both counts;
+- nothing changes within ``AUTOSCALE_COOLDOWN_SECONDS`` of the last change.
+
+The queues themselves are fixed, so resizing re-deals them over the new
+number of processes, moving as few as possible (see
+``rebalance_assignments``). At most one process per queue is useful.
+
+``simulate`` runs the same controller against a model of the queues instead
+of RabbitMQ and real processes, fed with the traffic of the in-repo load
+scripts, to tune the thresholds offline.
+"""
+import asyncio
+import logging
+import math
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import aio_pika
+
+from .config import get_settings
+from .supervisor import rebalance_assignments, shard_assignments
+
+logger = logging.getLogger(__name__)
+
+
+class ScalingPolicy:
+    """Decides the process count from queue depth and lag, with hysteresis"""
+
+    def __init__(self, min_processes: int, max_processes: int,
+                 up_depth: int, down_depth: int, up_lag: float, down_lag: float,
+                 up_polls: int = 2, down_polls: int = 6, cooldown: float = 30.0):
+        self.min_processes = max(1, min_processes)
+        self.max_processes = max(self.min_processes, max_processes)
+        self.up_depth = up_depth
+        self.down_depth = down_depth
+        self.up_lag = up_lag
+        self.down_lag = down_lag
+        self.up_polls = max(1, up_polls)
+        self.down_polls = max(1, down_polls)
+        self.cooldown = cooldown
+        self._above = 0
+        self._below = 0
+        self._changed_at = -math.inf
+
+    def clamp(self, processes: int) -> int:
+        return min(self.max_processes, max(self.min_processes, processes))
+
+    def decide(self, processes: int, depth: int, lag: float, now: float) -> int:
+        """Process count to run, given the deepest queue and the lag (seconds) at time now"""
+        if depth >= self.up_depth or lag >= self.up_lag:
+            self._above += 1
+            self._below = 0
+        elif depth <= self.down_depth and lag <= self.down_lag:
+            self._below += 1
+            self._above = 0
+        else:
+            # Between the thresholds: hold, and start counting again
+            self._above = self._below = 0
+
+        if processes != self.clamp(processes):
+            return self.clamp(processes)
+        if now - self._changed_at < self.cooldown:
+            return processes
+
+        if self._above >= self.up_polls and processes < self.max_processes:
+            processes += 1
+        elif self._below >= self.down_polls and processes > self.min_processes:
+            processes -= 1
+        else:
+            return processes
+        self._above = self._below = 0
+        self._changed_at = now
+        return processes
+
+
+def scaling_policy(max_processes: int) -> ScalingPolicy:
+    """Policy configured from the AUTOSCALE_* settings; max_processes caps AUTOSCALE_MAX_PROCESSES"""
+    settings = get_settings()
+    return ScalingPolicy(
+        min_processes=settings.autoscale_min_processes,
+        max_processes=min(settings.autoscale_max_processes or max_processes, max_processes),
+        up_depth=settings.autoscale_up_depth,
+        down_depth=settings.autoscale_down_depth,
+        up_lag=settings.autoscale_up_lag_seconds,
+        down_lag=settings.autoscale_down_lag_seconds,
+        up_polls=settings.autoscale_up_polls,
+        down_polls=settings.autoscale_down_polls,
+        cooldown=settings.autoscale_cooldown_seconds
+    )
+
+
+class QueueDepthProbe:
+    """
+    Polls queue depths from a background thread with its own event loop, so
+    the (synchronous) supervisor loop can read the latest ``depths``
+    """
+
+    def __init__(self, url: str, queue_names: List[str], interval: float = 5.0):
+        self.url = url
+        self.queue_names = queue_names
+        self.interval = interval
+        self.depths: Dict[str, int] = {}
+        self.errors = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), name="queue-depth-probe", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(self.interval + 5)
+            self._thread = None
+
+    async def _run(self):
+        connection = await aio_pika.connect_robust(
+            self.url,
+            client_properties={"connection_name": "autoscaler"}
+        )
+        try:
+            channel = await connection.channel()
+            while not self._stopped.is_set():
+                try:
+                    # A failed passive declare closes the channel
+                    if channel.is_closed:
+                        channel = await connection.channel()
+                    depths = {}
+                    for name in self.queue_names:
+                        queue = await channel.declare_queue(name, passive=True)
+                        depths[name] = queue.declaration_result.message_count
+                    self.depths = depths
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Queue depth poll failed: {e}")
+                await asyncio.sleep(self.interval)
+        finally:
+            await connection.close()
+
+
+class Autoscaler:
+    """
+    Drives a cluster (a WorkerSupervisor or a SimulatedCluster) from queue
+    depths. With apply=False decisions are only logged, so the controller can
+    shadow a fixed pool while the load scripts run against the API.
+    """
+
+    def __init__(self, cluster, probe, policy: ScalingPolicy, interval: float = 5.0, apply: bool = True):
+        self.cluster = cluster
+        self.probe = probe
+        self.policy = policy
+        self.interval = interval
+        self.apply = apply
+        self.processes = cluster.processes
+        self.throughput = 0.0  # messages/s, smoothed
+        self.depth = 0
+        self.lag = 0.0
+        self._last_tick: Optional[float] = None
+        self._last_processed = 0
+
+        # Stats
+        self.scale_ups = 0
+        self.scale_downs = 0
+
+    def tick(self, now: float) -> bool:
+        """Evaluate once per interval; called from the supervisor loop. True if evaluated."""
+        if self._last_tick is not None and now - self._last_tick < self.interval:
+            return False
+        processed = self.cluster.total_processed
+        if self._last_tick is not None:
+            rate = max(0, processed - self._last_processed) / (now - self._last_tick)
+            self.throughput = 0.5 * self.throughput + 0.5 * rate
+        self._last_tick = now
+        self._last_processed = processed
+
+        depths = self.probe.depths
+        if not depths:
+            return False
+        self.depth = max(depths.values())
+        # Queues are equally weighted, so each drains at its share of the throughput
+        per_queue = self.throughput / len(depths)
+        if self.depth:
+            self.lag = self.depth / per_queue if per_queue > 0 else math.inf
+        else:
+            self.lag = 0.0
+
+        processes = self.policy.decide(self.processes, self.depth, self.lag, now)
+        if processes == self.processes:
+            return True
+        if processes > self.processes:
+            self.scale_ups += 1
+        else:
+            self.scale_downs += 1
+        logger.info(
+            f"{'Scaling' if self.apply else 'Would scale'} feed workers {self.processes} -> {processes} "
+            f"(deepest queue {self.depth}, lag {self.lag:.1f}s, {self.throughput:.0f} msg/s)"
+        )
+        if self.apply:
+            self.cluster.resize(processes)
+        self.processes = processes
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "processes": self.processes,
+            "deepest_queue": self.depth,
+            "lag_seconds": round(self.lag, 1) if math.isfinite(self.lag) else None,
+            "throughput": round(self.throughput, 1),
+            "scale_ups": self.scale_ups,
+            "scale_downs": self.scale_downs
+        }
+
+
+# Simulation
+
+class LoadPhase(NamedTuple):
+    name: str
+    seconds: float
+    # (tweets per second, followers per author)
+    streams: Sequence[Tuple[float, int]]
+
+
+# The traffic of the in-repo load scripts against the step 5 API
+LOAD_SCRIPT_PROFILE = [
+    LoadPhase("idle", 30, []),
+    # run_demo.sh step 4: popular user (500 followers) every 0.5s, mega-popular
+    # user (2000) every 1s, a normal user every 0.2s
+    LoadPhase("run_demo.sh sustained load", 25, [(2, 500), (1, 2000), (5, 15)]),
+    # load_realistic_data.py step 6: 200 active users x 5 tweets, 100 requests in flight
+    LoadPhase("load_realistic_data.py content", 10, [(100, 15)]),
+    LoadPhase("idle", 150, []),
+]
+
+
+def messages_per_tweet(followers: int, routing_shards: int) -> float:
+    """Expected fan-out messages for one tweet: one per routing shard holding a follower"""
+    return routing_shards * (1 - (1 - 1 / routing_shards) ** followers)
+
+
+class SimulatedCluster:
+    """
+    Worker queues and processes in the shape of step 5: arrivals spread
+    evenly over the queues, each process drains service_rate messages/s split
+    over its queues, and a resized process consumes again after restart_seconds
+    """
+
+    def __init__(self, queues: int, processes: int, service_rate: float, restart_seconds: float = 5.0):
+        self.service_rate = service_rate
+        self.restart_seconds = restart_seconds
+        self.backlog = [0.0] * queues
+        self.assignments = shard_assignments(list(range(queues)), processes)
+        self.ready_at = [0.0] * len(self.assignments)
+        self.processed = 0.0
+        self.now = 0.0
+
+    @property
+    def processes(self) -> int:
+        return len(self.assignments)
+
+    @property
+    def total_processed(self) -> int:
+        return int(self.processed)
+
+    @property
+    def depths(self) -> Dict[str, int]:
+        return {str(queue): int(backlog) for queue, backlog in enumerate(self.backlog)}
+
+    def advance(self, seconds: float, arrival_rate: float):
+        for queue in range(len(self.backlog)):
+            self.backlog[queue] += arrival_rate / len(self.backlog) * seconds
+        for shards, ready_at in zip(self.assignments, self.ready_at):
+            if self.now < ready_at:
+                continue
+            for queue in shards:
+                drained = min(self.backlog[queue], self.service_rate / len(shards) * seconds)
+                self.backlog[queue] -= drained
+                self.processed += drained
+        self.now += seconds
+
+    def resize(self, processes: int):
+        assignments = rebalance_assignments(self.assignments, processes)
+        self.ready_at = [
+            self.ready_at[slot] if slot < len(self.assignments) and shards == self.assignments[slot]
+            else self.now + self.restart_seconds
+            for slot, shards in enumerate(assignments)
+        ]
+        self.assignments = assignments
+
+
+def simulate(policy: ScalingPolicy, queues: int, service_rate: float,
+             profile: Sequence[LoadPhase] = LOAD_SCRIPT_PROFILE, load_scale: float = 1.0,
+             interval: float = 5.0, restart_seconds: float = 5.0, step: float = 0.5):
+    """Run the autoscaler against a SimulatedCluster in virtual time and print each poll"""
+    routing_shards = get_settings().routing_shards
+    cluster = SimulatedCluster(queues, policy.min_processes, service_rate, restart_seconds)
+    autoscaler = Autoscaler(cluster, cluster, policy, interval)
+
+    print(f"{'time':>6}  {'phase':<32} {'in msg/s':>9} {'deepest':>8} {'lag s':>7} {'procs':>5}")
+    for phase in profile:
+        arrival_rate = load_scale * sum(
+            rate * messages_per_tweet(followers, routing_shards) for rate, followers in phase.streams
+        )
+        end = cluster.now + phase.seconds
+        while cluster.now < end:
+            processes = autoscaler.processes
+            if autoscaler.tick(cluster.now):
+                lag = f"{autoscaler.lag:7.1f}" if math.isfinite(autoscaler.lag) else f"{'inf':>7}"
+                change = f" -> {autoscaler.processes}" if autoscaler.processes != processes else ""
+                print(
+                    f"{cluster.now:5.0f}s  {phase.name:<32} {arrival_rate:9.0f} "
+                    f"{autoscaler.depth:8d} {lag} {processes:5d}{change}"
+                )
+            cluster.advance(step, arrival_rate)
+
+    stats = autoscaler.get_stats()
+    print(f"\n{stats['scale_ups']} scale-ups, {stats['scale_downs']} scale-downs, "
+          f"{cluster.total_processed} messages processed, {sum(cluster.depths.values())} left")
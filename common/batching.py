@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBatcher:
+    """
+    Collects incoming items and hands them to a handler in batches.
+
+    A batch is flushed as soon as it holds ``max_size`` items or ``linger_ms``
+    milliseconds after its first item arrived, whichever comes first.
+    Batches are handled one at a time, in arrival order.
+    """
+
+    def __init__(self, handler: Callable[[List[Any]], Awaitable[None]],
+                 max_size: int = 50, linger_ms: int = 20):
+        self.handler = handler
+        self.max_size = max(1, max_size)
+        self.linger = linger_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.batches = 0
+        self.items = 0
+        self.last_batch_size = 0
+        # Items put but not yet handled (queued or in the current batch)
+        self.pending = 0
+
+    async def put(self, item: Any):
+        """Add an item to the current batch"""
+        self.pending += 1
+        await self._queue.put(item)
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Wait up to timeout seconds until every item put so far has been
+        handled. Returns False if items were still pending at the deadline.
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def start(self):
+        """Start the flushing loop in the background"""
+        if not self._task:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the flushing loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """Collect and flush batches until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.linger
+
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    # Linger expired: still take whatever is already waiting
+                    while len(batch) < self.max_size and not self._queue.empty():
+                        batch.append(self._queue.get_nowait())
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    continue
+
+            self.batches += 1
+            self.items += len(batch)
+            self.last_batch_size = len(batch)
+
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                logger.error(f"Batch handler error: {e}")
+            finally:
+                self.pending -= len(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    @property
+    def average_batch_size(self) -> float:
+        return self.items / self.batches if self.batches else 0.0
@@ -0,0 +1,247 @@
+"""
+Delayed retries and dead-lettering for feed worker messages.
+
+A message whose processing fails is not rejected (which either drops it or
+redelivers it immediately, forever). Instead the worker acks it and
+republishes a copy:
+
+- to the delay queue of its next attempt (``feed_retry_<exchange>_<delay>ms``).
+  Delay queues have no consumers; when the message's TTL expires the broker
+  dead-letters it to the lane's consistent-hash exchange, which routes it by
+  its ``routing_hash`` header to whichever queue owns that shard now (the
+  queue it came from may have been rebalanced away or deleted meanwhile);
+- to ``feed_dead_letters`` once ``feed_retry_delays_ms`` attempts are used
+  up, or straight away for failures that cannot succeed on retry (malformed
+  message, missing tweet). When recipients of a packed message no longer
+  exist, the worker writes the others and dead-letters only a copy
+  addressed to the missing ones (``dead_letter``).
+
+Dead letters keep their original exchange, queue and the last error in
+headers and can be inspected, replayed or purged from the command line::
+
+    python -m common.dead_letters list --limit 20
+    python -m common.dead_letters replay
+    python -m common.dead_letters purge
+"""
+import argparse
+import asyncio
+import json
+import struct
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+import aio_pika
+from aio_pika import ExchangeType
+from aio_pika.abc import AbstractChannel, AbstractConnection, AbstractIncomingMessage
+from sqlalchemy.exc import IntegrityError
+
+from common.config import get_settings
+from common.event_codec import FORMAT_JSON, decode_event, encode_event
+
+DEAD_LETTER_QUEUE = "feed_dead_letters"
+ATTEMPT_HEADER = "x-retry-attempt"
+ORIGINAL_QUEUE_HEADER = "x-original-queue"
+ORIGINAL_EXCHANGE_HEADER = "x-original-exchange"
+ROUTING_HASH_HEADER = "routing_hash"
+ERROR_HEADER = "x-error"
+FAILED_AT_HEADER = "x-failed-at"
+
+
+def retry_queue_name(exchange: str, delay_ms: int) -> str:
+    return f"feed_retry_{exchange}_{delay_ms}ms"
+
+
+async def declare_retry_topology(channel: AbstractChannel, exchange: str, delays_ms: Sequence[int]):
+    """
+    Declare one delay queue (and fanout exchange) per retry delay for the
+    lane exchange `exchange`, and the DLQ
+    """
+    for delay_ms in delays_ms:
+        name = retry_queue_name(exchange, delay_ms)
+        delay_exchange = await channel.declare_exchange(name, ExchangeType.FANOUT, durable=True)
+        queue = await channel.declare_queue(
+            name,
+            durable=True,
+            arguments={
+                "x-message-ttl": delay_ms,
+                "x-dead-letter-exchange": exchange  # re-routed on the hash ring
+            }
+        )
+        await queue.bind(delay_exchange)
+    await channel.declare_queue(DEAD_LETTER_QUEUE, durable=True)
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """Failures that will not go away on retry (bad payload, FK violation)"""
+    return isinstance(error, (ValueError, KeyError, struct.error, IntegrityError))
+
+
+def _copy(message: AbstractIncomingMessage, headers: Dict[str, Any],
+          data: Optional[Dict[str, Any]] = None) -> aio_pika.Message:
+    """Copy a message with extra headers (and, if given, data as its new JSON body)"""
+    body, content_type = message.body, message.content_type
+    if data is not None:
+        body, content_type = encode_event(data, FORMAT_JSON)
+    return aio_pika.Message(
+        body=body,
+        headers={**(message.headers or {}), **headers},
+        message_id=message.message_id,
+        type=message.type,
+        content_type=content_type,
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+    )
+
+
+class RetryHandler:
+    """Routes failed messages of one worker queue to retry or the DLQ"""
+
+    def __init__(self, channel: AbstractChannel, queue_name: str, exchange: str, delays_ms: Sequence[int]):
+        self.channel = channel
+        self.queue_name = queue_name
+        self.exchange = exchange
+        self.delays_ms = list(delays_ms)
+
+        # Stats
+        self.retried = 0
+        self.dead_lettered = 0
+
+    async def handle_failure(self, message: AbstractIncomingMessage, error: Exception) -> str:
+        """
+        Republish a failed message for its next attempt or dead-letter it.
+        The caller acks the original afterwards. Returns "retry" or "dead_letter".
+        """
+        headers = message.headers or {}
+        attempt = int(headers.get(ATTEMPT_HEADER, 0)) + 1
+
+        # Retries are re-routed by routing_hash; without it they would be lost
+        if (attempt <= len(self.delays_ms) and not is_permanent_failure(error)
+                and ROUTING_HASH_HEADER in headers):
+            exchange = await self.channel.get_exchange(
+                retry_queue_name(self.exchange, self.delays_ms[attempt - 1]), ensure=False
+            )
+            await exchange.publish(_copy(message, {ATTEMPT_HEADER: attempt}), routing_key=self.queue_name)
+            self.retried += 1
+            return "retry"
+
+        await self.dead_letter(message, error)
+        return "dead_letter"
+
+    async def dead_letter(self, message: AbstractIncomingMessage, error: Exception,
+                          data: Optional[Dict[str, Any]] = None):
+        """
+        Move a copy of the message to the DLQ. data replaces the body, e.g. to
+        dead-letter only some recipients of a packed message.
+        """
+        attempt = int((message.headers or {}).get(ATTEMPT_HEADER, 0)) + 1
+        await self.channel.default_exchange.publish(
+            _copy(message, {
+                ATTEMPT_HEADER: attempt,
+                ORIGINAL_QUEUE_HEADER: self.queue_name,
+                ORIGINAL_EXCHANGE_HEADER: self.exchange,
+                ERROR_HEADER: f"{type(error).__name__}: {error}"[:1000],
+                FAILED_AT_HEADER: datetime.utcnow().isoformat()
+            }, data),
+            routing_key=DEAD_LETTER_QUEUE
+        )
+        self.dead_lettered += 1
+
+
+def _describe_body(message: AbstractIncomingMessage) -> Any:
+    try:
+        return decode_event(message.body, message.content_type)
+    except Exception:
+        return message.body[:500].decode(errors="replace")
+
+
+async def inspect_dead_letters(connection: AbstractConnection, limit: int = 20) -> List[Dict[str, Any]]:
+    """Peek at the oldest dead letters without removing them"""
+    channel = await connection.channel()
+    letters = []
+    try:
+        queue = await channel.get_queue(DEAD_LETTER_QUEUE, ensure=False)
+        for _ in range(limit):
+            message = await queue.get(no_ack=False, fail=False)
+            if message is None:
+                break
+            headers = message.headers or {}
+            letters.append({
+                "message_id": message.message_id,
+                "queue": headers.get(ORIGINAL_QUEUE_HEADER),
+                "attempts": headers.get(ATTEMPT_HEADER),
+                "error": headers.get(ERROR_HEADER),
+                "failed_at": headers.get(FAILED_AT_HEADER),
+                "body": _describe_body(message)
+            })
+    finally:
+        # Closing the channel returns every unacked message to the queue in order
+        await channel.close()
+    return letters
+
+
+async def replay_dead_letters(channel: AbstractChannel, limit: Optional[int] = None) -> int:
+    """
+    Move dead letters back with a fresh attempt count: through their lane
+    exchange (to the queue that owns their shard now) when known, otherwise
+    straight to their original queue
+    """
+    queue = await channel.get_queue(DEAD_LETTER_QUEUE, ensure=False)
+    replayed = 0
+    while limit is None or replayed < limit:
+        message = await queue.get(no_ack=False, fail=False)
+        if message is None:
+            break
+        headers = dict(message.headers or {})
+        original_queue = headers.pop(ORIGINAL_QUEUE_HEADER, None)
+        original_exchange = headers.pop(ORIGINAL_EXCHANGE_HEADER, None)
+        if not original_queue:
+            await message.reject(requeue=True)
+            break
+        for header in (ATTEMPT_HEADER, ERROR_HEADER, FAILED_AT_HEADER):
+            headers.pop(header, None)
+
+        exchange = channel.default_exchange
+        if original_exchange and ROUTING_HASH_HEADER in headers:
+            exchange = await channel.get_exchange(original_exchange, ensure=False)
+        await exchange.publish(
+            aio_pika.Message(
+                body=message.body,
+                headers=headers,
+                message_id=message.message_id,
+                type=message.type,
+                content_type=message.content_type,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            ),
+            routing_key=original_queue
+        )
+        await message.ack()
+        replayed += 1
+    return replayed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Inspect, replay or purge feed dead letters")
+    parser.add_argument("command", choices=["list", "replay", "purge"])
+    parser.add_argument("--limit", type=int, default=None, help="messages to list/replay")
+    parser.add_argument("--rabbitmq-url", default=get_settings().rabbitmq_url)
+    args = parser.parse_args()
+
+    connection = await aio_pika.connect_robust(args.rabbitmq_url)
+    try:
+        channel = await connection.channel()
+        queue = await channel.declare_queue(DEAD_LETTER_QUEUE, durable=True)
+        print(f"{DEAD_LETTER_QUEUE}: {queue.declaration_result.message_count} messages")
+
+        if args.command == "list":
+            for letter in await inspect_dead_letters(connection, args.limit or 20):
+                print(json.dumps(letter, default=str))
+        elif args.command == "replay":
+            print(f"Replayed {await replay_dead_letters(channel, args.limit)} messages")
+        else:
+            result = await queue.purge()
+            print(f"Purged {result.message_count} messages")
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+Graceful drain for feed workers.
+
+Closing a channel returns every unacknowledged delivery to its queue, so a
+worker that simply closes on shutdown makes RabbitMQ redeliver its whole
+prefetch window and whatever it was writing at that moment; after a
+rolling deploy the new workers redo that work. Stopping a worker instead:
+
+1. cancels its consumer, so no new deliveries arrive;
+2. waits up to ``FEED_WORKER_DRAIN_TIMEOUT_SECONDS`` for the deliveries it
+   already holds to be committed and acked;
+3. closes the channel and connection. Only what was still in flight at the
+   deadline is redelivered.
+
+Batching workers count in-flight deliveries in their MessageBatcher; the
+others use ``InFlight``. The per-process background consumers are stopped
+the same way by ``stop_background``: the outbox relay finishes its batch and
+the rebuild consumer flushes its coalescing windows early and the spill
+consumer records the dropped messages it holds.
+"""
+import asyncio
+
+from .feed_rebuilds import get_feed_rebuild_consumer
+from .feed_spill import get_spill_reconciler
+from .feed_trimmer import get_feed_trimmer
+from .keyed_executor import get_keyed_executor
+from .outbox import get_outbox_relay
+
+
+class InFlight:
+    """Counts deliveries between receipt and ack"""
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __aenter__(self):
+        self.count += 1
+        self._idle.clear()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.count -= 1
+        if not self.count:
+            self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for all deliveries to finish. False on timeout."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+async def stop_background(timeout: float):
+    """
+    Stop this process's shared background consumers, letting the work they
+    hold finish within timeout seconds
+    """
+    await asyncio.gather(
+        get_outbox_relay().stop(timeout),
+        get_feed_rebuild_consumer().stop(timeout),
+        get_spill_reconciler().stop(timeout)
+    )
+    await get_feed_trimmer().stop()
+    await get_keyed_executor().stop()
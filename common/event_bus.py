@@ -0,0 +1,505 @@
+"""
+Transport interface for the fan-out pipeline.
+
+An event bus carries encoded fan-out events (see common.event_codec) from
+publishers to a fixed number of partitions, each consumed by one worker:
+
+- ``publish`` / ``publish_many`` route every event by its routing hash
+  (``user_id % routing_shards``), so all events of a user land in the same
+  partition and keep their order;
+- ``consume`` hands the deliveries of a partition to a handler, with at
+  most ``prefetch`` of them unacknowledged at a time;
+- ``Delivery.ack`` / ``Delivery.reject`` settle a delivery; unacknowledged
+  deliveries are redelivered after a consumer restart where the transport
+  supports it (AMQP, Redis Streams).
+
+Backends:
+
+- ``amqp``: RabbitMQ x-consistent-hash exchange with one queue per
+  partition (the production topology of steps 5-6);
+- ``redis``: one Redis stream per partition read through a consumer group;
+- ``memory``: in-process asyncio queues, for tests and broker-free
+  benchmarks.
+
+Partitioning for the redis and memory backends uses jump consistent hashing
+of the routing hash, which, like the consistent-hash exchange, only moves
+keys to the new partitions when the count grows.
+
+This is a benchmark harness (see step5_balanced/benchmark_transport.py):
+the feed workers and RabbitMQService of steps 5-6 still talk to RabbitMQ
+through aio_pika directly.
+"""
+import asyncio
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aio_pika
+from aio_pika import ExchangeType
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage, AbstractRobustConnection
+
+from .config import get_settings
+from .publishing import publish_batch, uses_publisher_confirms
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_AMQP = "amqp"
+TRANSPORT_REDIS = "redis"
+TRANSPORT_MEMORY = "memory"
+TRANSPORTS = (TRANSPORT_AMQP, TRANSPORT_REDIS, TRANSPORT_MEMORY)
+
+# (routing_hash, body, content_type)
+Event = Tuple[int, bytes, str]
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach) of a 64-bit key into [0, buckets)"""
+    key &= 0xFFFFFFFFFFFFFFFF
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+class Delivery(ABC):
+    """One event handed to a consumer; each backend settles it its own way"""
+
+    def __init__(self, body: bytes, content_type: str, partition: int,
+                 headers: Optional[Dict[str, str]] = None, redelivered: bool = False):
+        self.body = body
+        self.content_type = content_type
+        self.partition = partition
+        self.headers = headers or {}
+        self.redelivered = redelivered
+
+    @abstractmethod
+    async def ack(self):
+        """Mark the event as processed"""
+
+    @abstractmethod
+    async def reject(self, requeue: bool = False):
+        """Give the event up, or hand it back for redelivery with requeue"""
+
+
+Handler = Callable[[Delivery], Awaitable[None]]
+
+
+class _Credit:
+    """Caps the number of unacknowledged deliveries of one consumer"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self._released = asyncio.Event()
+
+    @property
+    def available(self) -> int:
+        return self.limit - self.in_flight
+
+    async def wait(self):
+        """Wait until at least one more delivery may be handed out"""
+        while self.in_flight >= self.limit:
+            self._released.clear()
+            await self._released.wait()
+
+    async def acquire(self):
+        await self.wait()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._released.set()
+
+
+class EventBus(ABC):
+    """Publish, consume, ack and partitioning of fan-out events"""
+
+    def __init__(self, partitions: int):
+        self.partitions = partitions
+
+    def partition_for(self, routing_hash: int) -> int:
+        return jump_hash(routing_hash, self.partitions)
+
+    async def start(self):
+        """Connect and declare the partitions"""
+
+    async def close(self):
+        """Stop all consumers and disconnect"""
+
+    @abstractmethod
+    async def publish_many(self, events: Iterable[Event]):
+        """Publish events; returns once the transport has accepted all of them"""
+
+    async def publish(self, routing_hash: int, body: bytes, content_type: str):
+        await self.publish_many([(routing_hash, body, content_type)])
+
+    @abstractmethod
+    async def consume(self, partition: int, handler: Handler, prefetch: int = 50) -> str:
+        """Start handing the deliveries of a partition to handler. Returns a consumer tag."""
+
+    @abstractmethod
+    async def cancel(self, consumer_tag: str):
+        """Stop a consumer; its unacknowledged deliveries stay with the transport"""
+
+
+class _MemoryDelivery(Delivery):
+    def __init__(self, bus: "MemoryEventBus", credit: _Credit, event: Event, partition: int, redelivered: bool):
+        super().__init__(event[1], event[2], partition, {"routing_hash": str(event[0])}, redelivered)
+        self._bus = bus
+        self._credit = credit
+        self._event = event
+        self._settled = False
+
+    async def ack(self):
+        if not self._settled:
+            self._settled = True
+            self._credit.release()
+
+    async def reject(self, requeue: bool = False):
+        if not self._settled:
+            self._settled = True
+            self._credit.release()
+            if requeue:
+                self._bus.queues[self.partition].put_nowait((self._event, True))
+
+
+class MemoryEventBus(EventBus):
+    """In-process asyncio queues; nothing survives the process"""
+
+    def __init__(self, partitions: int, max_length: int = 0):
+        super().__init__(partitions)
+        self.queues: List[asyncio.Queue] = [asyncio.Queue(max_length) for _ in range(partitions)]
+        self._consumers: Dict[str, asyncio.Task] = {}
+
+    async def publish_many(self, events: Iterable[Event]):
+        for event in events:
+            # A bounded queue blocks the publisher, like broker flow control
+            await self.queues[self.partition_for(event[0])].put((event, False))
+
+    async def consume(self, partition: int, handler: Handler, prefetch: int = 50) -> str:
+        consumer_tag = f"memory-{partition}-{uuid.uuid4().hex[:8]}"
+        self._consumers[consumer_tag] = asyncio.create_task(
+            self._run_consumer(partition, handler, _Credit(prefetch))
+        )
+        return consumer_tag
+
+    async def _run_consumer(self, partition: int, handler: Handler, credit: _Credit):
+        queue = self.queues[partition]
+        while True:
+            await credit.acquire()
+            event, redelivered = await queue.get()
+            try:
+                await handler(_MemoryDelivery(self, credit, event, partition, redelivered))
+            except Exception as e:
+                logger.error(f"Handler error on memory partition {partition}: {e}")
+
+    async def cancel(self, consumer_tag: str):
+        task = self._consumers.pop(consumer_tag, None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def close(self):
+        for consumer_tag in list(self._consumers):
+            await self.cancel(consumer_tag)
+
+
+class _AmqpDelivery(Delivery):
+    def __init__(self, message: AbstractIncomingMessage, partition: int):
+        super().__init__(
+            message.body,
+            message.content_type,
+            partition,
+            headers={k: str(v) for k, v in (message.headers or {}).items()},
+            redelivered=bool(message.redelivered)
+        )
+        self.message = message
+
+    async def ack(self):
+        await self.message.ack()
+
+    async def reject(self, requeue: bool = False):
+        await self.message.reject(requeue=requeue)
+
+
+class AmqpEventBus(EventBus):
+    """
+    RabbitMQ consistent-hash exchange with one durable queue per partition.
+    The broker does the partitioning (on the routing_hash header), so
+    partition_for is only an estimate for this backend.
+    """
+
+    def __init__(self, url: str, partitions: int, exchange_name: str = "tweet_events_bus",
+                 queue_prefix: str = "feed_updates_bus", binding_weight: int = 20,
+                 publisher_mode: str = "confirms", confirm_window: int = 500, max_length: int = 0):
+        super().__init__(partitions)
+        self.url = url
+        self.exchange_name = exchange_name
+        self.queue_prefix = queue_prefix
+        self.binding_weight = binding_weight
+        self.publisher_mode = publisher_mode
+        self.confirm_window = confirm_window
+        self.max_length = max_length
+        self.connection: Optional[AbstractRobustConnection] = None
+        self.channel: Optional[AbstractChannel] = None
+        self.exchange = None
+        self._consumer_channels: Dict[str, Tuple[AbstractChannel, str]] = {}
+
+    def queue_name(self, partition: int) -> str:
+        return f"{self.queue_prefix}_{partition}"
+
+    async def start(self):
+        self.connection = await aio_pika.connect_robust(
+            self.url,
+            client_properties={"connection_name": f"event_bus_{self.exchange_name}"}
+        )
+        self.channel = await self.connection.channel(
+            publisher_confirms=uses_publisher_confirms(self.publisher_mode)
+        )
+        self.exchange = await self.channel.declare_exchange(
+            self.exchange_name,
+            ExchangeType.X_CONSISTENT_HASH,
+            durable=True,
+            arguments={"hash-header": "routing_hash", "hash-on": "header"}
+        )
+        arguments = {"x-max-length": self.max_length} if self.max_length else None
+        for partition in range(self.partitions):
+            queue = await self.channel.declare_queue(self.queue_name(partition), durable=True, arguments=arguments)
+            await queue.bind(self.exchange, routing_key=str(self.binding_weight))
+
+    async def publish_many(self, events: Iterable[Event]):
+        publishes = [
+            (
+                self.exchange,
+                aio_pika.Message(
+                    body=body,
+                    content_type=content_type,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    headers={"routing_hash": str(routing_hash)}
+                ),
+                str(routing_hash)
+            )
+            for routing_hash, body, content_type in events
+        ]
+        await publish_batch(self.channel, publishes, self.publisher_mode, window=self.confirm_window)
+
+    async def consume(self, partition: int, handler: Handler, prefetch: int = 50) -> str:
+        # A channel per consumer: prefetch is a channel setting
+        channel = await self.connection.channel()
+        await channel.set_qos(prefetch_count=prefetch)
+        queue = await channel.get_queue(self.queue_name(partition), ensure=False)
+
+        async def on_message(message: AbstractIncomingMessage):
+            try:
+                await handler(_AmqpDelivery(message, partition))
+            except Exception as e:
+                logger.error(f"Handler error on {queue.name}: {e}")
+
+        consumer_tag = await queue.consume(on_message)
+        self._consumer_channels[consumer_tag] = (channel, queue.name)
+        return consumer_tag
+
+    async def cancel(self, consumer_tag: str):
+        channel, queue_name = self._consumer_channels.pop(consumer_tag, (None, None))
+        if channel:
+            queue = await channel.get_queue(queue_name, ensure=False)
+            await queue.cancel(consumer_tag)
+            await channel.close()
+
+    async def close(self):
+        for consumer_tag in list(self._consumer_channels):
+            await self.cancel(consumer_tag)
+        if self.connection:
+            await self.connection.close()
+            self.connection = None
+
+
+class _RedisDelivery(Delivery):
+    def __init__(self, bus: "RedisStreamEventBus", credit: _Credit, stream: str, entry_id: bytes,
+                 fields: Dict[bytes, bytes], partition: int, redelivered: bool):
+        super().__init__(
+            fields[b"body"],
+            fields[b"content_type"].decode(),
+            partition,
+            {"routing_hash": fields[b"routing_hash"].decode()},
+            redelivered
+        )
+        self._fields = fields
+        self._bus = bus
+        self._credit = credit
+        self._stream = stream
+        self.entry_id = entry_id
+        self._settled = False
+
+    async def ack(self):
+        if not self._settled:
+            self._settled = True
+            self._credit.release()
+            await self._bus.redis.xack(self._stream, self._bus.group, self.entry_id)
+
+    async def reject(self, requeue: bool = False):
+        if not self._settled:
+            self._settled = True
+            self._credit.release()
+            if requeue:
+                await self._bus.redis.xadd(self._stream, self._fields,
+                                           maxlen=self._bus.max_length or None, approximate=True)
+            await self._bus.redis.xack(self._stream, self._bus.group, self.entry_id)
+
+
+class RedisStreamEventBus(EventBus):
+    """
+    One Redis stream per partition, read through a consumer group. Entries
+    are removed from the group's pending list by XACK. When a consumer
+    starts it claims (XAUTOCLAIM) the partition's entries that have been
+    pending for claim_idle_ms, whoever read them, and re-reads them before
+    new ones; consumer names are random per instance, so a crashed
+    consumer's entries would otherwise never be delivered again.
+    """
+
+    def __init__(self, url: str, partitions: int, stream_prefix: str = "tweet_events",
+                 group: str = "feed_workers", consumer_name: Optional[str] = None,
+                 max_length: int = 0, block_ms: int = 1000, claim_idle_ms: int = 60000):
+        super().__init__(partitions)
+        self.url = url
+        self.stream_prefix = stream_prefix
+        self.group = group
+        self.consumer_name = consumer_name or f"consumer-{uuid.uuid4().hex[:8]}"
+        self.max_length = max_length
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.redis = None
+        self._consumers: Dict[str, Tuple[asyncio.Task, object]] = {}
+
+    def stream_name(self, partition: int) -> str:
+        return f"{self.stream_prefix}:{partition}"
+
+    async def start(self):
+        import redis.asyncio as redis
+        from redis.exceptions import ResponseError
+
+        self.redis = redis.from_url(self.url)
+        for partition in range(self.partitions):
+            try:
+                await self.redis.xgroup_create(self.stream_name(partition), self.group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def publish_many(self, events: Iterable[Event]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for routing_hash, body, content_type in events:
+                pipe.xadd(
+                    self.stream_name(self.partition_for(routing_hash)),
+                    {b"body": body, b"content_type": content_type.encode(), b"routing_hash": str(routing_hash).encode()},
+                    maxlen=self.max_length or None,
+                    approximate=True
+                )
+            await pipe.execute()
+
+    async def consume(self, partition: int, handler: Handler, prefetch: int = 50) -> str:
+        consumer_tag = f"{self.consumer_name}-{partition}"
+        # Blocking XREADGROUP holds its connection, so every consumer gets its own
+        client = self.redis.client()
+        self._consumers[consumer_tag] = (
+            asyncio.create_task(self._run_consumer(client, consumer_tag, partition, handler, _Credit(prefetch))),
+            client
+        )
+        return consumer_tag
+
+    async def _claim_idle(self, client, stream: str, consumer_tag: str):
+        """Move entries pending on any consumer for claim_idle_ms into this consumer's pending list"""
+        cursor = "0-0"
+        while True:
+            response = await client.xautoclaim(
+                stream, self.group, consumer_tag, self.claim_idle_ms,
+                start_id=cursor, count=100
+            )
+            # [next cursor, claimed entries, ...]; with justid redis-py drops the cursor
+            cursor = response[0]
+            if cursor in (b"0-0", "0-0"):
+                return
+
+    async def _run_consumer(self, client, consumer_tag: str, partition: int, handler: Handler, credit: _Credit):
+        stream = self.stream_name(partition)
+        try:
+            await self._claim_idle(client, stream, consumer_tag)
+        except Exception as e:
+            logger.error(f"Claiming idle entries of {stream} failed: {e}")
+        # Entries left unacknowledged (ours or just claimed) first, then new ones
+        pending_from = "0"
+        while True:
+            await credit.wait()
+            redelivered = pending_from is not None
+            try:
+                response = await client.xreadgroup(
+                    self.group, consumer_tag, {stream: pending_from or ">"},
+                    count=credit.available,
+                    block=None if redelivered else self.block_ms
+                )
+            except Exception as e:
+                logger.error(f"Reading {stream} failed: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            entries = response[0][1] if response else []
+            if redelivered:
+                if not entries:
+                    pending_from = None
+                    continue
+                pending_from = entries[-1][0]
+
+            for entry_id, fields in entries:
+                if not fields:
+                    # Trimmed from the stream while pending
+                    if entry_id:
+                        await client.xack(stream, self.group, entry_id)
+                    continue
+                await credit.acquire()
+                try:
+                    await handler(_RedisDelivery(self, credit, stream, entry_id, fields, partition, redelivered))
+                except Exception as e:
+                    logger.error(f"Handler error on {stream}: {e}")
+
+    async def cancel(self, consumer_tag: str):
+        task, client = self._consumers.pop(consumer_tag, (None, None))
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            await client.close()
+
+    async def close(self):
+        for consumer_tag in list(self._consumers):
+            await self.cancel(consumer_tag)
+        if self.redis:
+            await self.redis.close()
+            self.redis = None
+
+
+def create_event_bus(transport: str, partitions: Optional[int] = None, **kwargs) -> EventBus:
+    """Event bus for a transport name, sized to the worker queues by default"""
+    settings = get_settings()
+    partitions = partitions or settings.feed_worker_queues
+    if transport == TRANSPORT_AMQP:
+        return AmqpEventBus(
+            settings.rabbitmq_url,
+            partitions,
+            binding_weight=settings.routing_binding_weight,
+            publisher_mode=settings.publisher_mode,
+            confirm_window=settings.publisher_confirm_window,
+            **kwargs
+        )
+    if transport == TRANSPORT_REDIS:
+        return RedisStreamEventBus(settings.redis_url, partitions, **kwargs)
+    if transport == TRANSPORT_MEMORY:
+        return MemoryEventBus(partitions, **kwargs)
+    raise ValueError(f"Unknown event bus transport: {transport}")
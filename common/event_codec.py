@@ -0,0 +1,117 @@
+"""
+Wire formats for fan-out tweet events.
+
+- ``application/json``: the original format, a JSON object with the tweet
+  fields and ``user_ids`` (or ``user_id``).
+- ``application/vnd.tweet-event.v1``: compact binary. A fixed little-endian
+  header, the strings length-prefixed, and the recipients as a packed array
+  of 32-bit ids (64-bit if any id needs it)::
+
+      B  version (1)        B  flags (1 = 64-bit ids, 2 = no author_id)
+      q  tweet_id           q  author_id           I  number of user ids
+      B  len + created_at   H  len + author_username
+      I  len + content      [I|q] * n  user_ids
+
+The publisher sets the message content type and consumers pick the decoder
+from it, so JSON and compact messages can share a queue while producers and
+consumers are upgraded independently. Both decoders return the same dict.
+"""
+import json
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Optional, Tuple
+
+FORMAT_JSON = "json"
+FORMAT_COMPACT = "compact"
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_COMPACT = "application/vnd.tweet-event.v1"
+
+COMPACT_VERSION = 1
+FLAG_WIDE_IDS = 1
+FLAG_NO_AUTHOR = 2
+
+_HEADER = struct.Struct("<BBqqI")
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_MAX_U32 = 2 ** 32 - 1
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def encode_event(data: Dict[str, Any], fmt: str = FORMAT_COMPACT) -> Tuple[bytes, str]:
+    """Encode a fan-out event; returns (body, content_type)"""
+    if fmt == FORMAT_JSON:
+        return json.dumps(data).encode(), CONTENT_TYPE_JSON
+    if fmt != FORMAT_COMPACT:
+        raise ValueError(f"Unknown message format: {fmt}")
+
+    user_ids = data["user_ids"] if "user_ids" in data else [data["user_id"]]
+    wide = any(user_id < 0 or user_id > _MAX_U32 for user_id in user_ids)
+    ids = array("q" if wide else "I", user_ids)
+    if _BIG_ENDIAN:
+        ids.byteswap()
+
+    created_at = data["created_at"].encode()
+    username = data.get("author_username", "").encode()
+    content = data.get("content", "").encode()
+    # A missing author is flagged rather than encoded as user 0
+    author_id = data.get("author_id")
+    flags = (FLAG_WIDE_IDS if wide else 0) | (FLAG_NO_AUTHOR if author_id is None else 0)
+    return b"".join((
+        _HEADER.pack(COMPACT_VERSION, flags, data["tweet_id"], author_id or 0, len(ids)),
+        _U8.pack(len(created_at)), created_at,
+        _U16.pack(len(username)), username,
+        _U32.pack(len(content)), content,
+        ids.tobytes()
+    )), CONTENT_TYPE_COMPACT
+
+
+def decode_event(body: bytes, content_type: Optional[str] = None) -> Dict[str, Any]:
+    """Decode a fan-out event by its content type (no content type means JSON)"""
+    if content_type != CONTENT_TYPE_COMPACT:
+        return json.loads(body)
+    try:
+        return _decode_compact(body)
+    except struct.error as e:
+        # Same error type as the other malformed-message cases
+        raise ValueError(f"Truncated tweet event: {e}") from e
+
+
+def _decode_compact(body: bytes) -> Dict[str, Any]:
+    version, flags, tweet_id, author_id, count = _HEADER.unpack_from(body)
+    if version != COMPACT_VERSION:
+        raise ValueError(f"Unsupported tweet event version: {version}")
+    offset = _HEADER.size
+
+    (length,) = _U8.unpack_from(body, offset)
+    offset += _U8.size
+    created_at = body[offset:offset + length].decode()
+    offset += length
+
+    (length,) = _U16.unpack_from(body, offset)
+    offset += _U16.size
+    username = body[offset:offset + length].decode()
+    offset += length
+
+    (length,) = _U32.unpack_from(body, offset)
+    offset += _U32.size
+    content = body[offset:offset + length].decode()
+    offset += length
+
+    ids = array("q" if flags & FLAG_WIDE_IDS else "I")
+    ids.frombytes(body[offset:offset + count * ids.itemsize])
+    if _BIG_ENDIAN:
+        ids.byteswap()
+    if len(ids) != count:
+        raise ValueError("Truncated tweet event")
+
+    return {
+        "tweet_id": tweet_id,
+        "content": content,
+        "author_id": None if flags & FLAG_NO_AUTHOR else author_id,
+        "author_username": username,
+        "created_at": created_at,
+        "user_ids": ids.tolist()
+    }
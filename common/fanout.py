@@ -0,0 +1,46 @@
+"""
+Packed fan-out messages.
+
+Instead of one message per follower (each repeating the tweet body), the
+publisher groups followers by routing bucket (``follower_id % buckets``,
+the value of the consistent-hash ``routing_hash`` header) and sends one
+message per bucket per tweet carrying the tweet once plus the list of
+recipients::
+
+    {"tweet_id": ..., "content": ..., ..., "user_ids": [12, 37, ...]}
+
+Every follower in a bucket hashes to the same queue, so the worker that
+owns those users receives the whole list and applies it as one bulk write.
+Large buckets are split so a single message stays bounded.
+"""
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+
+def group_by_bucket(user_ids: Iterable[int], buckets: int) -> Dict[int, List[int]]:
+    """Group users by routing bucket"""
+    grouped = defaultdict(list)
+    for user_id in user_ids:
+        grouped[user_id % buckets].append(user_id)
+    return grouped
+
+
+def packed_fanout(user_ids: Iterable[int], buckets: int, max_ids: int) -> Iterator[Tuple[int, List[int]]]:
+    """Yield (bucket, user_ids) pairs, at most max_ids users per pair"""
+    max_ids = max(1, max_ids)
+    for bucket, bucket_ids in sorted(group_by_bucket(user_ids, buckets).items()):
+        for i in range(0, len(bucket_ids), max_ids):
+            yield bucket, bucket_ids[i:i + max_ids]
+
+
+def message_user_ids(data: Dict[str, Any]) -> List[int]:
+    """Recipients of a fan-out message (packed, or the older one-user format)"""
+    if "user_ids" in data:
+        return data["user_ids"]
+    return [data["user_id"]]
+
+
+def message_bucket(data: Dict[str, Any], buckets: int) -> int:
+    """Routing bucket of a fan-out message (the same for all its recipients)"""
+    user_ids = message_user_ids(data)
+    return user_ids[0] % buckets if user_ids else 0
@@ -0,0 +1,277 @@
+"""
+Asynchronous, debounced feed maintenance after subscription changes.
+
+Follow/unfollow endpoints only publish a subscription change to the
+``feed_rebuilds`` queue. A consumer running next to the feed workers holds
+each user's changes for ``feed_rebuild_debounce_ms`` and then applies them
+in one go:
+
+- a single change is reconciled incrementally: the author's tweets are
+  merged into the feed if the subscription still exists, removed otherwise;
+- several changes (e.g. a follow import) collapse into one rebuild_user_feed.
+
+Both outcomes are derived from the current subscriptions table, so the
+result does not depend on the order in which changes were delivered.
+Messages are acked only after their flush succeeded. A failed flush is
+retried in memory with backoff (``FEED_REBUILD_MAX_ATTEMPTS``), then its
+messages go back to the queue once; changes that fail again after that
+redelivery are dropped.
+
+The queue uses single-active-consumer: every worker process may subscribe,
+but only one receives changes at a time, which keeps all of a user's
+changes in the same coalescing window.
+"""
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import aio_pika
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .database import async_session_maker
+from .models import Subscription
+
+logger = logging.getLogger(__name__)
+
+FEED_REBUILD_QUEUE = "feed_rebuilds"
+FEED_REBUILD_QUEUE_ARGUMENTS = {"x-single-active-consumer": True}
+
+# Messages held in the coalescing window are unacked, so the prefetch bounds
+# how many changes one window can absorb
+FEED_REBUILD_PREFETCH = 1000
+
+# Flush attempts per delivery before the messages are returned to the queue;
+# attempt n waits max(debounce, 1s) * 2 ** (n - 1) after the previous one
+FEED_REBUILD_MAX_ATTEMPTS = 3
+
+
+async def declare_feed_rebuild_queue(channel: aio_pika.abc.AbstractChannel) -> aio_pika.abc.AbstractQueue:
+    return await channel.declare_queue(
+        FEED_REBUILD_QUEUE,
+        durable=True,
+        arguments=FEED_REBUILD_QUEUE_ARGUMENTS
+    )
+
+
+def subscription_change_message(user_id: int, author_id: int) -> aio_pika.Message:
+    """Message telling the consumer that user_id (un)followed author_id"""
+    return aio_pika.Message(
+        body=json.dumps({"user_id": user_id, "author_id": author_id}).encode(),
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+    )
+
+
+@dataclass
+class PendingChanges:
+    deadline: float
+    author_ids: Set[int] = field(default_factory=set)
+    messages: List[aio_pika.IncomingMessage] = field(default_factory=list)
+    attempts: int = 0
+
+
+class FeedRebuildConsumer:
+    """Consumes subscription changes and coalesces them per user"""
+
+    def __init__(self, debounce_ms: int = 2000):
+        self.debounce = debounce_ms / 1000
+        self.service_factory: Optional[Callable[[AsyncSession], Any]] = None
+        self.connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self.channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self.queue: Optional[aio_pika.abc.AbstractQueue] = None
+        self.consumer_tag: Optional[str] = None
+        self._pending: Dict[int, PendingChanges] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+
+        # Stats
+        self.changes = 0
+        self.changes_applied = 0
+        self.flushes = 0
+        self.rebuilds = 0
+        self.incremental = 0
+        self.failures = 0
+        self.requeued = 0
+        self.dropped = 0
+
+    async def start(self, service_factory: Callable[[AsyncSession], Any]):
+        """
+        Start consuming (no-op if already running). service_factory builds the
+        step's FeedService for a session.
+        """
+        async with self._start_lock:
+            if self._task and not self._task.done():
+                return
+            self.service_factory = service_factory
+
+            self.connection = await aio_pika.connect_robust(get_settings().rabbitmq_url)
+            self.channel = await self.connection.channel()
+            await self.channel.set_qos(prefetch_count=FEED_REBUILD_PREFETCH)
+            self.queue = await declare_feed_rebuild_queue(self.channel)
+            self.consumer_tag = await self.queue.consume(self.put)
+
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = 0.0):
+        """
+        Stop consuming. Changes held in coalescing windows are flushed early
+        for up to timeout seconds; the rest are redelivered after reconnect.
+        """
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if timeout > 0 and self._pending:
+            try:
+                await asyncio.wait_for(self._flush_all(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Feed rebuild drain timed out, {self.pending_changes} changes will be redelivered")
+        if self.connection:
+            await self.connection.close()
+        self.queue = self.channel = self.connection = None
+        self._pending.clear()
+
+    async def put(self, message: aio_pika.IncomingMessage):
+        """Add a change to its user's coalescing window"""
+        try:
+            data = json.loads(message.body.decode())
+            user_id, author_id = data["user_id"], data["author_id"]
+        except (ValueError, KeyError) as e:
+            logger.error(f"Dropping malformed subscription change: {e}")
+            await message.reject()
+            return
+
+        pending = self._pending.get(user_id)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = self._pending[user_id] = PendingChanges(loop.time() + self.debounce)
+        pending.author_ids.add(author_id)
+        pending.messages.append(message)
+        self.changes += 1
+
+    async def run(self):
+        """Flush users whose window expired until cancelled"""
+        loop = asyncio.get_running_loop()
+        tick = min(self.debounce, 0.1) or 0.01
+        while True:
+            await asyncio.sleep(tick)
+            now = loop.time()
+            for user_id in [u for u, p in self._pending.items() if p.deadline <= now]:
+                await self.flush_user(user_id, self._pending.pop(user_id))
+
+    async def _flush_all(self):
+        """Flush every user now, regardless of their window"""
+        while self._pending:
+            user_id = next(iter(self._pending))
+            await self.flush_user(user_id, self._pending.pop(user_id))
+
+    async def flush_user(self, user_id: int, pending: PendingChanges):
+        """Apply a user's coalesced changes and ack their messages"""
+        try:
+            async with async_session_maker() as db:
+                feed_service = self.service_factory(db)
+                if len(pending.author_ids) == 1:
+                    await self._reconcile_author(db, feed_service, user_id, next(iter(pending.author_ids)))
+                    self.incremental += 1
+                else:
+                    await feed_service.rebuild_user_feed(user_id)
+                    self.rebuilds += 1
+        except Exception as e:
+            self.failures += 1
+            pending.attempts += 1
+            if pending.attempts < FEED_REBUILD_MAX_ATTEMPTS:
+                logger.warning(f"Feed rebuild for user {user_id} failed (attempt {pending.attempts}), retrying: {e}")
+                self._retry_later(user_id, pending)
+                return
+
+            logger.error(f"Feed rebuild for user {user_id} failed after {pending.attempts} attempts: {e}")
+            for message in pending.messages:
+                if message.redelivered:
+                    self.dropped += 1
+                    await message.reject()
+                else:
+                    self.requeued += 1
+                    await message.nack(requeue=True)
+            return
+
+        self.flushes += 1
+        self.changes_applied += len(pending.messages)
+        for message in pending.messages:
+            await message.ack()
+
+    def _retry_later(self, user_id: int, pending: PendingChanges):
+        """Put failed changes back into the user's window with a backoff deadline"""
+        loop = asyncio.get_running_loop()
+        pending.deadline = loop.time() + max(self.debounce, 1.0) * 2 ** (pending.attempts - 1)
+        # Changes that arrived during the failed flush join the retry
+        current = self._pending.get(user_id)
+        if current:
+            pending.author_ids |= current.author_ids
+            pending.messages.extend(current.messages)
+        self._pending[user_id] = pending
+
+    async def _reconcile_author(self, db: AsyncSession, feed_service, user_id: int, author_id: int):
+        """Bring one author's tweets in the feed in line with the subscription state"""
+        result = await db.execute(
+            select(Subscription.id).filter(
+                and_(
+                    Subscription.follower_id == user_id,
+                    Subscription.followed_id == author_id
+                )
+            )
+        )
+        if result.scalar_one_or_none() is not None:
+            await feed_service.merge_author_into_feed(user_id, author_id)
+        else:
+            await feed_service.remove_author_from_feed(user_id, author_id)
+
+    @property
+    def pending_users(self) -> int:
+        return len(self._pending)
+
+    @property
+    def pending_changes(self) -> int:
+        return sum(len(p.messages) for p in self._pending.values())
+
+    @property
+    def coalescing_ratio(self) -> float:
+        """Subscription changes applied per feed update"""
+        return self.changes_applied / self.flushes if self.flushes else 0.0
+
+    async def queue_depth(self) -> int:
+        """Changes waiting in RabbitMQ (not yet delivered to this consumer)"""
+        if not self.channel:
+            return 0
+        queue = await self.channel.declare_queue(FEED_REBUILD_QUEUE, passive=True)
+        return queue.declaration_result.message_count
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": await self.queue_depth(),
+            "pending_users": self.pending_users,
+            "pending_changes": self.pending_changes,
+            "changes": self.changes,
+            "flushes": self.flushes,
+            "rebuilds": self.rebuilds,
+            "incremental": self.incremental,
+            "failures": self.failures,
+            "requeued": self.requeued,
+            "dropped": self.dropped,
+            "coalescing_ratio": round(self.coalescing_ratio, 2),
+            "debounce_ms": int(self.debounce * 1000)
+        }
+
+
+@lru_cache()
+def get_feed_rebuild_consumer() -> FeedRebuildConsumer:
+    return FeedRebuildConsumer(debounce_ms=get_settings().feed_rebuild_debounce_ms)
@@ -0,0 +1,254 @@
+"""
+Overflow spill and feed reconciliation.
+
+The step 5-6 worker queues are bounded (``x-max-length``) and expire
+messages (``x-message-ttl``), so during an incident RabbitMQ discards the
+oldest feed updates. Instead of vanishing, those messages are dead-lettered
+to the ``feed_spill`` exchange and queue (reason ``maxlen`` or ``expired``
+in the ``x-first-death-reason`` header).
+
+A consumer next to the feed workers folds spilled messages into the
+``feed_spill`` table: one row per recipient with the oldest tweet it missed
+(``since``) and the time of its last spill. Millions of dropped messages
+collapse into at most one row per user, and the messages are acked once the
+rows are committed.
+
+Reconciliation then claims users that have not spilled for
+``feed_spill_settle_seconds`` (so a user is rebuilt once, after the backlog,
+not on every drop) in batches with ``FOR UPDATE SKIP LOCKED`` and merges
+everything their followed authors (and they themselves) posted since the
+watermark with a few set-based statements per batch
+(``merge_followed_tweets``). Feeds are
+derived from the current subscriptions, so no message is replayed and the
+result does not depend on which messages were lost.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+import aio_pika
+from aio_pika import ExchangeType
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .database import async_session_maker
+from .event_codec import decode_event
+from .fanout import message_user_ids
+from .feed_writer import INSERT_CHUNK_SIZE
+from .models import FeedSpill
+
+logger = logging.getLogger(__name__)
+
+FEED_SPILL_EXCHANGE = "feed_spill"
+FEED_SPILL_QUEUE = "feed_spill"
+
+# Spilled messages are held unacked until their rows are committed
+FEED_SPILL_PREFETCH = 1000
+
+# Add to the arguments of every bounded worker queue
+SPILL_QUEUE_ARGUMENTS = {"x-dead-letter-exchange": FEED_SPILL_EXCHANGE}
+
+
+async def declare_spill_topology(channel: aio_pika.abc.AbstractChannel) -> aio_pika.abc.AbstractQueue:
+    """Declare the spill exchange and its (unbounded) queue"""
+    exchange = await channel.declare_exchange(FEED_SPILL_EXCHANGE, ExchangeType.FANOUT, durable=True)
+    queue = await channel.declare_queue(FEED_SPILL_QUEUE, durable=True)
+    await queue.bind(exchange)
+    return queue
+
+
+async def record_spill(db: AsyncSession, since_by_user: Dict[int, datetime]):
+    """
+    Fold users' missed tweets into feed_spill, keeping the oldest watermark.
+    The caller owns the transaction.
+    """
+    spilled_at = datetime.utcnow()
+    # Sorted, so concurrent consumers lock rows in the same order
+    rows = [
+        {"user_id": user_id, "since": since_by_user[user_id], "spilled_at": spilled_at}
+        for user_id in sorted(since_by_user)
+    ]
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        stmt = insert(FeedSpill).values(rows[i:i + INSERT_CHUNK_SIZE])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={
+                "since": func.least(FeedSpill.since, stmt.excluded.since),
+                "spilled_at": stmt.excluded.spilled_at
+            }
+        ))
+
+
+class SpillReconciler:
+    """Consumes spilled feed updates and reconciles the affected feeds"""
+
+    def __init__(self, batch_size: int = 500, interval: float = 1.0, settle_seconds: float = 30.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.settle = timedelta(seconds=settle_seconds)
+        self.service_factory: Optional[Callable[[AsyncSession], Any]] = None
+        self.connection: Optional[aio_pika.abc.AbstractRobustConnection] = None
+        self.channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self.queue: Optional[aio_pika.abc.AbstractQueue] = None
+        self.consumer_tag: Optional[str] = None
+        self._messages: List[aio_pika.IncomingMessage] = []
+        self._task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+
+        # Stats
+        self.spilled = Counter()  # messages by dead-letter reason
+        self.malformed = 0
+        self.reconciled_users = 0
+        self.batches = 0
+        self.failures = 0
+
+    async def start(self, service_factory: Callable[[AsyncSession], Any]):
+        """
+        Start consuming and reconciling (no-op if already running).
+        service_factory builds the step's FeedService for a session.
+        """
+        async with self._start_lock:
+            if self._task and not self._task.done():
+                return
+            self.service_factory = service_factory
+
+            self.connection = await aio_pika.connect_robust(
+                get_settings().rabbitmq_url,
+                client_properties={"connection_name": "feed_spill"}
+            )
+            self.channel = await self.connection.channel()
+            await self.channel.set_qos(prefetch_count=FEED_SPILL_PREFETCH)
+            self.queue = await declare_spill_topology(self.channel)
+            self.consumer_tag = await self.queue.consume(self.put)
+
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = 0.0):
+        """
+        Stop consuming. Spilled messages already received are recorded for up
+        to timeout seconds; the rest are redelivered after reconnect. A
+        reconciliation batch in progress is rolled back and claimed again later.
+        """
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if timeout > 0 and self._messages:
+            try:
+                await asyncio.wait_for(self.record_spilled(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Feed spill drain timed out, {len(self._messages)} messages will be redelivered")
+        if self.connection:
+            await self.connection.close()
+        self.queue = self.channel = self.connection = None
+        self._messages = []
+
+    async def put(self, message: aio_pika.IncomingMessage):
+        self._messages.append(message)
+
+    async def run(self):
+        """Record spilled messages and reconcile settled users until cancelled"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.record_spilled()
+                while await self.reconcile_batch() == self.batch_size:
+                    pass
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Feed spill reconciliation error: {e}")
+
+    async def record_spilled(self):
+        """Fold the spilled messages received so far into feed_spill and ack them"""
+        messages, self._messages = self._messages, []
+        if not messages:
+            return
+
+        since_by_user: Dict[int, datetime] = {}
+        reasons = Counter()
+        for message in messages:
+            try:
+                data = decode_event(message.body, message.content_type)
+                created_at = datetime.fromisoformat(data["created_at"])
+                user_ids = message_user_ids(data)
+            except Exception as e:
+                # Acked with the rest: there is nothing to reconcile it into
+                logger.error(f"Dropping malformed spilled message: {e}")
+                self.malformed += 1
+                continue
+            for user_id in user_ids:
+                since_by_user[user_id] = min(created_at, since_by_user.get(user_id, created_at))
+            reasons[(message.headers or {}).get("x-first-death-reason", "unknown")] += 1
+
+        try:
+            async with async_session_maker() as db:
+                await record_spill(db, since_by_user)
+                await db.commit()
+        except Exception:
+            await messages[-1].nack(multiple=True, requeue=True)
+            raise
+
+        # Delivery tags grow per channel, so this acks exactly the messages taken above
+        await messages[-1].ack(multiple=True)
+        self.spilled.update(reasons)
+
+    async def reconcile_batch(self) -> int:
+        """Claim and reconcile one batch of settled users. Returns the number claimed."""
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(FeedSpill.user_id, FeedSpill.since)
+                .where(FeedSpill.spilled_at <= datetime.utcnow() - self.settle)
+                .order_by(FeedSpill.spilled_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            since_by_user = dict(result.all())
+            if not since_by_user:
+                return 0
+
+            # Removed in the same transaction the feed service commits; a user
+            # spilling again meanwhile waits for the lock and gets a new row
+            await db.execute(delete(FeedSpill).where(FeedSpill.user_id.in_(since_by_user)))
+            await self.service_factory(db).reconcile_spilled_feeds(since_by_user)
+
+        self.batches += 1
+        self.reconciled_users += len(since_by_user)
+        return len(since_by_user)
+
+    async def pending(self) -> int:
+        """Users waiting for reconciliation"""
+        async with async_session_maker() as db:
+            result = await db.execute(select(func.count()).select_from(FeedSpill))
+            return result.scalar_one()
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {
+            "pending_users": await self.pending(),
+            "spilled": dict(self.spilled),
+            "malformed": self.malformed,
+            "reconciled_users": self.reconciled_users,
+            "batches": self.batches,
+            "failures": self.failures,
+            "settle_seconds": self.settle.total_seconds()
+        }
+
+
+@lru_cache()
+def get_spill_reconciler() -> SpillReconciler:
+    settings = get_settings()
+    return SpillReconciler(
+        batch_size=settings.feed_spill_batch_size,
+        interval=settings.feed_spill_interval_seconds,
+        settle_seconds=settings.feed_spill_settle_seconds
+    )
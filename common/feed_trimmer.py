@@ -0,0 +1,138 @@
+"""
+Amortized feed trimming.
+
+Feed writers no longer delete old rows inline. Instead the users whose
+feed_counts went over ``max_feed_size`` are marked dirty, and a background
+job trims dirty feeds in batches with a single window-function DELETE per
+batch, keeping the newest ``max_feed_size`` items of every user, and
+resynchronizes their feed_counts in the same transaction.
+"""
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .database import async_session_maker
+
+logger = logging.getLogger(__name__)
+
+TRIM_FEEDS_SQL = text("""
+    DELETE FROM feed_items f
+    USING (
+        SELECT id, user_id
+        FROM (
+            SELECT id, user_id,
+                   row_number() OVER (
+                       PARTITION BY user_id ORDER BY created_at DESC, id DESC
+                   ) AS rn
+            FROM feed_items
+            WHERE user_id = ANY(:user_ids)
+        ) ranked
+        WHERE rn > :max_feed_size
+    ) old
+    WHERE f.user_id = old.user_id AND f.id = old.id
+""")
+
+# Trimmed feeds hold at most max_feed_size rows, so recounting them is cheap
+# and also repairs any drift in feed_counts
+RECOUNT_FEEDS_SQL = text("""
+    UPDATE feed_counts c
+    SET item_count = (SELECT count(*) FROM feed_items f WHERE f.user_id = c.user_id)
+    WHERE c.user_id = ANY(:user_ids)
+""")
+
+
+class FeedTrimmer:
+    """Tracks feeds that may exceed max_feed_size and trims them in the background"""
+
+    def __init__(self, max_feed_size: int = 1000, interval: float = 5.0, batch_size: int = 500):
+        self.max_feed_size = max_feed_size
+        self.interval = interval
+        self.batch_size = batch_size
+        self._dirty: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.runs = 0
+        self.users_trimmed = 0
+        self.items_removed = 0
+
+    def mark_dirty(self, user_ids: Iterable[int]):
+        """Schedule users' feeds for trimming"""
+        self._dirty.update(user_ids)
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    async def trim_users(self, db: AsyncSession, user_ids: List[int]) -> int:
+        """Trim the given feeds in one statement. The caller owns the transaction."""
+        result = await db.execute(
+            TRIM_FEEDS_SQL,
+            {"user_ids": user_ids, "max_feed_size": self.max_feed_size}
+        )
+        await db.execute(RECOUNT_FEEDS_SQL, {"user_ids": user_ids})
+        return max(result.rowcount, 0)
+
+    async def trim_once(self) -> int:
+        """Trim one batch of dirty feeds. Returns the number of removed items."""
+        if not self._dirty:
+            return 0
+
+        user_ids = [self._dirty.pop() for _ in range(min(self.batch_size, len(self._dirty)))]
+        try:
+            async with async_session_maker() as db:
+                removed = await self.trim_users(db, user_ids)
+                await db.commit()
+        except Exception:
+            # Keep them dirty so the next run retries
+            self._dirty.update(user_ids)
+            raise
+
+        self.runs += 1
+        self.users_trimmed += len(user_ids)
+        self.items_removed += removed
+        return removed
+
+    async def run(self):
+        """Trim dirty feeds every `interval` seconds until cancelled"""
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                while self._dirty:
+                    removed = await self.trim_once()
+                    if removed:
+                        logger.info(f"Feed trimmer removed {removed} old feed items")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Feed trimmer error: {e}")
+
+    def start(self):
+        """Start the background job (no-op if already running)"""
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the background job"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+@lru_cache()
+def get_feed_trimmer() -> FeedTrimmer:
+    settings = get_settings()
+    return FeedTrimmer(
+        max_feed_size=settings.max_feed_size,
+        interval=settings.feed_trim_interval_seconds,
+        batch_size=settings.feed_trim_batch_size
+    )
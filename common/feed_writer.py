@@ -0,0 +1,243 @@
+"""
+Bulk write primitives for the feed_items table.
+
+Every FeedService variant funnels its feed writes through these helpers so a
+fan-out (or a feed rebuild) costs a handful of statements instead of one
+INSERT per row:
+
+- insert_feed_items: multi-row ``INSERT ... ON CONFLICT (user_id, tweet_id)
+  DO NOTHING`` in chunks, safe to replay thanks to ``uq_user_tweet``.
+- copy_feed_items: asyncpg COPY into a temporary staging table followed by a
+  single ``INSERT ... SELECT ... ON CONFLICT DO NOTHING``, used for very large
+  fan-outs where even multi-row VALUES become the bottleneck.
+- write_feed_items: picks one of the two based on the number of rows.
+- delete_author_feed_items: removes one author's tweets from a feed (unfollow).
+- merge_followed_tweets: merges everything the followed authors posted
+  since a per-user watermark into many feeds with one subscriptions query,
+  one tweets query per chunk of authors and a bulk write (reconciliation of
+  dropped fan-out messages).
+- missing_users: recipients that no longer exist, so a packed message that
+  hit a foreign key violation can be written without them.
+
+Inserted rows are returned (``RETURNING user_id, tweet_id``) and folded into
+the per-user feed_counts table in the same transaction, so the new feed size
+of every touched user is known without counting rows. Users that went over
+max_feed_size are handed to the background feed trimmer.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Sequence, Set, Tuple
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .feed_trimmer import get_feed_trimmer
+from .models import FeedCount, FeedItem, Subscription, Tweet, User
+
+# Rows per multi-row INSERT statement (3 bind params per row keeps us far
+# below the 32767 parameter limit of the PostgreSQL wire protocol)
+INSERT_CHUNK_SIZE = 1000
+
+# Fan-outs at least this large go through COPY instead of INSERT
+COPY_THRESHOLD = 5000
+
+FEED_COLUMNS = ("user_id", "tweet_id", "created_at")
+
+
+class FeedWriteResult(NamedTuple):
+    # (user_id, tweet_id) pairs that were actually inserted
+    inserted: List[Tuple[int, int]]
+    # Feed size after the write for every user that received new rows
+    feed_sizes: Dict[int, int]
+
+
+def feed_rows(user_ids: Sequence[int], tweet_id: int, created_at: datetime) -> List[Dict[str, Any]]:
+    """Build feed rows for one tweet delivered to many users"""
+    return [
+        {"user_id": user_id, "tweet_id": tweet_id, "created_at": created_at}
+        for user_id in user_ids
+    ]
+
+
+async def adjust_feed_counts(db: AsyncSession, deltas: Dict[int, int],
+                             chunk_size: int = INSERT_CHUNK_SIZE) -> Dict[int, int]:
+    """Add non-negative deltas to users' feed counts. Returns the new count per user."""
+    feed_sizes = {}
+    # Sorted, so concurrent writers lock count rows in the same order
+    items = [{"user_id": user_id, "item_count": delta} for user_id, delta in sorted(deltas.items()) if delta]
+    for i in range(0, len(items), chunk_size):
+        stmt = insert(FeedCount).values(items[i:i + chunk_size])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={"item_count": FeedCount.item_count + stmt.excluded.item_count}
+        ).returning(FeedCount.user_id, FeedCount.item_count)
+        result = await db.execute(stmt)
+        feed_sizes.update((user_id, item_count) for user_id, item_count in result.all())
+    return feed_sizes
+
+
+async def reset_feed_counts(db: AsyncSession, user_ids: Iterable[int]):
+    """Set users' feed counts to zero (after their feed_items were deleted)"""
+    items = [{"user_id": user_id, "item_count": 0} for user_id in user_ids]
+    if items:
+        stmt = insert(FeedCount).values(items)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={"item_count": 0}
+        ))
+
+
+async def _record_inserted(db: AsyncSession, inserted: List[Tuple[int, int]]) -> FeedWriteResult:
+    """Update feed counts for inserted rows and schedule oversized feeds for trimming"""
+    feed_sizes = await adjust_feed_counts(db, Counter(user_id for user_id, _ in inserted))
+
+    feed_trimmer = get_feed_trimmer()
+    feed_trimmer.mark_dirty(
+        user_id for user_id, size in feed_sizes.items() if size > feed_trimmer.max_feed_size
+    )
+    return FeedWriteResult(inserted, feed_sizes)
+
+
+async def insert_feed_items(db: AsyncSession, rows: Sequence[Dict[str, Any]],
+                            chunk_size: int = INSERT_CHUNK_SIZE) -> FeedWriteResult:
+    """
+    Insert feed rows with multi-row VALUES, skipping (user_id, tweet_id)
+    pairs that already exist. The caller owns the transaction.
+    """
+    inserted = []
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        result = await db.execute(
+            insert(FeedItem)
+            .values(list(chunk))
+            .on_conflict_do_nothing(index_elements=["user_id", "tweet_id"])
+            .returning(FeedItem.user_id, FeedItem.tweet_id)
+        )
+        inserted.extend(tuple(row) for row in result.all())
+    return await _record_inserted(db, inserted)
+
+
+async def copy_feed_items(db: AsyncSession, rows: Sequence[Dict[str, Any]]) -> FeedWriteResult:
+    """
+    Load feed rows through asyncpg COPY into a transaction-scoped staging
+    table, then merge them into feed_items in one statement.
+    The caller owns the transaction (the staging table is dropped on commit).
+    """
+    conn = await db.connection()
+    raw_connection = await conn.get_raw_connection()
+    asyncpg_connection = raw_connection.driver_connection
+
+    await db.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS feed_items_staging "
+        "(user_id integer, tweet_id integer, created_at timestamp) "
+        "ON COMMIT DROP"
+    ))
+    await asyncpg_connection.copy_records_to_table(
+        "feed_items_staging",
+        records=[tuple(row[column] for column in FEED_COLUMNS) for row in rows],
+        columns=list(FEED_COLUMNS),
+    )
+    result = await db.execute(text(
+        "INSERT INTO feed_items (user_id, tweet_id, created_at) "
+        "SELECT user_id, tweet_id, created_at FROM feed_items_staging "
+        "ON CONFLICT (user_id, tweet_id) DO NOTHING "
+        "RETURNING user_id, tweet_id"
+    ))
+    inserted = [tuple(row) for row in result.all()]
+    await db.execute(text("TRUNCATE feed_items_staging"))
+    return await _record_inserted(db, inserted)
+
+
+async def write_feed_items(db: AsyncSession, rows: Sequence[Dict[str, Any]],
+                           copy_threshold: int = COPY_THRESHOLD) -> FeedWriteResult:
+    """Write feed rows using COPY for large batches and INSERT otherwise"""
+    if not rows:
+        return FeedWriteResult([], {})
+    if len(rows) >= copy_threshold and db.get_bind().dialect.driver == "asyncpg":
+        return await copy_feed_items(db, rows)
+    return await insert_feed_items(db, rows)
+
+
+async def missing_users(db: AsyncSession, user_ids: Sequence[int]) -> Set[int]:
+    """Users among user_ids that do not exist (e.g. deleted after fan-out)"""
+    result = await db.execute(select(User.id).where(User.id.in_(set(user_ids))))
+    return set(user_ids) - {row[0] for row in result}
+
+
+async def delete_author_feed_items(db: AsyncSession, user_id: int, author_id: int) -> int:
+    """
+    Delete the author's tweets from a user's feed and adjust the feed count.
+    Returns the number of removed rows. The caller owns the transaction.
+    """
+    result = await db.execute(
+        delete(FeedItem)
+        .where(
+            FeedItem.user_id == user_id,
+            FeedItem.tweet_id.in_(select(Tweet.id).where(Tweet.author_id == author_id))
+        )
+        .returning(FeedItem.tweet_id)
+    )
+    removed = len(result.all())
+    if removed:
+        # Update only: a feed without a count row must not get a negative one
+        await db.execute(
+            update(FeedCount)
+            .where(FeedCount.user_id == user_id)
+            .values(item_count=func.greatest(FeedCount.item_count - removed, 0))
+        )
+    return removed
+
+
+async def merge_followed_tweets(db: AsyncSession, since_by_user: Dict[int, datetime],
+                                chunk_size: int = INSERT_CHUNK_SIZE) -> FeedWriteResult:
+    """
+    Merge the tweets of every author a user follows (and the user's own),
+    posted at or after that user's watermark, into the users' feeds.
+    Rows already in a feed are skipped. The caller owns the transaction.
+
+    Subscriptions and tweets are distributed on different columns, so they
+    are not joined: the followed authors are read first (by follower_id) and
+    their tweets are then filtered by author_id.
+    """
+    if not since_by_user:
+        return FeedWriteResult([], {})
+
+    authors_by_user = {user_id: {user_id} for user_id in since_by_user}
+    result = await db.execute(
+        select(Subscription.follower_id, Subscription.followed_id)
+        .where(Subscription.follower_id.in_(list(since_by_user)))
+    )
+    for follower_id, followed_id in result:
+        authors_by_user[follower_id].add(followed_id)
+
+    # Each author is read once, from the oldest watermark of their followers
+    since_by_author: Dict[int, datetime] = {}
+    for user_id, author_ids in authors_by_user.items():
+        for author_id in author_ids:
+            since = since_by_user[user_id]
+            since_by_author[author_id] = min(since, since_by_author.get(author_id, since))
+
+    tweets_by_author = defaultdict(list)
+    author_ids = sorted(since_by_author)
+    for i in range(0, len(author_ids), chunk_size):
+        chunk = author_ids[i:i + chunk_size]
+        result = await db.execute(
+            select(Tweet.author_id, Tweet.id, Tweet.created_at)
+            .where(
+                Tweet.author_id.in_(chunk),
+                Tweet.created_at >= min(since_by_author[author_id] for author_id in chunk)
+            )
+        )
+        for author_id, tweet_id, created_at in result:
+            if created_at >= since_by_author[author_id]:
+                tweets_by_author[author_id].append((tweet_id, created_at))
+
+    rows = [
+        {"user_id": user_id, "tweet_id": tweet_id, "created_at": created_at}
+        for user_id, author_ids in authors_by_user.items()
+        for author_id in author_ids
+        for tweet_id, created_at in tweets_by_author[author_id]
+        if created_at >= since_by_user[user_id]
+    ]
+    return await write_feed_items(db, rows)
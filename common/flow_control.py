@@ -0,0 +1,153 @@
+"""
+Consumer flow control for the feed workers.
+
+Every delivery a worker takes (or every micro-batch, in steps 5-6) needs a
+database session. Left alone, a burst turns the prefetch window into as many
+concurrent sessions, the SQLAlchemy pool runs dry and sessions time out
+waiting for a connection. Two controls keep that in check:
+
+- ``DbSlots``: a per-process semaphore sized to the connection pool
+  (``DB_POOL_SIZE``; the overflow connections stay free for the API and the
+  background consumers). Feed writes hold a slot for the lifetime of their
+  session.
+- ``AdaptivePrefetch``: an AIMD controller for the channel prefetch. While
+  the smoothed processing latency (including the wait for a slot) stays
+  under ``FEED_WORKER_TARGET_LATENCY_MS`` the prefetch grows by a constant
+  step per adjustment interval; once it exceeds the target the prefetch is
+  cut by a factor. Deliveries then queue in the broker, where they are
+  visible to admission control, instead of in the worker.
+"""
+import asyncio
+import logging
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from aio_pika.abc import AbstractChannel
+
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class DbSlots:
+    """Caps the number of feed-write sessions open at once in this process"""
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self.in_use = 0
+        self.waiting = 0
+        self.waits = 0
+
+    async def __aenter__(self):
+        if self._semaphore.locked():
+            self.waits += 1
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_use -= 1
+        self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "waits": self.waits
+        }
+
+
+@lru_cache()
+def get_db_slots() -> DbSlots:
+    return DbSlots(get_settings().db_pool_size)
+
+
+class AdaptivePrefetch:
+    """AIMD prefetch controller for one consumer channel"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, target_latency_ms: float,
+                 increase: int = 5, decrease: float = 0.5, interval: float = 1.0, name: str = "consumer"):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.prefetch = min(self.maximum, max(self.minimum, initial))
+        self.target = target_latency_ms / 1000
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self.name = name
+        self.channel: Optional[AbstractChannel] = None
+        self.latency: Optional[float] = None  # smoothed, seconds
+        self._last_adjust = 0.0
+
+        # Stats
+        self.increases = 0
+        self.decreases = 0
+
+    async def start(self, channel: AbstractChannel):
+        """Apply the initial prefetch to the consumer's channel"""
+        self.channel = channel
+        self._last_adjust = time.monotonic()
+        await self._apply()
+
+    async def observe(self, latency: float):
+        """Record the latency of one processed delivery (or batch) and adjust if due"""
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+        now = time.monotonic()
+        if now - self._last_adjust < self.interval:
+            return
+        self._last_adjust = now
+
+        if self.latency > self.target:
+            prefetch = max(self.minimum, int(self.prefetch * self.decrease))
+        else:
+            prefetch = min(self.maximum, self.prefetch + self.increase)
+        if prefetch == self.prefetch:
+            return
+
+        if prefetch > self.prefetch:
+            self.increases += 1
+        else:
+            self.decreases += 1
+            logger.info(
+                f"{self.name}: latency {self.latency * 1000:.0f}ms over target, "
+                f"prefetch {self.prefetch} -> {prefetch}"
+            )
+        self.prefetch = prefetch
+        await self._apply()
+
+    async def _apply(self):
+        if self.channel and not self.channel.is_closed:
+            # Channel-wide limit: unlike the per-consumer one, RabbitMQ also
+            # applies it to the consumer that is already running
+            await self.channel.set_qos(prefetch_count=self.prefetch, global_=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "prefetch": self.prefetch,
+            "prefetch_min": self.minimum,
+            "prefetch_max": self.maximum,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "target_latency_ms": round(self.target * 1000, 1),
+            "increases": self.increases,
+            "decreases": self.decreases
+        }
+
+
+def adaptive_prefetch(initial: int, name: str) -> AdaptivePrefetch:
+    """Prefetch controller configured from the FEED_WORKER_* settings"""
+    settings = get_settings()
+    return AdaptivePrefetch(
+        initial,
+        minimum=settings.feed_worker_prefetch_min,
+        maximum=settings.feed_worker_prefetch_max,
+        target_latency_ms=settings.feed_worker_target_latency_ms,
+        name=name
+    )
@@ -1,7 +1,7 @@
 import os
 from sqlalchemy import text
 from .database import sync_engine, Base
-from .models import User, Tweet, Subscription
+from .models import User, Tweet, Subscription, FeedItem, FeedCount, UserActivity
 
 
 def init_regular_postgres():
@@ -26,6 +26,10 @@ def init_citus():
     
     with sync_engine.connect() as conn:
         # Drop existing tables if they exist (for clean start)
+        conn.execute(text("DROP TABLE IF EXISTS feed_spill CASCADE"))
+        conn.execute(text("DROP TABLE IF EXISTS tweet_outbox CASCADE"))
+        conn.execute(text("DROP TABLE IF EXISTS user_activity CASCADE"))
+        conn.execute(text("DROP TABLE IF EXISTS feed_counts CASCADE"))
         conn.execute(text("DROP TABLE IF EXISTS feed_items CASCADE"))
         conn.execute(text("DROP TABLE IF EXISTS subscriptions CASCADE"))
         conn.execute(text("DROP TABLE IF EXISTS tweets CASCADE"))
@@ -54,6 +58,16 @@ def init_citus():
         # This ensures a user's feed is on the same shard as the user
         conn.execute(text("SELECT create_distributed_table('feed_items', 'user_id', colocate_with => 'users')"))
         
+        # Per-user feed size counters live next to the feed they count
+        conn.execute(text("SELECT create_distributed_table('feed_counts', 'user_id', colocate_with => 'users')"))
+        
+        # Feed read activity (dormancy policy) is sharded with the user
+        conn.execute(text("SELECT create_distributed_table('user_activity', 'user_id', colocate_with => 'users')"))
+        
+        # tweet_outbox and feed_spill stay local tables on the coordinator:
+        # the outbox relay and feed reconciliation claim their rows with
+        # FOR UPDATE SKIP LOCKED
+        
         # Create distributed indexes
         conn.execute(text("CREATE INDEX idx_users_username ON users(username)"))
         conn.execute(text("CREATE INDEX idx_tweets_created ON tweets(created_at DESC)"))
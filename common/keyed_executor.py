@@ -0,0 +1,108 @@
+"""
+Keyed executor: per-key ordering with parallelism across keys.
+
+Work is submitted with a key (a user id, or the routing bucket of a packed
+fan-out message) and runs on lane ``key % lanes``. Each lane is one asyncio
+task working through its queue in submission order, so two pieces of work
+for the same user never overlap or reorder, while different lanes run
+concurrently. Deliveries can then be processed in parallel without falling
+back to prefetch=1.
+
+One executor is shared per process, so the workers of different queues or
+lanes (step 6 fast/bulk) are serialized against each other as well. Work
+submitted to a lane must not itself wait on work submitted to the executor.
+"""
+import asyncio
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List
+
+from .config import get_settings
+
+
+class KeyedExecutor:
+    def __init__(self, lanes: int = 4):
+        self.lanes = max(1, lanes)
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+
+        # Stats
+        self.completed = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def start(self):
+        """Start the lane tasks (no-op if already running)"""
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.lanes)]
+        self._tasks = [asyncio.create_task(self._run_lane(queue)) for queue in self._queues]
+
+    async def stop(self):
+        """Cancel the lanes; work still queued is dropped with CancelledError"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for queue in self._queues:
+            while not queue.empty():
+                _, future = queue.get_nowait()
+                future.cancel()
+        self._tasks = []
+        self._queues = []
+
+    def lane_for(self, key: int) -> int:
+        return key % self.lanes
+
+    def submit(self, key: int, work: Callable[[], Awaitable[Any]]) -> "asyncio.Future[Any]":
+        """
+        Queue work behind everything already submitted for the same lane.
+        Returns a future with its result. Enqueuing does not yield, so work
+        submitted in order by one task runs in that order.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[self.lane_for(key)]
+        queue.put_nowait((work, future))
+        self.max_depth = max(self.max_depth, queue.qsize())
+        return future
+
+    async def run(self, key: int, work: Callable[[], Awaitable[Any]]) -> Any:
+        """Submit and wait for the result"""
+        return await self.submit(key, work)
+
+    async def join(self):
+        """Wait until everything submitted so far has run"""
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def _run_lane(self, queue: asyncio.Queue):
+        while True:
+            work, future = await queue.get()
+            try:
+                if not future.cancelled():
+                    result = await work()
+                    if not future.cancelled():
+                        future.set_result(result)
+                self.completed += 1
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "lanes": self.lanes,
+            "queued": [queue.qsize() for queue in self._queues],
+            "max_depth": self.max_depth,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+@lru_cache()
+def get_keyed_executor() -> KeyedExecutor:
+    return KeyedExecutor(get_settings().feed_worker_lanes)
+
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Index, UniqueConstraint
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Text, Boolean, Index, UniqueConstraint, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -71,4 +71,58 @@ class FeedItem(Base):
         UniqueConstraint('user_id', 'tweet_id', name='uq_user_tweet'),
         # Index for fast feed retrieval
         Index('idx_user_created', 'user_id', 'created_at'),
-    )
\ No newline at end of file
+    )
+
+
+class FeedCount(Base):
+    """
+    Number of feed_items rows per user, maintained in the same transaction
+    as feed inserts and trims so the feed size is an O(1) lookup.
+    """
+    __tablename__ = "feed_counts"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    item_count = Column(Integer, nullable=False, default=0)
+
+
+class UserActivity(Base):
+    """
+    Last time a user read their feed. Users without a recent read are
+    dormant: fan-out skips them and their feed is rebuilt on their next read.
+    """
+    __tablename__ = "user_activity"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_feed_read_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class TweetOutbox(Base):
+    """
+    Fan-out events of newly created tweets, written in the same transaction
+    as the tweet and deleted by the outbox relay once published.
+    """
+    __tablename__ = "tweet_outbox"
+
+    id = Column(BigInteger, primary_key=True)
+    tweet_id = Column(Integer, nullable=False)
+    author_id = Column(Integer, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Relay lease and failure bookkeeping (see common.outbox)
+    claimed_until = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    failed_at = Column(DateTime, nullable=True)
+
+
+class FeedSpill(Base):
+    """
+    Users whose fan-out messages were dropped by a worker queue (length limit
+    or TTL), with the oldest tweet they missed. Rows are folded in by the
+    spill consumer and deleted by the reconciliation job.
+    """
+    __tablename__ = "feed_spill"
+
+    user_id = Column(Integer, primary_key=True)
+    since = Column(DateTime, nullable=False)
+    spilled_at = Column(DateTime, nullable=False, default=datetime.utcnow)
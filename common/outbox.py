@@ -0,0 +1,250 @@
+"""
+Transactional outbox for tweet events.
+
+Creating a tweet used to commit the tweet and then publish its fan-out in a
+separate step of the request: a crash in between lost the fan-out, and the
+request waited for the follower query and the publishes. Now the tweet and
+its event are committed in one transaction (the event row lands in
+``tweet_outbox``) and the request returns. A relay running next to the feed
+workers claims events in batches with ``FOR UPDATE SKIP LOCKED`` (so any
+number of relays can run side by side) and leases them with
+``claimed_until`` in a short transaction, fans them out through the step's
+TweetService without holding row locks, then deletes the published ones in
+a second short transaction.
+
+A failed event is released with a backoff and stops the batch (the broker
+is likely unavailable); the events behind it are claimable right away, so
+one bad event does not block the outbox. After ``outbox_max_attempts``
+failures an event is parked (``failed_at``, ``last_error``) and no longer
+claimed; clear ``failed_at`` to retry it.
+
+Delivery is at-least-once: a relay that dies after publishing but before
+deleting leaves its events to be claimed again once their lease expires,
+which the idempotent feed writes absorb.
+
+On Citus, ``tweet_outbox`` stays a plain table on the coordinator: row
+locks with SKIP LOCKED need a single-node table, and it is written in the
+same (coordinated) transaction as the tweet.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import get_settings
+from .database import async_session_maker
+from .models import TweetOutbox
+from .publisher_pool import PublisherPool
+from .publishing import uses_publisher_confirms
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of the backoff before a failed event is claimed again
+MAX_RETRY_BACKOFF = timedelta(seconds=60)
+
+
+def tweet_event(tweet) -> Dict[str, Any]:
+    """Fan-out payload of a tweet (author relationship must be loaded)"""
+    return {
+        "tweet_id": tweet.id,
+        "content": tweet.content,
+        "author_id": tweet.author_id,
+        "author_username": tweet.author.username,
+        "created_at": tweet.created_at.isoformat()
+    }
+
+
+def outbox_entry(tweet) -> TweetOutbox:
+    """Outbox row to add in the transaction that creates the tweet"""
+    return TweetOutbox(tweet_id=tweet.id, author_id=tweet.author_id, payload=tweet_event(tweet))
+
+
+class OutboxRelay:
+    """Publishes outbox events in batches"""
+
+    def __init__(self, batch_size: int = 100, interval: float = 0.2,
+                 max_attempts: int = 5, claim_timeout_seconds: float = 60.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.claim_timeout = timedelta(seconds=claim_timeout_seconds)
+        self.service_factory: Optional[Callable[[AsyncSession, PublisherPool], Any]] = None
+        self.publisher_pool: Optional[PublisherPool] = None
+        self._task: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+        self._stopping = False
+
+        # Stats
+        self.batches = 0
+        self.published = 0
+        self.failures = 0
+        self.parked = 0
+
+    async def start(self, service_factory: Callable[[AsyncSession, PublisherPool], Any]):
+        """
+        Start relaying (no-op if already running). service_factory builds the
+        step's TweetService for a session and publisher pool.
+        """
+        async with self._start_lock:
+            if self._task and not self._task.done():
+                return
+            self.service_factory = service_factory
+            self._stopping = False
+
+            settings = get_settings()
+            self.publisher_pool = PublisherPool(
+                settings.rabbitmq_url,
+                size=1,
+                publisher_confirms=uses_publisher_confirms(settings.publisher_mode),
+                connection_name="outbox_relay"
+            )
+            await self.publisher_pool.start()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = 0.0):
+        """
+        Stop relaying. The batch being published gets up to timeout seconds
+        to finish; events of a cancelled batch are claimed again once their
+        lease expires.
+        """
+        if self._task:
+            self._stopping = True
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+        if self.publisher_pool:
+            await self.publisher_pool.close()
+            self.publisher_pool = None
+
+    async def run(self):
+        """Relay until stopped; sleeps only while the outbox is empty"""
+        while not self._stopping:
+            try:
+                relayed = await self.relay_batch()
+            except Exception as e:
+                logger.error(f"Outbox relay error: {e}")
+                relayed = 0
+            if relayed < self.batch_size and not self._stopping:
+                await asyncio.sleep(self.interval)
+
+    async def claim_batch(self) -> List[TweetOutbox]:
+        """Lease up to batch_size claimable events in one short transaction"""
+        now = datetime.utcnow()
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(TweetOutbox)
+                .where(
+                    TweetOutbox.failed_at.is_(None),
+                    or_(TweetOutbox.claimed_until.is_(None), TweetOutbox.claimed_until < now)
+                )
+                .order_by(TweetOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            entries = result.scalars().all()
+            if entries:
+                await db.execute(
+                    update(TweetOutbox)
+                    .where(TweetOutbox.id.in_([entry.id for entry in entries]))
+                    .values(claimed_until=now + self.claim_timeout)
+                )
+            await db.commit()
+            return entries
+
+    async def relay_batch(self) -> int:
+        """Claim, publish and delete one batch. Returns the number of events claimed."""
+        entries = await self.claim_batch()
+        if not entries:
+            return 0
+
+        published = []
+        failed, error = None, None
+        async with async_session_maker() as db:
+            service = self.service_factory(db, self.publisher_pool)
+            for entry in entries:
+                try:
+                    await service.publish_tweet_event(entry.payload)
+                except Exception as e:
+                    logger.error(f"Publishing outbox event {entry.id} (tweet {entry.tweet_id}) failed: {e}")
+                    self.failures += 1
+                    failed, error = entry, e
+                    break
+                published.append(entry.id)
+
+        async with async_session_maker() as db:
+            if published:
+                await db.execute(delete(TweetOutbox).where(TweetOutbox.id.in_(published)))
+            if failed is not None:
+                await self._record_failure(db, failed, error)
+            # Events after the failed one are released for the next round
+            unpublished = [entry.id for entry in entries if entry.id not in published and entry is not failed]
+            if unpublished:
+                await db.execute(
+                    update(TweetOutbox)
+                    .where(TweetOutbox.id.in_(unpublished))
+                    .values(claimed_until=None)
+                )
+            await db.commit()
+
+        self.batches += 1
+        self.published += len(published)
+        return len(entries)
+
+    async def _record_failure(self, db: AsyncSession, entry: TweetOutbox, error: Exception):
+        """Back off a failed event, or park it once it used up its attempts"""
+        attempts = entry.attempts + 1
+        values = {"attempts": attempts, "last_error": f"{type(error).__name__}: {error}"[:1000]}
+        if attempts >= self.max_attempts:
+            logger.error(f"Parking outbox event {entry.id} (tweet {entry.tweet_id}) after {attempts} attempts")
+            values["failed_at"] = datetime.utcnow()
+            self.parked += 1
+        else:
+            values["claimed_until"] = datetime.utcnow() + min(MAX_RETRY_BACKOFF, timedelta(seconds=2 ** attempts))
+        await db.execute(update(TweetOutbox).where(TweetOutbox.id == entry.id).values(**values))
+
+    async def pending(self) -> int:
+        """Events waiting in the outbox (parked ones excluded)"""
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(func.count()).select_from(TweetOutbox).where(TweetOutbox.failed_at.is_(None))
+            )
+            return result.scalar_one()
+
+    async def parked_events(self) -> int:
+        """Events that used up their attempts"""
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(func.count()).select_from(TweetOutbox).where(TweetOutbox.failed_at.isnot(None))
+            )
+            return result.scalar_one()
+
+    async def get_stats(self) -> Dict[str, Any]:
+        return {
+            "pending": await self.pending(),
+            "parked": await self.parked_events(),
+            "batches": self.batches,
+            "published": self.published,
+            "failures": self.failures,
+            "batch_size": self.batch_size
+        }
+
+
+@lru_cache()
+def get_outbox_relay() -> OutboxRelay:
+    settings = get_settings()
+    return OutboxRelay(
+        batch_size=settings.outbox_relay_batch_size,
+        interval=settings.outbox_relay_interval_seconds,
+        max_attempts=settings.outbox_max_attempts,
+        claim_timeout_seconds=settings.outbox_claim_timeout_seconds
+    )
@@ -0,0 +1,67 @@
+"""
+App-lifetime RabbitMQ publisher pool.
+
+Services used to open a connection, declare the whole topology, publish and
+close again for every tweet. The pool is created once in the FastAPI
+lifespan: it holds one robust connection and ``size`` channels, the
+topology is declared once at startup, and publishers check a channel out
+for the duration of a publish. Exchanges are looked up by name without a
+declare round trip, so a publish costs only the publish itself.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractRobustConnection
+
+
+class PublisherPool:
+    def __init__(self, url: str, size: int = 4, publisher_confirms: bool = True,
+                 connection_name: str = "publisher_pool"):
+        self.url = url
+        self.size = max(1, size)
+        self.publisher_confirms = publisher_confirms
+        self.connection_name = connection_name
+        self.connection: Optional[AbstractRobustConnection] = None
+        self._channels: asyncio.Queue = asyncio.Queue()
+
+        # Stats
+        self.checkouts = 0
+        self.waits = 0
+
+    async def start(self):
+        """Open the connection and all channels"""
+        self.connection = await aio_pika.connect_robust(
+            self.url,
+            client_properties={"connection_name": self.connection_name}
+        )
+        for _ in range(self.size):
+            channel = await self.connection.channel(publisher_confirms=self.publisher_confirms)
+            self._channels.put_nowait(channel)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AbstractChannel]:
+        """Check a channel out of the pool (waits if all are in use)"""
+        if self._channels.empty():
+            self.waits += 1
+        channel = await self._channels.get()
+        self.checkouts += 1
+        try:
+            yield channel
+        finally:
+            self._channels.put_nowait(channel)
+
+    @staticmethod
+    async def get_exchange(channel: AbstractChannel, name: str) -> AbstractExchange:
+        """Exchange handle for an already declared exchange (no round trip)"""
+        return await channel.get_exchange(name, ensure=False)
+
+    @property
+    def available(self) -> int:
+        return self._channels.qsize()
+
+    async def close(self):
+        if self.connection:
+            await self.connection.close()
+            self.connection = None
@@ -0,0 +1,66 @@
+"""
+Worker sharding on the consistent-hash exchange.
+
+Fan-out messages carry ``routing_hash = user_id % routing_shards`` in the
+header the exchange hashes on. With a large shard space (1024 by default)
+every worker queue owns many shards, so load spreads evenly whatever the
+number of queues, and all messages of one user always carry the same value
+and land on the same queue (per-user ordering).
+
+Changing the number of queues moves shards between queues. Messages already
+queued for a moved user must be applied before the ones that now arrive on
+its new queue, so queues are resized with a drain-and-rebind procedure:
+
+1. pause the consumers of every queue that will gain shards (new queues are
+   simply not consumed yet; when shrinking, all surviving queues gain);
+2. change the bindings;
+3. publish a barrier message straight to every queue that lost shards and
+   wait until its worker has processed it, i.e. everything queued before
+   the rebind has been applied;
+4. resume/start the gaining queues and drop the removed ones.
+"""
+import uuid
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
+
+REBALANCE_BARRIER = "rebalance_barrier"
+
+
+def routing_hash(user_id: int, shards: int) -> str:
+    """Value of the routing_hash header for a user"""
+    return str(user_id % shards)
+
+
+def new_barrier_id() -> str:
+    return f"barrier-{uuid.uuid4()}"
+
+
+def is_barrier(message: AbstractIncomingMessage) -> bool:
+    return message.type == REBALANCE_BARRIER
+
+
+async def publish_barrier(channel: AbstractChannel, queue_name: str, barrier_id: str):
+    """Append a barrier to a queue (bypassing the hash exchange)"""
+    await channel.default_exchange.publish(
+        aio_pika.Message(
+            body=b"",
+            type=REBALANCE_BARRIER,
+            message_id=barrier_id,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+        ),
+        routing_key=queue_name
+    )
+
+
+def plan_rebalance(current: int, target: int):
+    """
+    Queue indices (gaining, losing, added, removed) for resizing a lane from
+    `current` to `target` queues. Consistent hashing only moves shards to
+    added queues when growing and only away from removed queues when shrinking.
+    """
+    if target >= current:
+        added = list(range(current, target))
+        return added, list(range(current)), added, []
+    removed = list(range(target, current))
+    return list(range(target)), removed, [], removed
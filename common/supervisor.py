@@ -0,0 +1,227 @@
+"""
+Multi-process supervisor for feed workers.
+
+One asyncio event loop only ever uses one core, and decoding, ORM work and
+cache serialization in the feed workers are CPU bound. The supervisor
+starts N child processes, each running its own event loop with the workers
+for a fixed subset of the shard queues, so the queues are spread over the
+cores while every queue still has exactly one consumer.
+
+Children are started with the ``spawn`` method (no inherited event loop,
+engine or broker connections). A child that crashes is restarted with
+exponential backoff; each child counts processed messages into a shared
+counter that the supervisor turns into an aggregate throughput report.
+``resize`` changes the number of children at runtime (see
+``common.autoscaler``).
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from typing import Any, Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# A child that stayed up this long is considered healthy again
+HEALTHY_UPTIME_SECONDS = 60.0
+
+
+def shard_assignments(shards: Sequence[Any], processes: int) -> List[List[Any]]:
+    """Deal shards round-robin over at most len(shards) processes"""
+    processes = max(1, min(processes, len(shards)))
+    return [list(shards[i::processes]) for i in range(processes)]
+
+
+def rebalance_assignments(assignments: List[List[Any]], processes: int) -> List[List[Any]]:
+    """
+    Re-deal the shards of assignments over processes (at most one per shard),
+    keeping every shard that can stay on its current slot there
+    """
+    shards = [shard for assigned in assignments for shard in assigned]
+    processes = max(1, min(processes, len(shards)))
+    sizes = [len(shards) // processes + (1 if slot < len(shards) % processes else 0) for slot in range(processes)]
+
+    kept = [list(assignments[slot][:size]) if slot < len(assignments) else [] for slot, size in enumerate(sizes)]
+    spare = [
+        shard
+        for slot, assigned in enumerate(assignments)
+        for shard in (assigned[sizes[slot]:] if slot < processes else assigned)
+    ]
+    for assigned, size in zip(kept, sizes):
+        while len(assigned) < size:
+            assigned.append(spare.pop(0))
+    return kept
+
+
+async def report_progress(counter, get_count: Callable[[], int], interval: float = 1.0):
+    """Child side: publish this process's processed-message count to the supervisor"""
+    reported = 0
+    while True:
+        await asyncio.sleep(interval)
+        count = get_count()
+        with counter.get_lock():
+            counter.value += count - reported
+        reported = count
+
+
+class _Child:
+    def __init__(self, slot: int, shards: List[Any], counter):
+        self.slot = slot
+        self.shards = shards
+        self.counter = counter
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.failures = 0
+        self.restarts = 0
+        self.finished = False
+
+
+class WorkerSupervisor:
+    def __init__(self, target: Callable[[List[Any], Any], None], assignments: List[List[Any]],
+                 name: str = "feed-worker", report_interval: float = 10.0,
+                 restart_backoff: float = 1.0, max_restart_backoff: float = 30.0,
+                 stop_timeout: float = 30.0):
+        self.target = target
+        self.name = name
+        self.report_interval = report_interval
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        # Children drain on SIGTERM; they are killed after this long
+        self.stop_timeout = stop_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self.children = [
+            _Child(slot, shards, self._context.Value("q", 0))
+            for slot, shards in enumerate(assignments)
+        ]
+        # Processed counts of children retired by resize()
+        self._retired_processed = 0
+        self._stopping = False
+
+    def run(self, on_tick: Optional[Callable[[float], Any]] = None):
+        """
+        Start all children and supervise them until SIGINT/SIGTERM. on_tick is
+        called with the monotonic time on every pass (e.g. Autoscaler.tick).
+        """
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        for child in self.children:
+            self._start(child)
+
+        last_report = time.monotonic()
+        last_total = self.total_processed
+        try:
+            while not self._stopping and not all(child.finished for child in self.children):
+                time.sleep(0.5)
+                self._check_children()
+
+                now = time.monotonic()
+                if now - last_report >= self.report_interval:
+                    total = self.total_processed
+                    self._report(total - last_total, now - last_report)
+                    last_report, last_total = now, total
+
+                if on_tick:
+                    on_tick(now)
+        finally:
+            self._stop(self.children)
+
+    @property
+    def processes(self) -> int:
+        return len(self.children)
+
+    @property
+    def total_processed(self) -> int:
+        return self._retired_processed + sum(child.counter.value for child in self.children)
+
+    def resize(self, processes: int):
+        """
+        Run the shards on processes children. Only children whose shards
+        change are restarted; they drain and exit before their shards are
+        started elsewhere, so every shard keeps a single consumer.
+        """
+        assignments = rebalance_assignments([child.shards for child in self.children], processes)
+        changed = [
+            child for child in self.children
+            if child.slot >= len(assignments) or child.shards != assignments[child.slot]
+        ]
+        self._stop(changed)
+
+        for child in self.children[len(assignments):]:
+            self._retired_processed += child.counter.value
+        self.children = self.children[:len(assignments)]
+        for slot, shards in enumerate(assignments):
+            if slot == len(self.children):
+                self.children.append(_Child(slot, shards, self._context.Value("q", 0)))
+            elif self.children[slot] not in changed:
+                continue
+            child = self.children[slot]
+            child.shards = shards
+            child.restart_at = 0.0
+            child.failures = 0
+            child.finished = False
+            self._start(child)
+        logger.info(f"Resized to {len(self.children)} processes ({len(changed)} restarted)")
+
+    def _start(self, child: _Child):
+        child.process = self._context.Process(
+            target=self.target,
+            args=(child.shards, child.counter),
+            name=f"{self.name}-{child.slot}",
+            daemon=False
+        )
+        child.process.start()
+        child.started_at = time.monotonic()
+        logger.info(f"Started {child.process.name} (pid {child.process.pid}) for shards {child.shards}")
+
+    def _check_children(self):
+        now = time.monotonic()
+        for child in self.children:
+            if child.finished:
+                continue
+            if child.process.is_alive():
+                if child.failures and now - child.started_at >= HEALTHY_UPTIME_SECONDS:
+                    child.failures = 0
+                continue
+
+            if child.process.exitcode == 0 and not child.restart_at:
+                # Clean exit: the workers were stopped on purpose
+                child.finished = True
+                logger.info(f"{child.process.name} finished")
+            elif not child.restart_at:
+                child.failures += 1
+                delay = min(self.max_restart_backoff, self.restart_backoff * 2 ** (child.failures - 1))
+                child.restart_at = now + delay
+                logger.warning(
+                    f"{child.process.name} exited with code {child.process.exitcode}, "
+                    f"restarting in {delay:.1f}s"
+                )
+            elif now >= child.restart_at:
+                child.restart_at = 0.0
+                child.restarts += 1
+                self._start(child)
+
+    def _report(self, processed: int, elapsed: float):
+        alive = sum(1 for child in self.children if child.process.is_alive())
+        restarts = sum(child.restarts for child in self.children)
+        logger.info(
+            f"{processed / elapsed:.0f} msg/s across {alive}/{len(self.children)} processes "
+            f"({self.total_processed} total, {restarts} restarts)"
+        )
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def _stop(self, children: List[_Child]):
+        for child in children:
+            if child.process and child.process.is_alive():
+                child.process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for child in children:
+            if child.process:
+                child.process.join(max(0.0, deadline - time.monotonic()))
+                if child.process.is_alive():
+                    child.process.kill()
+                    child.process.join()
@@ -5,6 +5,8 @@ from typing import List
 from datetime import datetime
 from common.models import FeedItem as FeedItemModel, Tweet, Subscription, User
 from common.schemas import FeedItem
+from common.feed_writer import feed_rows, write_feed_items, reset_feed_counts, delete_author_feed_items
+from common.activity import record_feed_read, filter_active_users
 
 
 class FeedService:
@@ -17,6 +19,10 @@ class FeedService:
         Step 2: Get pre-computed feed from the feed_items table.
         Much faster than JOIN queries in Step 1.
         """
+        # Returning dormant users missed fan-out: rebuild their feed first
+        if await record_feed_read(self.db, user_id):
+            await self.rebuild_user_feed(user_id)
+        
         # Get feed items for the user with tweet and author data
         result = await self.db.execute(
             select(FeedItemModel)
@@ -57,44 +63,12 @@ class FeedService:
         # Add the author's own ID to update their feed too
         follower_ids.append(tweet.author_id)
         
-        # Create feed items for all followers
-        feed_items = []
-        for user_id in follower_ids:
-            feed_item = FeedItemModel(
-                user_id=user_id,
-                tweet_id=tweet.id,
-                created_at=tweet.created_at
-            )
-            feed_items.append(feed_item)
-        
-        # Bulk insert all feed items
-        self.db.add_all(feed_items)
-        await self.db.commit()
-        
-        # Clean up old feed items if needed
-        for user_id in follower_ids:
-            await self._cleanup_old_feed_items(user_id)
-
-    async def _cleanup_old_feed_items(self, user_id: int):
-        """Remove old feed items beyond max_feed_size"""
-        # Get the ID of the nth newest item
-        subquery = (
-            select(FeedItemModel.id)
-            .filter(FeedItemModel.user_id == user_id)
-            .order_by(desc(FeedItemModel.created_at))
-            .offset(self.max_feed_size)
-            .limit(1)
-            .scalar_subquery()
-        )
+        # Dormant users are skipped; their feed is rebuilt when they return
+        follower_ids = await filter_active_users(self.db, follower_ids)
         
-        # Delete items older than the nth item
-        await self.db.execute(
-            delete(FeedItemModel)
-            .filter(
-                FeedItemModel.user_id == user_id,
-                FeedItemModel.created_at < select(FeedItemModel.created_at).filter(FeedItemModel.id == subquery).scalar_subquery()
-            )
-        )
+        # Bulk insert feed items for all followers (multi-row INSERT / COPY);
+        # oversized feeds are trimmed later by the background trimming job
+        await write_feed_items(self.db, feed_rows(follower_ids, tweet.id, tweet.created_at))
         await self.db.commit()
 
     async def rebuild_user_feed(self, user_id: int):
@@ -106,6 +80,7 @@ class FeedService:
         await self.db.execute(
             delete(FeedItemModel).filter(FeedItemModel.user_id == user_id)
         )
+        await reset_feed_counts(self.db, [user_id])
         
         # Get users that this user follows
         result = await self.db.execute(
@@ -124,18 +99,36 @@ class FeedService:
         )
         tweets = result.scalars().all()
         
-        # Create new feed items
-        feed_items = [
-            FeedItemModel(
-                user_id=user_id,
-                tweet_id=tweet.id,
-                created_at=tweet.created_at
-            )
+        # Bulk insert new feed items
+        await write_feed_items(self.db, [
+            {"user_id": user_id, "tweet_id": tweet.id, "created_at": tweet.created_at}
             for tweet in tweets
-        ]
+        ])
         
-        # Bulk insert
-        if feed_items:
-            self.db.add_all(feed_items)
+        await self.db.commit()
+
+    async def merge_author_into_feed(self, user_id: int, author_id: int):
+        """
+        Merge a newly followed author's recent tweets into the user's feed.
+        Costs O(author's tweets) instead of a full rebuild.
+        """
+        result = await self.db.execute(
+            select(Tweet.id, Tweet.created_at)
+            .filter(Tweet.author_id == author_id)
+            .order_by(desc(Tweet.created_at))
+            .limit(self.max_feed_size)
+        )
+        feed_items = [
+            {"user_id": user_id, "tweet_id": tweet_id, "created_at": created_at}
+            for tweet_id, created_at in result
+        ]
         
-        await self.db.commit()
\ No newline at end of file
+        # Rows already in the feed are skipped; oversized feeds are trimmed
+        # later by the background trimming job
+        await write_feed_items(self.db, feed_items)
+        await self.db.commit()
+
+    async def remove_author_from_feed(self, user_id: int, author_id: int):
+        """Delete an unfollowed author's tweets from the user's feed"""
+        await delete_author_feed_items(self.db, user_id, author_id)
+        await self.db.commit()
@@ -32,9 +32,9 @@ class SubscriptionService:
         await self.db.commit()
         await self.db.refresh(subscription)
         
-        # Step 2: Rebuild follower's feed when they follow someone
+        # Merge only the new author's tweets into the follower's feed
         feed_service = FeedService(self.db)
-        await feed_service.rebuild_user_feed(follower_id)
+        await feed_service.merge_author_into_feed(follower_id, followed_id)
         
         return subscription
 
@@ -53,9 +53,9 @@ class SubscriptionService:
             await self.db.delete(subscription)
             await self.db.commit()
             
-            # Step 2: Rebuild follower's feed when they unfollow someone
+            # Remove only the unfollowed author's tweets from the feed
             feed_service = FeedService(self.db)
-            await feed_service.rebuild_user_feed(follower_id)
+            await feed_service.remove_author_from_feed(follower_id, followed_id)
             
             return True
         return False
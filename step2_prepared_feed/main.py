@@ -6,6 +6,7 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from common.database import engine
 from common.models import Base
+from common.feed_trimmer import get_feed_trimmer
 from app.api import users, tweets, subscriptions, feed
 
 @asynccontextmanager
@@ -13,8 +14,13 @@ async def lifespan(app: FastAPI):
     # Startup
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    
+    # Trim oversized feeds in the background instead of on every fan-out
+    feed_trimmer = get_feed_trimmer()
+    feed_trimmer.start()
     yield
     # Shutdown
+    await feed_trimmer.stop()
     await engine.dispose()
 
 
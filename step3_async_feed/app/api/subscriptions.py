@@ -1,11 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 from common.database import get_async_session
 from common.schemas import User, SubscriptionCreate
+from common.publisher_pool import PublisherPool
 from ..services.subscription_service import SubscriptionService
 from ..services.user_service import UserService
-from .tweets import get_current_user_id
+from .tweets import get_current_user_id, get_publisher_pool
 
 router = APIRouter()
 
@@ -14,7 +15,8 @@ router = APIRouter()
 async def follow_user(
     data: SubscriptionCreate,
     follower_id: int = Depends(get_current_user_id),
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    publisher_pool: Optional[PublisherPool] = Depends(get_publisher_pool)
 ):
     # Verify both users exist
     user_service = UserService(db)
@@ -24,7 +26,7 @@ async def follow_user(
     if not follower or not followed:
         raise HTTPException(status_code=404, detail="User not found")
     
-    service = SubscriptionService(db)
+    service = SubscriptionService(db, publisher_pool)
     subscription = await service.follow(follower_id, data.followed_id)
     
     if not subscription:
@@ -37,9 +39,10 @@ async def follow_user(
 async def unfollow_user(
     followed_id: int,
     follower_id: int = Depends(get_current_user_id),
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    publisher_pool: Optional[PublisherPool] = Depends(get_publisher_pool)
 ):
-    service = SubscriptionService(db)
+    service = SubscriptionService(db, publisher_pool)
     if not await service.unfollow(follower_id, followed_id):
         raise HTTPException(status_code=404, detail="Subscription not found")
     
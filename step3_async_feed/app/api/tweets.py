@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from common.database import get_async_session
 from common.schemas import Tweet, TweetCreate
+from common.publisher_pool import PublisherPool
 from ..services.tweet_service import TweetService
 from ..services.user_service import UserService
 
@@ -16,11 +17,17 @@ async def get_current_user_id(x_user_id: Optional[int] = Header(None)) -> int:
     return x_user_id
 
 
+def get_publisher_pool(request: Request) -> Optional[PublisherPool]:
+    """App-lifetime publisher pool created in the lifespan"""
+    return getattr(request.app.state, "publisher_pool", None)
+
+
 @router.post("/", response_model=Tweet)
 async def create_tweet(
     tweet_data: TweetCreate,
     user_id: int = Depends(get_current_user_id),
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    publisher_pool: Optional[PublisherPool] = Depends(get_publisher_pool)
 ):
     # Verify user exists
     user_service = UserService(db)
@@ -28,7 +35,7 @@ async def create_tweet(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    tweet_service = TweetService(db)
+    tweet_service = TweetService(db, publisher_pool)
     return await tweet_service.create_tweet(user_id, tweet_data)
 
 
@@ -2,12 +2,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_
 from typing import List, Optional
 from common.models import Subscription, User
-from .feed_service import FeedService
+from common.publisher_pool import PublisherPool
+from .rabbitmq_service import RabbitMQService
 
 
 class SubscriptionService:
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, publisher_pool: Optional[PublisherPool] = None):
         self.db = db
+        self.publisher_pool = publisher_pool
 
     async def follow(self, follower_id: int, followed_id: int) -> Optional[Subscription]:
         # Check if already following
@@ -32,9 +34,10 @@ class SubscriptionService:
         await self.db.commit()
         await self.db.refresh(subscription)
         
-        # Step 2: Rebuild follower's feed when they follow someone
-        feed_service = FeedService(self.db)
-        await feed_service.rebuild_user_feed(follower_id)
+        # Feed update happens in the background, coalesced per user
+        rabbitmq = RabbitMQService(self.publisher_pool)
+        await rabbitmq.publish_subscription_change(follower_id, followed_id)
+        await rabbitmq.close()
         
         return subscription
 
@@ -53,9 +56,10 @@ class SubscriptionService:
             await self.db.delete(subscription)
             await self.db.commit()
             
-            # Step 2: Rebuild follower's feed when they unfollow someone
-            feed_service = FeedService(self.db)
-            await feed_service.rebuild_user_feed(follower_id)
+            # Feed update happens in the background, coalesced per user
+            rabbitmq = RabbitMQService(self.publisher_pool)
+            await rabbitmq.publish_subscription_change(follower_id, followed_id)
+            await rabbitmq.close()
             
             return True
         return False
@@ -4,25 +4,27 @@ from sqlalchemy.orm import selectinload
 from typing import List, Optional
 from common.models import Tweet, User
 from common.schemas import TweetCreate
+from common.outbox import outbox_entry
+from common.publisher_pool import PublisherPool
 from .rabbitmq_service import RabbitMQService
 
 
 class TweetService:
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, publisher_pool: Optional[PublisherPool] = None):
         self.db = db
+        self.publisher_pool = publisher_pool
 
     async def create_tweet(self, user_id: int, tweet_data: TweetCreate) -> Tweet:
         """
-        Step 3: Create tweet and publish to RabbitMQ for async processing.
-        Non-blocking - returns immediately after publishing message.
+        Step 3: Create tweet and queue its event in the outbox, in one transaction.
+        Non-blocking - the outbox relay publishes the event to RabbitMQ.
         """
         tweet = Tweet(
             content=tweet_data.content,
             author_id=user_id
         )
         self.db.add(tweet)
-        await self.db.commit()
-        await self.db.refresh(tweet)
+        await self.db.flush()
         
         # Load author relationship
         result = await self.db.execute(
@@ -32,19 +34,17 @@ class TweetService:
         )
         tweet = result.scalar_one()
         
-        # Publish to RabbitMQ for async processing
-        rabbitmq = RabbitMQService()
-        await rabbitmq.publish_tweet_event({
-            "tweet_id": tweet.id,
-            "content": tweet.content,
-            "author_id": tweet.author_id,
-            "author_username": tweet.author.username,
-            "created_at": tweet.created_at.isoformat()
-        })
-        await rabbitmq.close()
+        self.db.add(outbox_entry(tweet))
+        await self.db.commit()
         
         return tweet
 
+    async def publish_tweet_event(self, event: dict):
+        """Publish an outbox event to RabbitMQ for async processing"""
+        rabbitmq = RabbitMQService(self.publisher_pool)
+        await rabbitmq.publish_tweet_event(event)
+        await rabbitmq.close()
+
     async def get_tweet(self, tweet_id: int) -> Optional[Tweet]:
         result = await self.db.execute(
             select(Tweet)
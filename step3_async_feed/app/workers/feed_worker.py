@@ -2,11 +2,18 @@ import asyncio
 import aio_pika
 import json
 import logging
+import time
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from common.database import async_session_maker
 from common.config import get_settings
+from common.feed_trimmer import get_feed_trimmer
+from common.feed_rebuilds import get_feed_rebuild_consumer
+from common.outbox import get_outbox_relay
+from common.flow_control import adaptive_prefetch, get_db_slots
+from common.draining import InFlight
 from ..services.feed_service import FeedService
+from ..services.tweet_service import TweetService
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -17,7 +24,10 @@ class FeedWorker:
         self.connection: Optional[aio_pika.Connection] = None
         self.channel: Optional[aio_pika.Channel] = None
         self.queue: Optional[aio_pika.Queue] = None
+        self.consumer_tag: Optional[str] = None
         self.running = False
+        self.in_flight = InFlight()
+        self.prefetch = adaptive_prefetch(10, "feed_worker")
 
     async def start(self):
         """Start the feed worker to consume messages from RabbitMQ"""
@@ -28,7 +38,7 @@ class FeedWorker:
             # Connect to RabbitMQ
             self.connection = await aio_pika.connect_robust(settings.rabbitmq_url)
             self.channel = await self.connection.channel()
-            await self.channel.set_qos(prefetch_count=10)
+            await self.prefetch.start(self.channel)
             
             # Declare exchange and queue
             exchange = await self.channel.declare_exchange(
@@ -44,8 +54,17 @@ class FeedWorker:
             
             await self.queue.bind(exchange, routing_key="new_tweet")
             
+            # Trim oversized feeds in the background (shared per process)
+            get_feed_trimmer().start()
+            
+            # Apply subscription changes in the background (shared per process)
+            await get_feed_rebuild_consumer().start(FeedService)
+            
+            # Publish committed tweet events from the outbox (shared per process)
+            await get_outbox_relay().start(TweetService)
+            
             # Start consuming messages
-            await self.queue.consume(self.process_message)
+            self.consumer_tag = await self.queue.consume(self.process_message)
             
             logger.info("Feed worker started successfully")
             
@@ -61,16 +80,18 @@ class FeedWorker:
 
     async def process_message(self, message: aio_pika.IncomingMessage):
         """Process a single message from the queue"""
-        async with message.process():
+        async with self.in_flight, message.process():
+            start_time = time.monotonic()
             try:
                 # Parse message
                 tweet_data = json.loads(message.body.decode())
                 logger.info(f"Processing tweet {tweet_data['tweet_id']} for feed updates")
                 
-                # Create database session
-                async with async_session_maker() as db:
-                    feed_service = FeedService(db)
-                    await feed_service.add_tweet_to_followers_feeds_async(tweet_data)
+                # Create database session (within the pool's capacity)
+                async with get_db_slots():
+                    async with async_session_maker() as db:
+                        feed_service = FeedService(db)
+                        await feed_service.add_tweet_to_followers_feeds_async(tweet_data)
                 
                 logger.info(f"Successfully processed tweet {tweet_data['tweet_id']}")
                 
@@ -78,18 +99,41 @@ class FeedWorker:
                 logger.error(f"Error processing message: {e}")
                 # In production, you might want to send to a dead letter queue
                 raise
+            finally:
+                await self.prefetch.observe(time.monotonic() - start_time)
+
+    def get_stats(self) -> dict:
+        """Current flow control limits"""
+        return {
+            **self.prefetch.get_stats(),
+            "db_slots": get_db_slots().get_stats(),
+            "in_flight": self.in_flight.count
+        }
 
-    async def stop(self):
-        """Stop the feed worker gracefully"""
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        Drain and stop: stop consuming, wait up to timeout (default
+        FEED_WORKER_DRAIN_TIMEOUT_SECONDS) for in-flight messages to be
+        applied and acked, then close.
+        """
         logger.info("Stopping feed worker...")
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
+        timeout = settings.feed_worker_drain_timeout_seconds if timeout is None else timeout
+        if not await self.in_flight.wait_idle(timeout):
+            logger.warning(f"Drain timed out, {self.in_flight.count} messages will be redelivered")
         self.running = False
         await self.cleanup()
 
     async def cleanup(self):
-        """Clean up resources"""
-        if self.queue:
-            await self.queue.cancel_consumer()
+        """Clean up resources (unacked deliveries return to the queue)"""
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
         if self.channel:
             await self.channel.close()
+            self.channel = None
         if self.connection:
-            await self.connection.close()
\ No newline at end of file
+            await self.connection.close()
+            self.connection = None
\ No newline at end of file
@@ -7,6 +7,11 @@ from contextlib import asynccontextmanager
 import asyncio
 from common.database import engine
 from common.models import Base
+from common.config import get_settings
+from common.publisher_pool import PublisherPool
+from common.feed_rebuilds import get_feed_rebuild_consumer
+from common.outbox import get_outbox_relay
+from common.draining import stop_background
 from app.api import users, tweets, subscriptions, feed
 from app.workers.feed_worker import FeedWorker
 from app.services.rabbitmq_service import RabbitMQService
@@ -29,6 +34,14 @@ async def lifespan(app: FastAPI):
     await rabbitmq.setup_exchanges()
     await rabbitmq.close()
     
+    # Long-lived publisher connection and channels shared by all requests
+    publisher_pool = PublisherPool(
+        get_settings().rabbitmq_url,
+        size=get_settings().publisher_pool_size
+    )
+    await publisher_pool.start()
+    app.state.publisher_pool = publisher_pool
+    
     # Start feed worker in background
     feed_worker = FeedWorker()
     worker_task = asyncio.create_task(feed_worker.start())
@@ -44,6 +57,9 @@ async def lifespan(app: FastAPI):
             await worker_task
         except asyncio.CancelledError:
             pass
+    # Let the background consumers finish what they hold
+    await stop_background(get_settings().feed_worker_drain_timeout_seconds)
+    await publisher_pool.close()
     await engine.dispose()
 
 
@@ -72,4 +88,22 @@ async def root():
             "Background feed worker",
             "Better write performance"
         ]
-    }
\ No newline at end of file
+    }
+
+
+@app.get("/worker/stats")
+async def worker_stats():
+    """Get feed worker prefetch and database slot limits"""
+    return feed_worker.get_stats() if feed_worker else {}
+
+
+@app.get("/feed-rebuilds/stats")
+async def feed_rebuilds_stats():
+    """Get rebuild queue depth and coalescing statistics"""
+    return await get_feed_rebuild_consumer().get_stats()
+
+
+@app.get("/outbox/stats")
+async def outbox_stats():
+    """Get outbox backlog and relay statistics"""
+    return await get_outbox_relay().get_stats()
@@ -5,6 +5,8 @@ from typing import List, Dict, Any
 from datetime import datetime
 from common.models import FeedItem as FeedItemModel, Tweet, Subscription, User
 from common.schemas import FeedItem
+from common.feed_writer import feed_rows, insert_feed_items, write_feed_items, reset_feed_counts, delete_author_feed_items
+from common.activity import record_feed_read
 
 
 class FeedService:
@@ -14,6 +16,10 @@ class FeedService:
 
     async def get_user_feed(self, user_id: int, skip: int = 0, limit: int = 20) -> List[FeedItem]:
         """Get pre-computed feed from the feed_items table"""
+        # Returning dormant users missed fan-out: rebuild their feed first
+        if await record_feed_read(self.db, user_id):
+            await self.rebuild_user_feed(user_id)
+        
         result = await self.db.execute(
             select(FeedItemModel)
             .options(
@@ -46,49 +52,10 @@ class FeedService:
         tweet_id = tweet_data["tweet_id"]
         created_at = datetime.fromisoformat(tweet_data["created_at"])
         
-        # Check if already exists (idempotency)
-        result = await self.db.execute(
-            select(FeedItemModel).filter(
-                FeedItemModel.user_id == user_id,
-                FeedItemModel.tweet_id == tweet_id
-            )
-        )
-        if result.scalar_one_or_none():
-            return  # Already processed
-        
-        # Add to user's feed
-        feed_item = FeedItemModel(
-            user_id=user_id,
-            tweet_id=tweet_id,
-            created_at=created_at
-        )
-        self.db.add(feed_item)
+        # Add to user's feed. Idempotency comes from the uq_user_tweet
+        # constraint: a redelivered message inserts (and returns) no row
+        await insert_feed_items(self.db, feed_rows([user_id], tweet_id, created_at))
         await self.db.commit()
-        
-        # Clean up old items
-        await self._cleanup_old_feed_items(user_id)
-
-    async def _cleanup_old_feed_items(self, user_id: int):
-        """Remove old feed items beyond max_feed_size"""
-        # Get the count of items
-        count_result = await self.db.execute(
-            select(FeedItemModel.id)
-            .filter(FeedItemModel.user_id == user_id)
-            .order_by(desc(FeedItemModel.created_at))
-            .offset(self.max_feed_size)
-            .limit(1)
-        )
-        oldest_to_keep_id = count_result.scalar_one_or_none()
-        
-        if oldest_to_keep_id:
-            await self.db.execute(
-                delete(FeedItemModel)
-                .filter(
-                    FeedItemModel.user_id == user_id,
-                    FeedItemModel.id < oldest_to_keep_id
-                )
-            )
-            await self.db.commit()
 
     async def rebuild_user_feed(self, user_id: int):
         """Rebuild a user's feed from scratch"""
@@ -96,6 +63,7 @@ class FeedService:
         await self.db.execute(
             delete(FeedItemModel).filter(FeedItemModel.user_id == user_id)
         )
+        await reset_feed_counts(self.db, [user_id])
         
         # Get users that this user follows
         result = await self.db.execute(
@@ -114,17 +82,37 @@ class FeedService:
         )
         tweets = result.scalars().all()
         
-        # Create new feed items
+        # Bulk insert new feed items
         feed_items = [
-            FeedItemModel(
-                user_id=user_id,
-                tweet_id=tweet.id,
-                created_at=tweet.created_at
-            )
+            {"user_id": user_id, "tweet_id": tweet.id, "created_at": tweet.created_at}
             for tweet in tweets
         ]
+        await write_feed_items(self.db, feed_items)
         
-        if feed_items:
-            self.db.add_all(feed_items)
+        await self.db.commit()
+
+    async def merge_author_into_feed(self, user_id: int, author_id: int):
+        """
+        Merge a newly followed author's recent tweets into the user's feed.
+        Costs O(author's tweets) instead of a full rebuild.
+        """
+        result = await self.db.execute(
+            select(Tweet.id, Tweet.created_at)
+            .filter(Tweet.author_id == author_id)
+            .order_by(desc(Tweet.created_at))
+            .limit(self.max_feed_size)
+        )
+        feed_items = [
+            {"user_id": user_id, "tweet_id": tweet_id, "created_at": created_at}
+            for tweet_id, created_at in result
+        ]
         
-        await self.db.commit()
\ No newline at end of file
+        # Rows already in the feed are skipped; oversized feeds are trimmed
+        # later by the background trimming job
+        await write_feed_items(self.db, feed_items)
+        await self.db.commit()
+
+    async def remove_author_from_feed(self, user_id: int, author_id: int):
+        """Delete an unfollowed author's tweets from the user's feed"""
+        await delete_author_feed_items(self.db, user_id, author_id)
+        await self.db.commit()
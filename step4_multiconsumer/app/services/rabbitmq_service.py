@@ -1,14 +1,18 @@
 import aio_pika
+from contextlib import asynccontextmanager
 from aio_pika import ExchangeType
 import json
 from typing import Dict, Any, Optional, List
 from common.config import get_settings
+from common.publisher_pool import PublisherPool
+from common.feed_rebuilds import FEED_REBUILD_QUEUE, declare_feed_rebuild_queue, subscription_change_message
 
 settings = get_settings()
 
 
 class RabbitMQService:
-    def __init__(self):
+    def __init__(self, pool: Optional[PublisherPool] = None):
+        self.pool = pool
         self.connection: Optional[aio_pika.Connection] = None
         self.channel: Optional[aio_pika.Channel] = None
         self.exchange: Optional[aio_pika.Exchange] = None
@@ -40,31 +44,53 @@ class RabbitMQService:
             # Bind with weight for consistent hash distribution
             await queue.bind(self.exchange, routing_key="20")
 
+        # Queue for subscription changes (feed rebuild consumer)
+        await declare_feed_rebuild_queue(self.channel)
+
+    @asynccontextmanager
+    async def _publishing_channel(self):
+        """Channel to publish on: checked out of the app pool, or a private connection"""
+        if self.pool:
+            async with self.pool.acquire() as channel:
+                yield channel
+        else:
+            if not self.exchange:
+                await self.connect()
+                await self.setup_exchanges()
+            yield self.channel
+
     async def publish_tweet_event_to_followers(self, tweet_data: Dict[str, Any], follower_ids: List[int]):
         """
         Step 4: Publish individual messages for each follower.
         This allows parallel processing by multiple workers.
         """
-        if not self.exchange:
-            await self.connect()
-            await self.setup_exchanges()
-        
-        # Publish a message for each follower
-        for follower_id in follower_ids:
-            message_data = {
-                **tweet_data,
-                "user_id": follower_id  # This will be used for routing
-            }
+        async with self._publishing_channel() as channel:
+            exchange = await PublisherPool.get_exchange(channel, "tweet_events_consistent")
             
-            message = aio_pika.Message(
-                body=json.dumps(message_data).encode(),
-                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                headers={"user_id": str(follower_id)}  # Routing key for consistent hash
-            )
-            
-            await self.exchange.publish(
-                message,
-                routing_key=str(follower_id % 100)  # Simple hash for routing
+            # Publish a message for each follower
+            for follower_id in follower_ids:
+                message_data = {
+                    **tweet_data,
+                    "user_id": follower_id  # This will be used for routing
+                }
+                
+                message = aio_pika.Message(
+                    body=json.dumps(message_data).encode(),
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    headers={"user_id": str(follower_id)}  # Routing key for consistent hash
+                )
+                
+                await exchange.publish(
+                    message,
+                    routing_key=str(follower_id % 100)  # Simple hash for routing
+                )
+
+    async def publish_subscription_change(self, user_id: int, author_id: int):
+        """Hand a follow/unfollow to the feed rebuild consumer"""
+        async with self._publishing_channel() as channel:
+            await channel.default_exchange.publish(
+                subscription_change_message(user_id, author_id),
+                routing_key=FEED_REBUILD_QUEUE
             )
 
     async def close(self):
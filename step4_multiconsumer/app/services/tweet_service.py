@@ -4,25 +4,28 @@ from sqlalchemy.orm import selectinload
 from typing import List, Optional
 from common.models import Tweet, User, Subscription
 from common.schemas import TweetCreate
+from common.activity import filter_active_users
+from common.outbox import outbox_entry
+from common.publisher_pool import PublisherPool
 from .rabbitmq_service import RabbitMQService
 
 
 class TweetService:
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, publisher_pool: Optional[PublisherPool] = None):
         self.db = db
+        self.publisher_pool = publisher_pool
 
     async def create_tweet(self, user_id: int, tweet_data: TweetCreate) -> Tweet:
         """
-        Step 4: Create tweet and publish individual messages for each follower.
-        This enables parallel processing by multiple workers.
+        Step 4: Create tweet and queue its event in the outbox, in one transaction.
+        The outbox relay fans it out as individual messages for each follower.
         """
         tweet = Tweet(
             content=tweet_data.content,
             author_id=user_id
         )
         self.db.add(tweet)
-        await self.db.commit()
-        await self.db.refresh(tweet)
+        await self.db.flush()
         
         # Load author relationship
         result = await self.db.execute(
@@ -32,29 +35,32 @@ class TweetService:
         )
         tweet = result.scalar_one()
         
+        self.db.add(outbox_entry(tweet))
+        await self.db.commit()
+        
+        return tweet
+
+    async def publish_tweet_event(self, event: dict):
+        """
+        Publish individual messages for each follower of an outbox event.
+        This enables parallel processing by multiple workers.
+        """
+        author_id = event["author_id"]
+        
         # Get all followers
         result = await self.db.execute(
             select(Subscription.follower_id)
-            .filter(Subscription.followed_id == user_id)
+            .filter(Subscription.followed_id == author_id)
         )
         follower_ids = [row[0] for row in result]
-        follower_ids.append(user_id)  # Include author
+        follower_ids.append(author_id)  # Include author
         
-        # Publish individual messages for each follower
-        rabbitmq = RabbitMQService()
-        await rabbitmq.publish_tweet_event_to_followers(
-            {
-                "tweet_id": tweet.id,
-                "content": tweet.content,
-                "author_id": tweet.author_id,
-                "author_username": tweet.author.username,
-                "created_at": tweet.created_at.isoformat()
-            },
-            follower_ids
-        )
-        await rabbitmq.close()
+        # Dormant users are skipped; their feed is rebuilt when they return
+        follower_ids = await filter_active_users(self.db, follower_ids)
         
-        return tweet
+        rabbitmq = RabbitMQService(self.publisher_pool)
+        await rabbitmq.publish_tweet_event_to_followers(event, follower_ids)
+        await rabbitmq.close()
 
     async def get_tweet(self, tweet_id: int) -> Optional[Tweet]:
         result = await self.db.execute(
@@ -3,11 +3,19 @@ import aio_pika
 import json
 import logging
 import sys
+import time
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from common.database import async_session_maker
 from common.config import get_settings
+from common.feed_trimmer import get_feed_trimmer
+from common.feed_rebuilds import get_feed_rebuild_consumer
+from common.outbox import get_outbox_relay
+from common.flow_control import adaptive_prefetch, get_db_slots
+from common.keyed_executor import get_keyed_executor
+from common.draining import InFlight
 from ..services.feed_service import FeedService
+from ..services.tweet_service import TweetService
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -19,7 +27,10 @@ class FeedWorker:
         self.connection: Optional[aio_pika.Connection] = None
         self.channel: Optional[aio_pika.Channel] = None
         self.queue: Optional[aio_pika.Queue] = None
+        self.consumer_tag: Optional[str] = None
         self.running = False
+        self.in_flight = InFlight()
+        self.prefetch = adaptive_prefetch(10, f"feed_worker_{worker_id}")
 
     async def start(self):
         """Start the feed worker to consume messages from its specific queue"""
@@ -30,7 +41,7 @@ class FeedWorker:
             # Connect to RabbitMQ
             self.connection = await aio_pika.connect_robust(settings.rabbitmq_url)
             self.channel = await self.connection.channel()
-            await self.channel.set_qos(prefetch_count=10)
+            await self.prefetch.start(self.channel)
             
             # Connect to specific worker queue
             self.queue = await self.channel.declare_queue(
@@ -38,8 +49,17 @@ class FeedWorker:
                 durable=True
             )
             
+            # Trim oversized feeds in the background (shared per process)
+            get_feed_trimmer().start()
+            
+            # Apply subscription changes in the background (shared per process)
+            await get_feed_rebuild_consumer().start(FeedService)
+            
+            # Publish committed tweet events from the outbox (shared per process)
+            await get_outbox_relay().start(TweetService)
+            
             # Start consuming messages
-            await self.queue.consume(self.process_message)
+            self.consumer_tag = await self.queue.consume(self.process_message)
             
             logger.info(f"Feed worker {self.worker_id} started successfully")
             
@@ -54,39 +74,65 @@ class FeedWorker:
             await self.cleanup()
 
     async def process_message(self, message: aio_pika.IncomingMessage):
+        """
+        Run the message on its user's executor lane: messages for one user
+        are applied in delivery order, different users in parallel.
+        """
+        user_id = int((message.headers or {}).get("user_id", 0))
+        async with self.in_flight:
+            await get_keyed_executor().run(user_id, lambda: self.handle_message(message))
+
+    async def handle_message(self, message: aio_pika.IncomingMessage):
         """Process a single message for a specific user"""
         async with message.process():
+            start_time = time.monotonic()
             try:
                 # Parse message
                 data = json.loads(message.body.decode())
                 user_id = data["user_id"]
                 logger.info(f"Worker {self.worker_id} processing tweet {data['tweet_id']} for user {user_id}")
                 
-                # Create database session
-                async with async_session_maker() as db:
-                    feed_service = FeedService(db)
-                    await feed_service.add_tweet_to_user_feed(data)
+                # Create database session (within the pool's capacity)
+                async with get_db_slots():
+                    async with async_session_maker() as db:
+                        feed_service = FeedService(db)
+                        await feed_service.add_tweet_to_user_feed(data)
                 
                 logger.info(f"Worker {self.worker_id} successfully processed for user {user_id}")
                 
             except Exception as e:
                 logger.error(f"Worker {self.worker_id} error processing message: {e}")
                 raise
+            finally:
+                await self.prefetch.observe(time.monotonic() - start_time)
 
-    async def stop(self):
-        """Stop the feed worker gracefully"""
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        Drain and stop: stop consuming, wait up to timeout (default
+        FEED_WORKER_DRAIN_TIMEOUT_SECONDS) for in-flight messages to be
+        applied and acked, then close.
+        """
         logger.info(f"Stopping feed worker {self.worker_id}...")
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
+        timeout = settings.feed_worker_drain_timeout_seconds if timeout is None else timeout
+        if not await self.in_flight.wait_idle(timeout):
+            logger.warning(f"Worker {self.worker_id} drain timed out, {self.in_flight.count} messages will be redelivered")
         self.running = False
         await self.cleanup()
 
     async def cleanup(self):
-        """Clean up resources"""
-        if self.queue:
-            await self.queue.cancel_consumer()
+        """Clean up resources (unacked deliveries return to the queue)"""
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
         if self.channel:
             await self.channel.close()
+            self.channel = None
         if self.connection:
             await self.connection.close()
+            self.connection = None
 
 
 async def main():
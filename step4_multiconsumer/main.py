@@ -8,6 +8,8 @@ import asyncio
 import multiprocessing
 from common.database import engine
 from common.models import Base
+from common.config import get_settings
+from common.publisher_pool import PublisherPool
 from app.api import users, tweets, subscriptions, feed
 from app.workers.feed_worker import FeedWorker
 from app.services.rabbitmq_service import RabbitMQService
@@ -27,6 +29,14 @@ async def lifespan(app: FastAPI):
     await rabbitmq.setup_exchanges()
     await rabbitmq.close()
     
+    # Long-lived publisher connection and channels shared by all requests
+    publisher_pool = PublisherPool(
+        get_settings().rabbitmq_url,
+        size=get_settings().publisher_pool_size
+    )
+    await publisher_pool.start()
+    app.state.publisher_pool = publisher_pool
+    
     # Note: In production, workers would run as separate processes
     # For demo purposes, we'll show the configuration
     print(f"Configured for {NUM_WORKERS} workers with consistent hash exchange")
@@ -34,6 +44,7 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    await publisher_pool.close()
     await engine.dispose()
 
 
@@ -13,6 +13,9 @@ sys.path.append(str(Path(__file__).parent.parent))
 
 import asyncio
 import logging
+import signal
+from common.config import get_settings
+from common.draining import stop_background
 from app.workers.feed_worker import FeedWorker
 
 logging.basicConfig(
@@ -31,11 +34,28 @@ async def main():
     
     worker = FeedWorker(worker_id)
     
-    try:
-        await worker.start()
-    except KeyboardInterrupt:
+    async def shutdown():
+        """Drain in-flight messages, then stop the background consumers"""
         print(f"\nShutting down worker {worker_id}...")
         await worker.stop()
+        await stop_background(get_settings().feed_worker_drain_timeout_seconds)
+    
+    shutdown_task = None
+    
+    def request_shutdown():
+        nonlocal shutdown_task
+        if shutdown_task is None:
+            shutdown_task = asyncio.create_task(shutdown())
+    
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, request_shutdown)
+    
+    await worker.start()
+    
+    # start() returns once the drain has stopped the worker
+    if shutdown_task:
+        await shutdown_task
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
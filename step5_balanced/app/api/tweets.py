@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from common.database import get_async_session
 from common.schemas import Tweet, TweetCreate
+from common.publisher_pool import PublisherPool
+from common.admission import ADMIT_ALL, AdmissionController, AdmissionRejected
 from ..services.tweet_service import TweetService
 from ..services.user_service import UserService
 
@@ -16,11 +18,23 @@ async def get_current_user_id(x_user_id: Optional[int] = Header(None)) -> int:
     return x_user_id
 
 
+def get_publisher_pool(request: Request) -> Optional[PublisherPool]:
+    """App-lifetime publisher pool created in the lifespan"""
+    return getattr(request.app.state, "publisher_pool", None)
+
+
+def get_admission(request: Request) -> Optional[AdmissionController]:
+    """Queue-depth admission control created in the lifespan"""
+    return getattr(request.app.state, "admission", None)
+
+
 @router.post("/", response_model=Tweet)
 async def create_tweet(
     tweet_data: TweetCreate,
     user_id: int = Depends(get_current_user_id),
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    publisher_pool: Optional[PublisherPool] = Depends(get_publisher_pool),
+    admission: Optional[AdmissionController] = Depends(get_admission)
 ):
     # Verify user exists
     user_service = UserService(db)
@@ -28,7 +42,20 @@ async def create_tweet(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    tweet_service = TweetService(db)
+    tweet_service = TweetService(db, publisher_pool)
+    
+    # Backpressure: refuse the write (before anything is stored) while the
+    # fan-out queues are too full to take it
+    if admission and admission.state != ADMIT_ALL:
+        try:
+            admission.check(await tweet_service.count_followers(user_id))
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=e.status_code,
+                detail=e.reason,
+                headers={"Retry-After": str(e.retry_after)}
+            )
+    
     return await tweet_service.create_tweet(user_id, tweet_data)
 
 
@@ -5,6 +5,9 @@ from typing import List, Dict, Any
 from datetime import datetime
 from common.models import FeedItem as FeedItemModel, Tweet, Subscription, User
 from common.schemas import FeedItem
+from common.feed_writer import feed_rows, insert_feed_items, write_feed_items, reset_feed_counts, delete_author_feed_items, merge_followed_tweets
+from common.fanout import message_user_ids
+from common.activity import record_feed_read
 from .metrics_service import MetricsService, track_time
 from prometheus_client import Counter, Histogram
 
@@ -24,6 +27,10 @@ class FeedService:
         """Get pre-computed feed with metrics tracking"""
         self.metrics.increment("feed.read.attempt")
         
+        # Returning dormant users missed fan-out: rebuild their feed first
+        if await record_feed_read(self.db, user_id):
+            await self.rebuild_user_feed(user_id)
+        
         result = await self.db.execute(
             select(FeedItemModel)
             .options(
@@ -62,70 +69,55 @@ class FeedService:
         # Track attempt
         self.metrics.increment("feed.update.attempt", tags={"user_id": user_id})
         
-        # Check for duplicate (idempotency)
-        result = await self.db.execute(
-            select(FeedItemModel).filter(
-                FeedItemModel.user_id == user_id,
-                FeedItemModel.tweet_id == tweet_id
-            )
-        )
-        if result.scalar_one_or_none():
+        # Add to feed. ON CONFLICT DO NOTHING ... RETURNING gives idempotency:
+        # no returned row means the update was already applied
+        write_result = await insert_feed_items(self.db, feed_rows([user_id], tweet_id, created_at))
+        await self.db.commit()
+        
+        if not write_result.inserted:
             self.metrics.increment("feed.update.duplicate")
             feed_update_counter.labels(status='duplicate').inc()
             return
         
-        # Add to feed
-        feed_item = FeedItemModel(
-            user_id=user_id,
-            tweet_id=tweet_id,
-            created_at=created_at
-        )
-        self.db.add(feed_item)
-        await self.db.commit()
-        
         # Track success
         self.metrics.increment("feed.update.success")
         feed_update_counter.labels(status='success').inc()
-        
-        # Clean up old items
-        await self._cleanup_old_feed_items(user_id)
+        self._track_feed_sizes(write_result.feed_sizes)
 
-    async def _cleanup_old_feed_items(self, user_id: int):
-        """Remove old feed items with metrics"""
-        # Count current items
-        count_result = await self.db.execute(
-            select(FeedItemModel.id)
-            .filter(FeedItemModel.user_id == user_id)
-        )
-        total_items = len(count_result.all())
-        
-        # Track feed size
-        feed_size_histogram.observe(total_items)
-        self.metrics.gauge("feed.size", total_items, {"user_id": user_id})
-        
-        if total_items > self.max_feed_size:
-            # Get oldest item to keep
-            oldest_result = await self.db.execute(
-                select(FeedItemModel.id)
-                .filter(FeedItemModel.user_id == user_id)
-                .order_by(desc(FeedItemModel.created_at))
-                .offset(self.max_feed_size)
-                .limit(1)
-            )
-            oldest_to_keep_id = oldest_result.scalar_one_or_none()
-            
-            if oldest_to_keep_id:
-                # Delete old items
-                deleted = await self.db.execute(
-                    delete(FeedItemModel)
-                    .filter(
-                        FeedItemModel.user_id == user_id,
-                        FeedItemModel.id < oldest_to_keep_id
-                    )
-                )
-                await self.db.commit()
-                
-                self.metrics.increment("feed.cleanup.items_removed", deleted.rowcount)
+    @track_time("feed.add_tweets_batch")
+    async def add_tweets_to_user_feeds(self, batch: List[Dict[str, Any]]):
+        """
+        Step 5: Apply a batch of fan-out messages (each carrying a tweet and
+        its recipients) in one transaction.
+        Duplicates are skipped by the (user_id, tweet_id) unique constraint.
+        """
+        rows = []
+        for data in batch:
+            rows.extend(feed_rows(
+                message_user_ids(data), data["tweet_id"], datetime.fromisoformat(data["created_at"])
+            ))
+
+        write_result = await write_feed_items(self.db, rows)
+        await self.db.commit()
+
+        # Track results
+        inserted = len(write_result.inserted)
+        duplicates = len(rows) - inserted
+        self.metrics.increment("feed.update.success", inserted)
+        feed_update_counter.labels(status='success').inc(inserted)
+        if duplicates:
+            self.metrics.increment("feed.update.duplicate", duplicates)
+            feed_update_counter.labels(status='duplicate').inc(duplicates)
+        self._track_feed_sizes(write_result.feed_sizes)
+
+    def _track_feed_sizes(self, feed_sizes: Dict[int, int]):
+        """
+        Record feed size metrics from the feed_counts values returned by the
+        write (no rows are counted). Trimming is scheduled by the feed writer.
+        """
+        for user_id, total_items in feed_sizes.items():
+            feed_size_histogram.observe(total_items)
+            self.metrics.gauge("feed.size", total_items, {"user_id": user_id})
 
     @track_time("feed.rebuild")
     async def rebuild_user_feed(self, user_id: int):
@@ -136,6 +128,7 @@ class FeedService:
         await self.db.execute(
             delete(FeedItemModel).filter(FeedItemModel.user_id == user_id)
         )
+        await reset_feed_counts(self.db, [user_id])
         
         # Get followed users
         result = await self.db.execute(
@@ -154,20 +147,58 @@ class FeedService:
         )
         tweets = result.scalars().all()
         
-        # Create new feed items
+        # Bulk insert new feed items
         feed_items = [
-            FeedItemModel(
-                user_id=user_id,
-                tweet_id=tweet.id,
-                created_at=tweet.created_at
-            )
+            {"user_id": user_id, "tweet_id": tweet.id, "created_at": tweet.created_at}
             for tweet in tweets
         ]
-        
-        if feed_items:
-            self.db.add_all(feed_items)
+        await write_feed_items(self.db, feed_items)
         
         await self.db.commit()
         
         self.metrics.increment("feed.rebuild.success")
-        self.metrics.gauge("feed.rebuild.items", len(feed_items))
\ No newline at end of file
+        self.metrics.gauge("feed.rebuild.items", len(feed_items))
+
+    @track_time("feed.merge_author")
+    async def merge_author_into_feed(self, user_id: int, author_id: int):
+        """
+        Merge a newly followed author's recent tweets into the user's feed.
+        Costs O(author's tweets) instead of a full rebuild.
+        """
+        result = await self.db.execute(
+            select(Tweet.id, Tweet.created_at)
+            .filter(Tweet.author_id == author_id)
+            .order_by(desc(Tweet.created_at))
+            .limit(self.max_feed_size)
+        )
+        feed_items = [
+            {"user_id": user_id, "tweet_id": tweet_id, "created_at": created_at}
+            for tweet_id, created_at in result
+        ]
+        
+        # Rows already in the feed are skipped; oversized feeds are trimmed
+        # later by the background trimming job
+        write_result = await write_feed_items(self.db, feed_items)
+        await self.db.commit()
+        
+        self.metrics.increment("feed.merge_author.items", len(write_result.inserted))
+
+    @track_time("feed.remove_author")
+    async def remove_author_from_feed(self, user_id: int, author_id: int):
+        """Delete an unfollowed author's tweets from the user's feed"""
+        removed = await delete_author_feed_items(self.db, user_id, author_id)
+        await self.db.commit()
+        
+        self.metrics.increment("feed.remove_author.items", removed)
+
+    @track_time("feed.reconcile_spilled")
+    async def reconcile_spilled_feeds(self, since_by_user: Dict[int, datetime]):
+        """
+        Merge everything the users' followed authors posted since their
+        watermark into their feeds (fan-out messages for them were dropped)
+        """
+        write_result = await merge_followed_tweets(self.db, since_by_user)
+        await self.db.commit()
+        
+        self.metrics.increment("feed.reconcile_spilled.users", len(since_by_user))
+        self.metrics.increment("feed.reconcile_spilled.items", len(write_result.inserted))
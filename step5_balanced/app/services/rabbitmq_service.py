@@ -1,15 +1,30 @@
 import aio_pika
+from contextlib import asynccontextmanager
 from aio_pika import ExchangeType
-import json
 from typing import Dict, Any, Optional, List
 from common.config import get_settings
+from common.publisher_pool import PublisherPool
+from common.fanout import packed_fanout
+from common.event_codec import encode_event
+from common.publishing import publish_batch, uses_publisher_confirms
+from common.feed_rebuilds import FEED_REBUILD_QUEUE, declare_feed_rebuild_queue, subscription_change_message
+from common.feed_spill import SPILL_QUEUE_ARGUMENTS, declare_spill_topology
 from .metrics_service import MetricsService, track_time
 
 settings = get_settings()
 
+# Worker queues drop their oldest messages beyond this length (to feed_spill)
+QUEUE_MAX_LENGTH = 100000
+
+
+def worker_queue_limits() -> Dict[str, int]:
+    """Length limit of every worker queue, by name (for admission control)"""
+    return {f"feed_updates_balanced_{i}": QUEUE_MAX_LENGTH for i in range(settings.feed_worker_queues)}
+
 
 class RabbitMQService:
-    def __init__(self):
+    def __init__(self, pool: Optional[PublisherPool] = None):
+        self.pool = pool
         self.connection: Optional[aio_pika.Connection] = None
         self.channel: Optional[aio_pika.Channel] = None
         self.exchange: Optional[aio_pika.Exchange] = None
@@ -18,7 +33,10 @@ class RabbitMQService:
     async def connect(self):
         """Connect to RabbitMQ"""
         self.connection = await aio_pika.connect_robust(settings.rabbitmq_url)
-        self.channel = await self.connection.channel()
+        # Confirm-mode and transactional publishing need differently configured channels
+        self.channel = await self.connection.channel(
+            publisher_confirms=uses_publisher_confirms(settings.publisher_mode)
+        )
         await self.channel.set_qos(prefetch_count=10)
 
     async def setup_exchanges(self):
@@ -34,65 +52,90 @@ class RabbitMQService:
             }
         )
         
-        # Create queues with optimized bindings
-        num_workers = 4
+        # Create queues with optimized bindings (one per worker process)
+        num_workers = settings.feed_worker_queues
         for i in range(num_workers):
             queue = await self.channel.declare_queue(
                 f"feed_updates_balanced_{i}",
                 durable=True,
                 arguments={
-                    "x-max-length": 100000,  # Limit queue size
-                    "x-message-ttl": 3600000  # 1 hour TTL
+                    "x-max-length": QUEUE_MAX_LENGTH,  # Limit queue size
+                    "x-message-ttl": 3600000,  # 1 hour TTL
+                    **SPILL_QUEUE_ARGUMENTS  # Dropped and expired messages are reconciled
                 }
             )
             
-            # Bind with weight 20 for better distribution
-            await queue.bind(self.exchange, routing_key="20")
+            # Equal weights: every queue owns the same share of the hash ring
+            await queue.bind(self.exchange, routing_key=str(settings.routing_binding_weight))
+
+        # Queue for subscription changes (feed rebuild consumer)
+        await declare_feed_rebuild_queue(self.channel)
+
+        # Overflow of the worker queues (spill reconciler)
+        await declare_spill_topology(self.channel)
+
+    @asynccontextmanager
+    async def _publishing_channel(self):
+        """Channel to publish on: checked out of the app pool, or a private connection"""
+        if self.pool:
+            async with self.pool.acquire() as channel:
+                yield channel
+        else:
+            if not self.exchange:
+                await self.connect()
+                await self.setup_exchanges()
+            yield self.channel
 
     @track_time("rabbitmq.publish_batch")
     async def publish_tweet_event_batch(self, tweet_data: Dict[str, Any], follower_ids: List[int]):
         """
         Step 5: Optimized batch publishing with metrics
         """
-        if not self.exchange:
-            await self.connect()
-            await self.setup_exchanges()
-        
         # Track metrics
         self.metrics.increment("tweets.published")
         self.metrics.gauge("tweets.fanout_size", len(follower_ids))
         
-        # Batch messages for better performance
+        # One message per routing shard carrying the tweet once and the
+        # followers in that shard (all of them hash to the same queue)
         messages = []
-        for follower_id in follower_ids:
-            message_data = {
-                **tweet_data,
-                "user_id": follower_id
-            }
-            
-            # Use optimized routing hash
-            routing_hash = str(follower_id % 20)  # Better distribution
+        for bucket, user_ids in packed_fanout(follower_ids, settings.routing_shards, settings.fanout_max_user_ids_per_message):
+            routing_hash = str(bucket)
+            body, content_type = encode_event({**tweet_data, "user_ids": user_ids}, settings.fanout_message_format)
             
             message = aio_pika.Message(
-                body=json.dumps(message_data).encode(),
+                body=body,
+                content_type=content_type,
                 delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
                 headers={
-                    "routing_hash": routing_hash,
-                    "user_id": str(follower_id)
+                    "routing_hash": routing_hash
                 }
             )
             messages.append((message, routing_hash))
+        self.metrics.gauge("tweets.fanout_messages", len(messages))
         
-        # Publish in batches
-        batch_size = 100
-        for i in range(0, len(messages), batch_size):
-            batch = messages[i:i + batch_size]
-            async with self.channel.transaction():
-                for message, routing_key in batch:
-                    await self.exchange.publish(message, routing_key=routing_key)
+        # Publish pipelined with confirms (or in transactions of 100)
+        async with self._publishing_channel() as channel:
+            exchange = await PublisherPool.get_exchange(channel, "tweet_events_balanced")
+            with self.metrics.timer(f"rabbitmq.publish.{settings.publisher_mode}"):
+                await publish_batch(
+                    channel,
+                    [(exchange, message, routing_key) for message, routing_key in messages],
+                    settings.publisher_mode,
+                    batch_size=100,
+                    window=settings.publisher_confirm_window
+                )
             
             self.metrics.increment("rabbitmq.batch_published")
 
+    async def publish_subscription_change(self, user_id: int, author_id: int):
+        """Hand a follow/unfollow to the feed rebuild consumer"""
+        async with self._publishing_channel() as channel:
+            await publish_batch(
+                channel,
+                [(channel.default_exchange, subscription_change_message(user_id, author_id), FEED_REBUILD_QUEUE)],
+                settings.publisher_mode
+            )
+
     async def close(self):
         """Close RabbitMQ connection"""
         if self.connection:
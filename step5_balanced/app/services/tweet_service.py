@@ -1,9 +1,12 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, func
 from sqlalchemy.orm import selectinload
 from typing import List, Optional
 from common.models import Tweet, User, Subscription
 from common.schemas import TweetCreate
+from common.activity import filter_active_users
+from common.outbox import outbox_entry
+from common.publisher_pool import PublisherPool
 from .rabbitmq_service import RabbitMQService
 from .metrics_service import MetricsService, track_time
 from prometheus_client import Counter
@@ -13,14 +16,16 @@ tweet_counter = Counter('tweets_created_total', 'Total number of tweets created'
 
 
 class TweetService:
-    def __init__(self, db: AsyncSession):
+    def __init__(self, db: AsyncSession, publisher_pool: Optional[PublisherPool] = None):
         self.db = db
+        self.publisher_pool = publisher_pool
         self.metrics = MetricsService()
 
     @track_time("tweet.create")
     async def create_tweet(self, user_id: int, tweet_data: TweetCreate) -> Tweet:
         """
-        Step 5: Create tweet with full monitoring and optimized publishing
+        Step 5: Create tweet and queue its event in the outbox, in one transaction.
+        The outbox relay publishes the fan-out with optimized batch processing.
         """
         # Track metrics
         self.metrics.increment("tweet.create.attempt")
@@ -31,8 +36,7 @@ class TweetService:
             author_id=user_id
         )
         self.db.add(tweet)
-        await self.db.commit()
-        await self.db.refresh(tweet)
+        await self.db.flush()
         
         # Load author relationship
         result = await self.db.execute(
@@ -42,34 +46,44 @@ class TweetService:
         )
         tweet = result.scalar_one()
         
+        self.db.add(outbox_entry(tweet))
+        await self.db.commit()
+        
+        self.metrics.increment("tweet.create.success")
+        return tweet
+
+    @track_time("tweet.publish")
+    async def publish_tweet_event(self, event: dict):
+        """Fan an outbox event out to the author's active followers"""
+        author_id = event["author_id"]
+        
         # Get followers count for metrics
         result = await self.db.execute(
             select(Subscription.follower_id)
-            .filter(Subscription.followed_id == user_id)
+            .filter(Subscription.followed_id == author_id)
         )
         follower_ids = [row[0] for row in result]
-        follower_ids.append(user_id)
+        follower_ids.append(author_id)
         
         # Track follower metrics
-        self.metrics.gauge("tweet.followers_count", len(follower_ids), {"user_id": user_id})
+        self.metrics.gauge("tweet.followers_count", len(follower_ids), {"user_id": author_id})
+        
+        # Dormant users are skipped; their feed is rebuilt when they return
+        follower_ids = await filter_active_users(self.db, follower_ids)
+        self.metrics.gauge("tweet.fanout_count", len(follower_ids), {"user_id": author_id})
         
         # Publish with optimized batch processing
-        rabbitmq = RabbitMQService()
+        rabbitmq = RabbitMQService(self.publisher_pool)
         with self.metrics.timer("tweet.publish_to_queue"):
-            await rabbitmq.publish_tweet_event_batch(
-                {
-                    "tweet_id": tweet.id,
-                    "content": tweet.content,
-                    "author_id": tweet.author_id,
-                    "author_username": tweet.author.username,
-                    "created_at": tweet.created_at.isoformat()
-                },
-                follower_ids
-            )
+            await rabbitmq.publish_tweet_event_batch(event, follower_ids)
         await rabbitmq.close()
-        
-        self.metrics.increment("tweet.create.success")
-        return tweet
+
+    async def count_followers(self, user_id: int) -> int:
+        """Size of the fan-out a tweet by this user would cause"""
+        result = await self.db.execute(
+            select(func.count()).select_from(Subscription).filter(Subscription.followed_id == user_id)
+        )
+        return result.scalar_one()
 
     @track_time("tweet.get")
     async def get_tweet(self, tweet_id: int) -> Optional[Tweet]:
@@ -1,15 +1,28 @@
 import asyncio
 import aio_pika
-import json
 import logging
 import sys
-from typing import Optional
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from common.database import async_session_maker
 from common.config import get_settings
+from common.feed_trimmer import get_feed_trimmer
+from common.feed_rebuilds import get_feed_rebuild_consumer
+from common.outbox import get_outbox_relay
+from common.feed_spill import get_spill_reconciler
+from common.flow_control import adaptive_prefetch, get_db_slots
+from common.keyed_executor import get_keyed_executor
+from common.fanout import message_bucket, message_user_ids
+from common.batching import MessageBatcher
+from common.event_codec import decode_event
+from common.dead_letters import RetryHandler, declare_retry_topology
+from common.feed_writer import missing_users
 from ..services.feed_service import FeedService
+from ..services.tweet_service import TweetService
 from ..services.metrics_service import MetricsService
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 import time
 
 logger = logging.getLogger(__name__)
@@ -18,6 +31,12 @@ settings = get_settings()
 # Worker metrics
 messages_processed = Counter('worker_messages_processed_total', 'Messages processed by workers', ['worker_id', 'status'])
 processing_time = Histogram('worker_processing_time_seconds', 'Time to process messages', ['worker_id'])
+batch_size_histogram = Histogram(
+    'worker_batch_size', 'Messages per processed batch', ['worker_id'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+prefetch_gauge = Gauge('worker_prefetch', 'Current adaptive prefetch of the worker channel', ['worker_id'])
+db_slots_gauge = Gauge('worker_db_slots', 'Feed-write database session slots in this process', ['state'])
 
 
 class FeedWorker:
@@ -26,9 +45,20 @@ class FeedWorker:
         self.connection: Optional[aio_pika.Connection] = None
         self.channel: Optional[aio_pika.Channel] = None
         self.queue: Optional[aio_pika.Queue] = None
+        self.consumer_tag: Optional[str] = None
         self.running = False
         self.metrics = MetricsService()
         self.processed_count = 0
+        self.retries: Optional[RetryHandler] = None
+        self.batcher = MessageBatcher(
+            self.process_batch,
+            max_size=settings.feed_worker_batch_size,
+            linger_ms=settings.feed_worker_batch_linger_ms
+        )
+        # Starts at one full batch; adapts to the processing latency
+        self.prefetch = adaptive_prefetch(
+            max(50, settings.feed_worker_batch_size), f"feed_worker_{worker_id}"
+        )
 
     async def start(self):
         """Start optimized feed worker with monitoring"""
@@ -48,8 +78,8 @@ class FeedWorker:
             )
             self.channel = await self.connection.channel()
             
-            # Optimized prefetch for better throughput
-            await self.channel.set_qos(prefetch_count=50)
+            # Adaptive prefetch (AIMD on the batch processing latency)
+            await self.prefetch.start(self.channel)
             
             # Connect to specific worker queue
             self.queue = await self.channel.declare_queue(
@@ -57,8 +87,25 @@ class FeedWorker:
                 durable=True
             )
             
-            # Start consuming with error handling
-            await self.queue.consume(self.process_message)
+            # Failed messages go through delayed retries to the dead-letter queue
+            await declare_retry_topology(self.channel, "tweet_events_balanced", settings.feed_retry_delays_ms)
+            self.retries = RetryHandler(self.channel, self.queue.name, "tweet_events_balanced", settings.feed_retry_delays_ms)
+            
+            # Trim oversized feeds in the background (shared per process)
+            get_feed_trimmer().start()
+            
+            # Apply subscription changes in the background (shared per process)
+            await get_feed_rebuild_consumer().start(FeedService)
+            
+            # Publish committed tweet events from the outbox (shared per process)
+            await get_outbox_relay().start(TweetService)
+            
+            # Reconcile feeds whose messages the queues dropped (shared per process)
+            await get_spill_reconciler().start(FeedService)
+            
+            # Start consuming: messages are collected into micro-batches
+            self.batcher.start()
+            self.consumer_tag = await self.queue.consume(self.batcher.put)
             
             logger.info(f"Feed worker {self.worker_id} started successfully")
             
@@ -70,6 +117,7 @@ class FeedWorker:
                 await asyncio.sleep(1)
             
             metric_task.cancel()
+            await self.batcher.stop()
                 
         except Exception as e:
             logger.error(f"Feed worker {self.worker_id} error: {e}")
@@ -85,16 +133,14 @@ class FeedWorker:
         async with message.process():
             try:
                 # Parse message
-                data = json.loads(message.body.decode())
-                user_id = data["user_id"]
+                data = decode_event(message.body, message.content_type)
                 
                 # Track processing
                 self.metrics.increment(f"worker.{self.worker_id}.message.received")
                 
-                # Process feed update
-                async with async_session_maker() as db:
-                    feed_service = FeedService(db)
-                    await feed_service.add_tweet_to_user_feed(data)
+                # Process feed update (packed messages carry many recipients)
+                # on the recipients' executor lane
+                await self.write_message(message, data)
                 
                 # Track success
                 duration = time.time() - start_time
@@ -114,7 +160,103 @@ class FeedWorker:
                 messages_processed.labels(worker_id=self.worker_id, status='error').inc()
                 self.metrics.increment(f"worker.{self.worker_id}.message.error")
                 logger.error(f"Worker {self.worker_id} error processing message: {e}")
+                if not self.retries:
+                    raise
+                
+                # Ack and schedule a delayed retry (or dead-letter) instead of rejecting
+                outcome = await self.retries.handle_failure(message, e)
+                self.metrics.increment(f"worker.{self.worker_id}.message.{outcome}")
+
+    async def process_batch(self, messages: List[aio_pika.IncomingMessage]):
+        """
+        Process a micro-batch: one DB transaction per executor lane (lanes in
+        parallel, each user's writes in order), then a single multiple-ack. Batches are handled sequentially, so acking up to
+        the last delivery tag covers exactly this batch.
+        """
+        start_time = time.time()
+        batch_size_histogram.labels(worker_id=self.worker_id).observe(len(messages))
+        self.metrics.gauge(f"worker.{self.worker_id}.batch_size", len(messages))
+        
+        try:
+            batch = [decode_event(message.body, message.content_type) for message in messages]
+            
+            # Split by executor lane: each lane writes its users in its own
+            # transaction, in parallel with the other lanes
+            executor = get_keyed_executor()
+            by_lane = defaultdict(list)
+            for data in batch:
+                by_lane[executor.lane_for(message_bucket(data, settings.routing_shards))].append(data)
+            results = await asyncio.gather(
+                *(executor.submit(lane, lambda items=items: self.write_feeds(items)) for lane, items in by_lane.items()),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            
+            await messages[-1].ack(multiple=True)
+        except Exception as e:
+            # Fall back to per-message processing so one bad message
+            # does not fail the whole batch
+            logger.warning(f"Worker {self.worker_id} batch of {len(messages)} failed ({e}), retrying one by one")
+            self.metrics.increment(f"worker.{self.worker_id}.batch.fallback")
+            for message in messages:
+                try:
+                    await self.process_message(message)
+                except Exception as message_error:
+                    # process_message has already rejected it
+                    logger.error(f"Worker {self.worker_id} dropped message {message.message_id}: {message_error}")
+            await self.prefetch.observe(time.time() - start_time)
+            return
+        
+        # Track success
+        duration = time.time() - start_time
+        await self.prefetch.observe(duration)
+        processing_time.labels(worker_id=self.worker_id).observe(duration)
+        messages_processed.labels(worker_id=self.worker_id, status='success').inc(len(messages))
+        self.metrics.timing(f"worker.{self.worker_id}.batch_processing_time", duration)
+        
+        previous_count = self.processed_count
+        self.processed_count += len(messages)
+        
+        # Log progress every 100 messages
+        if self.processed_count // 100 > previous_count // 100:
+            logger.info(f"Worker {self.worker_id} processed {self.processed_count} messages")
+
+    async def write_message(self, message: aio_pika.IncomingMessage, data: Dict[str, Any]):
+        """
+        Write one fan-out message on its recipients' executor lane. Recipients
+        that no longer exist are dead-lettered on their own instead of failing
+        the whole packed message.
+        """
+        executor = get_keyed_executor()
+        bucket = message_bucket(data, settings.routing_shards)
+        try:
+            await executor.run(bucket, lambda: self.write_feeds([data]))
+        except IntegrityError as e:
+            if not self.retries:
+                raise
+            user_ids = message_user_ids(data)
+            async with get_db_slots():
+                async with async_session_maker() as db:
+                    missing = await missing_users(db, user_ids)
+            if not missing:
                 raise
+            
+            remaining = [user_id for user_id in user_ids if user_id not in missing]
+            if remaining:
+                data = {**data, "user_ids": remaining}
+                await executor.run(bucket, lambda: self.write_feeds([data]))
+            await self.retries.dead_letter(message, e, {**data, "user_ids": sorted(missing)})
+            logger.warning(f"Worker {self.worker_id} dead-lettered {len(missing)} missing recipients of tweet {data['tweet_id']}")
+            self.metrics.increment(f"worker.{self.worker_id}.message.dead_letter")
+
+    async def write_feeds(self, batch: List[Dict[str, Any]]):
+        """Write fan-out messages to their recipients' feeds in one transaction"""
+        async with get_db_slots():
+            async with async_session_maker() as db:
+                feed_service = FeedService(db)
+                await feed_service.add_tweets_to_user_feeds(batch)
 
     async def _report_metrics(self):
         """Report worker metrics periodically"""
@@ -137,26 +279,82 @@ class FeedWorker:
                     self.processed_count
                 )
                 
+                # Report flow control limits
+                prefetch_gauge.labels(worker_id=self.worker_id).set(self.prefetch.prefetch)
+                self.metrics.gauge(f"worker.{self.worker_id}.prefetch", self.prefetch.prefetch)
+                executor_stats = get_keyed_executor().get_stats()
+                self.metrics.gauge("worker.executor.queued", sum(executor_stats["queued"]))
+                self.metrics.gauge("worker.executor.max_depth", executor_stats["max_depth"])
+                db_slots = get_db_slots()
+                for state, value in (("limit", db_slots.limit), ("in_use", db_slots.in_use), ("waiting", db_slots.waiting)):
+                    db_slots_gauge.labels(state=state).set(value)
+                    self.metrics.gauge(f"worker.db_slots.{state}", value)
+                
+                if self.retries:
+                    self.metrics.gauge(f"worker.{self.worker_id}.retried", self.retries.retried)
+                    self.metrics.gauge(f"worker.{self.worker_id}.dead_lettered", self.retries.dead_lettered)
+                
+                # Report background trimming progress
+                feed_trimmer = get_feed_trimmer()
+                self.metrics.gauge("feed.cleanup.pending_users", feed_trimmer.pending)
+                self.metrics.gauge("feed.cleanup.items_removed", feed_trimmer.items_removed)
+                
+                # Report subscription change coalescing
+                rebuild_stats = await get_feed_rebuild_consumer().get_stats()
+                self.metrics.gauge("feed.rebuild.queue_depth", rebuild_stats["queue_depth"])
+                self.metrics.gauge("feed.rebuild.pending_changes", rebuild_stats["pending_changes"])
+                self.metrics.gauge("feed.rebuild.coalescing_ratio", rebuild_stats["coalescing_ratio"])
+                
+                # Report outbox relay backlog
+                outbox_stats = await get_outbox_relay().get_stats()
+                self.metrics.gauge("outbox.pending", outbox_stats["pending"])
+                self.metrics.gauge("outbox.published", outbox_stats["published"])
+                self.metrics.gauge("outbox.failures", outbox_stats["failures"])
+                self.metrics.gauge("outbox.parked", outbox_stats["parked"])
+                
+                # Report overflow spill and reconciliation
+                spill_stats = await get_spill_reconciler().get_stats()
+                self.metrics.gauge("feed.spill.pending_users", spill_stats["pending_users"])
+                self.metrics.gauge("feed.spill.messages", sum(spill_stats["spilled"].values()))
+                self.metrics.gauge("feed.spill.reconciled_users", spill_stats["reconciled_users"])
+                
                 await asyncio.sleep(10)  # Report every 10 seconds
                 
             except Exception as e:
                 logger.error(f"Error reporting metrics: {e}")
 
-    async def stop(self):
-        """Stop worker gracefully"""
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        Drain and stop: stop consuming, wait up to timeout (default
+        FEED_WORKER_DRAIN_TIMEOUT_SECONDS) for the batches already received
+        to be committed and acked, then close. Only what is still pending
+        at the deadline is redelivered.
+        """
         logger.info(f"Stopping feed worker {self.worker_id}...")
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
+        timeout = settings.feed_worker_drain_timeout_seconds if timeout is None else timeout
+        drained = await self.batcher.drain(timeout)
+        if not drained:
+            logger.warning(f"Worker {self.worker_id} drain timed out, {self.batcher.pending} messages will be redelivered")
+        self.metrics.increment(f"worker.{self.worker_id}.drain.{'complete' if drained else 'timeout'}")
+        self.metrics.gauge(f"worker.{self.worker_id}.drain.abandoned", self.batcher.pending)
         self.running = False
         self.metrics.increment(f"worker.{self.worker_id}.stopped")
         await self.cleanup()
 
     async def cleanup(self):
         """Clean up resources"""
-        if self.queue:
-            await self.queue.cancel_consumer()
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
         if self.channel:
             await self.channel.close()
+            self.channel = None
         if self.connection:
             await self.connection.close()
+            self.connection = None
 
 
 async def main():
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Fan-out message format microbenchmark: JSON vs compact binary.
+
+Encodes and decodes one tweet's fan-out messages in both wire formats
+(common.event_codec) and reports the cost per message and the bytes on the
+wire. Messages are packed per routing shard, so a typical fan-out sends
+about one recipient per message while a mega fan-out fills every message up
+to FANOUT_MAX_USER_IDS_PER_MESSAGE recipients. No broker is needed.
+
+  python benchmark_codec.py --followers 200,1000000
+"""
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import argparse
+import time
+from datetime import datetime
+
+from common.config import get_settings
+from common.event_codec import FORMAT_COMPACT, FORMAT_JSON, decode_event, encode_event
+from common.fanout import packed_fanout
+
+settings = get_settings()
+
+
+def build_events(followers: int):
+    tweet = {
+        "tweet_id": 123456789,
+        "content": "Benchmarking the fan-out wire format " + "x" * 100,
+        "author_id": 4242,
+        "author_username": "benchmark_author",
+        "created_at": datetime.utcnow().isoformat()
+    }
+    follower_ids = range(1000, 1000 + followers)
+    return [
+        {**tweet, "user_ids": user_ids}
+        for _, user_ids in packed_fanout(follower_ids, settings.routing_shards, settings.fanout_max_user_ids_per_message)
+    ]
+
+
+def run_case(events, fmt: str, repeat: int):
+    encoded = [encode_event(event, fmt) for event in events]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for event in events:
+            encode_event(event, fmt)
+    encode_us = (time.perf_counter() - start) / (repeat * len(events)) * 1e6
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for body, content_type in encoded:
+            decode_event(body, content_type)
+    decode_us = (time.perf_counter() - start) / (repeat * len(events)) * 1e6
+
+    total_bytes = sum(len(body) for body, _ in encoded)
+    return encode_us, decode_us, total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--followers", default="200,1000000", help="comma-separated fan-out sizes")
+    parser.add_argument("--repeat", type=int, default=0, help="passes per case (default: scaled to size)")
+    args = parser.parse_args()
+
+    print(f"{'followers':>10} {'messages':>9} {'format':>8} {'encode us/msg':>14} "
+          f"{'decode us/msg':>14} {'bytes/msg':>10} {'MB/tweet':>9}")
+
+    for followers in [int(f) for f in args.followers.split(",") if f]:
+        events = build_events(followers)
+        repeat = args.repeat or max(1, 200000 // followers)
+        results = {}
+        for fmt in (FORMAT_JSON, FORMAT_COMPACT):
+            encode_us, decode_us, total_bytes = run_case(events, fmt, repeat)
+            results[fmt] = (encode_us, decode_us, total_bytes)
+            print(f"{followers:>10} {len(events):>9} {fmt:>8} {encode_us:>14.2f} "
+                  f"{decode_us:>14.2f} {total_bytes / len(events):>10.0f} {total_bytes / 1e6:>9.2f}")
+
+        json_result, compact_result = results[FORMAT_JSON], results[FORMAT_COMPACT]
+        print(f"{'':>10} {'':>9} {'ratio':>8} {json_result[0] / compact_result[0]:>13.1f}x "
+              f"{json_result[1] / compact_result[1]:>13.1f}x {json_result[2] / compact_result[2]:>9.1f}x\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Fan-out publish benchmark: AMQP transactions vs pipelined publisher confirms.
+
+Publishes the same persistent, tweet-sized messages through the transactional
+path (commit every --batch-size messages) and through the confirm pipeline
+with each --windows in-flight limit, into a scratch queue that is deleted
+afterwards. Workers are not involved.
+
+  python benchmark_publish.py --messages 20000 --windows 50,200,500,1000
+"""
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+
+import aio_pika
+from common.config import get_settings
+from common.publishing import publish_confirmed, publish_transactional
+from common.sharding import routing_hash
+
+BENCHMARK_EXCHANGE = "publish_benchmark"
+BENCHMARK_QUEUE = "publish_benchmark"
+
+settings = get_settings()
+
+
+def build_publishes(exchange, count: int):
+    body = {
+        "tweet_id": 1,
+        "content": "x" * 140,
+        "author_id": 1,
+        "author_username": "benchmark",
+        "created_at": datetime.utcnow().isoformat()
+    }
+    publishes = []
+    for follower_id in range(count):
+        message = aio_pika.Message(
+            body=json.dumps({**body, "user_id": follower_id}).encode(),
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            headers={"routing_hash": routing_hash(follower_id, settings.routing_shards), "user_id": str(follower_id)}
+        )
+        publishes.append((exchange, message, BENCHMARK_QUEUE))
+    return publishes
+
+
+async def run_case(connection, label: str, confirms: bool, count: int, batch_size: int, window: int) -> float:
+    channel = await connection.channel(publisher_confirms=confirms)
+    exchange = await channel.get_exchange(BENCHMARK_EXCHANGE, ensure=False)
+    publishes = build_publishes(exchange, count)
+
+    start = time.perf_counter()
+    if confirms:
+        await publish_confirmed(publishes, window)
+    else:
+        await publish_transactional(channel, publishes, batch_size)
+    elapsed = time.perf_counter() - start
+
+    await channel.close()
+    print(f"{label:<28} {elapsed:>9.2f}s {count / elapsed:>12.0f} msg/s")
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="messages per run")
+    parser.add_argument("--batch-size", type=int, default=100, help="messages per transaction")
+    parser.add_argument("--windows", default="50,200,500,1000", help="comma-separated confirm windows")
+    parser.add_argument("--rabbitmq-url", default=settings.rabbitmq_url)
+    args = parser.parse_args()
+    windows = [int(w) for w in args.windows.split(",") if w]
+
+    connection = await aio_pika.connect_robust(args.rabbitmq_url)
+    setup = await connection.channel()
+    exchange = await setup.declare_exchange(BENCHMARK_EXCHANGE, aio_pika.ExchangeType.DIRECT)
+    queue = await setup.declare_queue(BENCHMARK_QUEUE, durable=True)
+    await queue.bind(exchange, routing_key=BENCHMARK_QUEUE)
+
+    print(f"Publishing {args.messages} persistent messages per run\n")
+    print(f"{'mode':<28} {'time':>10} {'throughput':>16}")
+
+    try:
+        baseline = await run_case(
+            connection, f"transactions (batch {args.batch_size})", False,
+            args.messages, args.batch_size, 0
+        )
+        await queue.purge()
+
+        for window in windows:
+            elapsed = await run_case(
+                connection, f"confirms (window {window})", True,
+                args.messages, args.batch_size, window
+            )
+            print(f"{'':<28} {baseline / elapsed:>9.1f}x vs transactions")
+            await queue.purge()
+    finally:
+        await queue.delete(if_unused=False, if_empty=False)
+        await exchange.delete()
+        await connection.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
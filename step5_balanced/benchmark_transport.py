@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Fan-out transport benchmark: RabbitMQ vs Redis Streams vs in-process queues.
+
+Publishes the packed, encoded fan-out messages of --tweets tweets through
+each event bus transport (common.event_bus) into --partitions scratch
+partitions, with one consumer per partition that decodes and acks every
+message, and reports publish throughput and end-to-end throughput (first
+publish to last ack). Feeds are not written, so the numbers compare the
+transports alone; run everything on one machine for comparable results.
+
+  python benchmark_transport.py --transports memory,redis,amqp --followers 100000
+"""
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from common.config import get_settings
+from common.event_bus import TRANSPORT_AMQP, TRANSPORT_REDIS, Delivery, create_event_bus
+from common.event_codec import decode_event, encode_event
+from common.fanout import message_user_ids, packed_fanout
+
+BENCHMARK_NAME = "transport_benchmark"
+
+settings = get_settings()
+
+
+def build_events(tweets: int, followers: int, fmt: str):
+    events = []
+    for tweet_id in range(tweets):
+        tweet = {
+            "tweet_id": tweet_id,
+            "content": "Benchmarking the fan-out transport " + "x" * 100,
+            "author_id": 4242,
+            "author_username": "benchmark_author",
+            "created_at": datetime.utcnow().isoformat()
+        }
+        for bucket, user_ids in packed_fanout(range(1000, 1000 + followers), settings.routing_shards,
+                                              settings.fanout_max_user_ids_per_message):
+            body, content_type = encode_event({**tweet, "user_ids": user_ids}, fmt)
+            events.append((bucket, body, content_type))
+    return events
+
+
+def scratch_bus(transport: str, partitions: int):
+    if transport == TRANSPORT_AMQP:
+        return create_event_bus(transport, partitions, exchange_name=BENCHMARK_NAME, queue_prefix=BENCHMARK_NAME)
+    if transport == TRANSPORT_REDIS:
+        return create_event_bus(transport, partitions, stream_prefix=BENCHMARK_NAME, group=BENCHMARK_NAME)
+    return create_event_bus(transport, partitions)
+
+
+async def drop_scratch(bus, transport: str):
+    if transport == TRANSPORT_AMQP:
+        for partition in range(bus.partitions):
+            await bus.channel.queue_delete(bus.queue_name(partition))
+        await bus.channel.exchange_delete(BENCHMARK_NAME)
+    elif transport == TRANSPORT_REDIS:
+        await bus.redis.delete(*(bus.stream_name(partition) for partition in range(bus.partitions)))
+
+
+async def run_case(transport: str, events, partitions: int, prefetch: int):
+    bus = scratch_bus(transport, partitions)
+    await bus.start()
+
+    consumed = 0
+    recipients = 0
+    done = asyncio.Event()
+
+    async def handle(delivery: Delivery):
+        nonlocal consumed, recipients
+        recipients += len(message_user_ids(decode_event(delivery.body, delivery.content_type)))
+        await delivery.ack()
+        consumed += 1
+        if consumed == len(events):
+            done.set()
+
+    try:
+        for partition in range(partitions):
+            await bus.consume(partition, handle, prefetch)
+
+        start = time.perf_counter()
+        # Publish in tweet-sized slices, as the API would
+        for i in range(0, len(events), 1000):
+            await bus.publish_many(events[i:i + 1000])
+        published = time.perf_counter() - start
+        await done.wait()
+        elapsed = time.perf_counter() - start
+    finally:
+        await drop_scratch(bus, transport)
+        await bus.close()
+
+    print(f"{transport:>10} {len(events) / published:>14.0f} {len(events) / elapsed:>14.0f} "
+          f"{recipients / elapsed:>16.0f} {elapsed:>9.2f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transports", default="memory,redis,amqp", help="comma-separated transports")
+    parser.add_argument("--tweets", type=int, default=10)
+    parser.add_argument("--followers", type=int, default=100000, help="fan-out per tweet")
+    parser.add_argument("--partitions", type=int, default=settings.feed_worker_queues)
+    parser.add_argument("--prefetch", type=int, default=200)
+    parser.add_argument("--format", default=settings.fanout_message_format, help="compact or json")
+    args = parser.parse_args()
+
+    events = build_events(args.tweets, args.followers, args.format)
+    print(f"{len(events)} messages, {args.tweets * args.followers} recipients, {args.partitions} partitions\n")
+    print(f"{'transport':>10} {'publish msg/s':>14} {'e2e msg/s':>14} {'recipients/s':>16} {'total':>10}")
+
+    for transport in [t for t in args.transports.split(",") if t]:
+        try:
+            await run_case(transport, events, args.partitions, args.prefetch)
+        except Exception as e:
+            print(f"{transport:>10} failed: {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
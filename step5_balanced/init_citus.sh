@@ -73,6 +73,46 @@ CREATE TABLE IF NOT EXISTS feed_items (
     UNIQUE (user_id, tweet_id)
 );
 
+-- Create feed_counts table (per-user feed size counter)
+CREATE TABLE IF NOT EXISTS feed_counts (
+    user_id INTEGER PRIMARY KEY,
+    item_count INTEGER NOT NULL DEFAULT 0
+);
+
+-- Create user_activity table (last feed read, used by the dormancy policy)
+CREATE TABLE IF NOT EXISTS user_activity (
+    user_id INTEGER PRIMARY KEY,
+    last_feed_read_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create tweet_outbox table (fan-out events waiting for the relay).
+-- Kept local to the coordinator: the relay claims rows with FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS tweet_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    tweet_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    payload JSON NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    claimed_until TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    failed_at TIMESTAMP
+);
+
+-- Relay lease and failure columns for outboxes created before they existed
+ALTER TABLE tweet_outbox ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP;
+ALTER TABLE tweet_outbox ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE tweet_outbox ADD COLUMN IF NOT EXISTS last_error TEXT;
+ALTER TABLE tweet_outbox ADD COLUMN IF NOT EXISTS failed_at TIMESTAMP;
+
+-- Create feed_spill table (users with dropped fan-out messages to reconcile).
+-- Kept local to the coordinator: reconciliation claims rows with FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS feed_spill (
+    user_id INTEGER PRIMARY KEY,
+    since TIMESTAMP NOT NULL,
+    spilled_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Create indexes before distribution
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_tweets_author_created ON tweets(author_id, created_at DESC);
@@ -98,8 +138,21 @@ BEGIN
     IF NOT EXISTS (SELECT 1 FROM pg_dist_partition WHERE logicalrelid = 'feed_items'::regclass) THEN
         PERFORM create_distributed_table('feed_items', 'user_id', colocate_with => 'users');
     END IF;
+    
+    IF NOT EXISTS (SELECT 1 FROM pg_dist_partition WHERE logicalrelid = 'feed_counts'::regclass) THEN
+        PERFORM create_distributed_table('feed_counts', 'user_id', colocate_with => 'users');
+    END IF;
+    
+    IF NOT EXISTS (SELECT 1 FROM pg_dist_partition WHERE logicalrelid = 'user_activity'::regclass) THEN
+        PERFORM create_distributed_table('user_activity', 'user_id', colocate_with => 'users');
+    END IF;
 END $$;
 
+-- Backfill feed counts for feeds created before feed_counts existed
+INSERT INTO feed_counts (user_id, item_count)
+SELECT user_id, count(*) FROM feed_items GROUP BY user_id
+ON CONFLICT (user_id) DO NOTHING;
+
 -- Show distribution info
 SELECT 
     logicalrelid::regclass AS table_name,
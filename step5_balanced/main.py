@@ -9,8 +9,12 @@ import multiprocessing
 from prometheus_client import make_asgi_app, Counter, Histogram, Gauge
 from common.database import engine
 from common.models import Base
+from common.config import get_settings
+from common.publisher_pool import PublisherPool
+from common.publishing import uses_publisher_confirms
+from common.admission import AdmissionController
 from app.api import users, tweets, subscriptions, feed
-from app.services.rabbitmq_service import RabbitMQService
+from app.services.rabbitmq_service import RabbitMQService, worker_queue_limits
 from app.services.metrics_service import MetricsService
 
 # Prometheus metrics
@@ -34,6 +38,28 @@ async def lifespan(app: FastAPI):
     await rabbitmq.setup_exchanges()
     await rabbitmq.close()
     
+    # Long-lived publisher connection and channels shared by all requests
+    publisher_pool = PublisherPool(
+        get_settings().rabbitmq_url,
+        size=get_settings().publisher_pool_size,
+        publisher_confirms=uses_publisher_confirms(get_settings().publisher_mode)
+    )
+    await publisher_pool.start()
+    app.state.publisher_pool = publisher_pool
+    
+    # Refuse writes before the worker queues overflow and drop updates
+    admission = AdmissionController(
+        get_settings().rabbitmq_url,
+        worker_queue_limits(),
+        interval=get_settings().admission_poll_interval_seconds,
+        soft_ratio=get_settings().admission_soft_ratio,
+        hard_ratio=get_settings().admission_hard_ratio,
+        large_fanout=get_settings().admission_large_fanout,
+        stale_after_failures=get_settings().admission_stale_after_failures
+    )
+    await admission.start()
+    app.state.admission = admission
+    
     # Initialize metrics
     metrics = MetricsService()
     await metrics.initialize()
@@ -43,6 +69,8 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    await admission.stop()
+    await publisher_pool.close()
     await engine.dispose()
 
 
@@ -84,6 +112,12 @@ async def root():
     }
 
 
+@app.get("/admission/stats")
+async def admission_stats():
+    """Get worker queue fill level and refused writes"""
+    return app.state.admission.get_stats()
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for monitoring"""
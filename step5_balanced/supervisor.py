@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Multi-process worker runner for Step 5.
+
+Starts N processes (default: one per core, at most one per queue), each
+running the feed workers for its share of the FEED_WORKER_QUEUES queues on
+its own event loop. Crashed processes are restarted and the aggregate
+throughput is logged periodically.
+
+With --autoscale the number of processes follows the queue depth and lag
+between AUTOSCALE_MIN_PROCESSES and AUTOSCALE_MAX_PROCESSES (see
+common/autoscaler.py); --dry-run only logs the decisions. --simulate runs the
+autoscaler against a model of the queues fed with the traffic of
+run_demo.sh and load_realistic_data.py, without RabbitMQ.
+
+  python supervisor.py --processes 4
+  python supervisor.py --autoscale
+  python supervisor.py --simulate --service-rate 400 --load-scale 2
+"""
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from typing import List
+
+from common.autoscaler import Autoscaler, QueueDepthProbe, scaling_policy, simulate
+from common.config import get_settings
+from common.draining import stop_background
+from common.supervisor import WorkerSupervisor, report_progress, shard_assignments
+from app.workers.feed_worker import FeedWorker
+
+settings = get_settings()
+
+
+def configure_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+
+async def serve(queue_ids: List[int], counter):
+    """Run the workers of one child process until they stop"""
+    workers = [FeedWorker(worker_id) for worker_id in queue_ids]
+
+    shutdown_task = None
+
+    async def shutdown():
+        # Drain all workers at once, then the background consumers
+        await asyncio.gather(*(worker.stop() for worker in workers))
+        await stop_background(settings.feed_worker_drain_timeout_seconds)
+
+    def stop_workers():
+        nonlocal shutdown_task
+        if shutdown_task is None:
+            shutdown_task = asyncio.create_task(shutdown())
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_workers)
+
+    progress = asyncio.create_task(
+        report_progress(counter, lambda: sum(worker.processed_count for worker in workers))
+    )
+    try:
+        await asyncio.gather(*(worker.start() for worker in workers))
+        if shutdown_task:
+            await shutdown_task
+    finally:
+        progress.cancel()
+
+
+def run_worker_process(queue_ids: List[int], counter):
+    """Child process entry point"""
+    configure_logging()
+    asyncio.run(serve(queue_ids, counter))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=settings.feed_worker_processes or os.cpu_count())
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between throughput reports")
+    parser.add_argument("--autoscale", action="store_true", help="scale processes with queue depth and lag")
+    parser.add_argument("--dry-run", action="store_true", help="with --autoscale, only log scaling decisions")
+    parser.add_argument("--simulate", action="store_true", help="run the autoscaler against simulated queues")
+    parser.add_argument("--service-rate", type=float, default=400.0, help="simulated messages/s per process")
+    parser.add_argument("--load-scale", type=float, default=1.0, help="multiplier for the simulated load")
+    args = parser.parse_args()
+    configure_logging()
+
+    queue_ids = list(range(settings.feed_worker_queues))
+    if args.simulate:
+        simulate(
+            scaling_policy(len(queue_ids)),
+            len(queue_ids),
+            args.service_rate,
+            load_scale=args.load_scale,
+            interval=settings.autoscale_interval_seconds
+        )
+        return
+
+    policy = scaling_policy(len(queue_ids))
+    supervisor = WorkerSupervisor(
+        run_worker_process,
+        shard_assignments(queue_ids, policy.clamp(args.processes) if args.autoscale else args.processes),
+        name="feed-worker",
+        report_interval=args.report_interval,
+        # Worker drain, then background consumer drain, plus slack
+        stop_timeout=2 * settings.feed_worker_drain_timeout_seconds + 10
+    )
+    if not args.autoscale:
+        supervisor.run()
+        return
+
+    probe = QueueDepthProbe(
+        settings.rabbitmq_url,
+        [f"feed_updates_balanced_{i}" for i in queue_ids],
+        interval=settings.autoscale_interval_seconds
+    )
+    autoscaler = Autoscaler(
+        supervisor, probe, policy,
+        interval=settings.autoscale_interval_seconds,
+        apply=not args.dry_run
+    )
+    probe.start()
+    try:
+        supervisor.run(on_tick=autoscaler.tick)
+    finally:
+        probe.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ sys.path.append(str(Path(__file__).parent.parent))
 import asyncio
 import logging
 import signal
+from common.config import get_settings
+from common.draining import stop_background
 from app.workers.feed_worker import FeedWorker
 
 logging.basicConfig(
@@ -18,17 +20,23 @@ logging.basicConfig(
 )
 
 worker = None
+shutdown_task = None
 
-async def shutdown(signal, loop):
-    """Graceful shutdown handler"""
-    logging.info(f"Received exit signal {signal.name}...")
+async def shutdown(sig):
+    """
+    Graceful shutdown: stop consuming, let the batches already received
+    commit and ack (up to FEED_WORKER_DRAIN_TIMEOUT_SECONDS), then stop the
+    background consumers the same way
+    """
+    logging.info(f"Received exit signal {sig.name}, draining...")
     if worker:
         await worker.stop()
-    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
-    for task in tasks:
-        task.cancel()
-    await asyncio.gather(*tasks, return_exceptions=True)
-    loop.stop()
+    await stop_background(get_settings().feed_worker_drain_timeout_seconds)
+
+def request_shutdown(sig):
+    global shutdown_task
+    if shutdown_task is None:
+        shutdown_task = asyncio.create_task(shutdown(sig))
 
 async def main():
     global worker
@@ -42,9 +50,9 @@ async def main():
     print(f"Starting production worker {worker_id}...")
     
     # Setup signal handlers
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
     for sig in (signal.SIGTERM, signal.SIGINT):
-        signal.signal(sig, lambda s, f: asyncio.create_task(shutdown(s, loop)))
+        loop.add_signal_handler(sig, request_shutdown, sig)
     
     worker = FeedWorker(worker_id)
     
@@ -53,6 +61,10 @@ async def main():
     except Exception as e:
         logging.error(f"Worker {worker_id} failed: {e}")
         sys.exit(1)
+    
+    # start() returns once the drain has stopped the worker
+    if shutdown_task:
+        await shutdown_task
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -78,7 +78,7 @@ class CacheService:
     async def initialize(self):
         """Initialize Redis connection"""
         self.redis = await redis.from_url(
-            "redis://localhost:6379",
+            settings.redis_url,
             encoding="utf-8",
             decode_responses=True
         )
@@ -127,6 +127,48 @@ class CacheService:
         # Mark as hot user if frequently accessed
         await self._mark_hot_user(user_id)
     
+    async def add_many_to_feed_caches(self, entries: List[Tuple[int, Dict[str, Any]]],
+                                      processed_message_ids: List[str] = None):
+        """
+        Bulk variant of add_to_feed_cache for worker batches.
+        Reads every touched buffer with one MGET and writes buffers, tweets,
+        hot-user counters and dedup markers back in one pipeline.
+        """
+        if not entries and not processed_message_ids:
+            return
+        
+        user_ids = list(dict.fromkeys(user_id for user_id, _ in entries))
+        keys = [f"feed:buffer:{user_id}" for user_id in user_ids]
+        
+        # Load all touched buffers in one round trip
+        buffers = {}
+        for user_id, buffer_data in zip(user_ids, await self.redis.mget(keys) if keys else []):
+            if buffer_data:
+                buffers[user_id] = CircularBuffer.from_dict(json.loads(buffer_data))
+            else:
+                buffers[user_id] = CircularBuffer(self.buffer_size)
+        
+        for user_id, tweet_data in entries:
+            buffers[user_id].add(tweet_data)
+        
+        # Write everything back in one round trip
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id, cb in buffers.items():
+                pipe.setex(f"feed:buffer:{user_id}", self.feed_ttl, json.dumps(cb.to_dict()))
+                pipe.zincrby("users:hot", 1, str(user_id))
+            for tweet_data in {data["tweet_id"]: data for _, data in entries}.values():
+                pipe.setex(f"tweet:{tweet_data['tweet_id']}", self.tweet_ttl, json.dumps(tweet_data))
+            for message_id in processed_message_ids or []:
+                pipe.setex(f"msg:processed:{message_id}", self.message_ttl, "1")
+            await pipe.execute()
+    
+    async def get_processed_messages(self, message_ids: List[str]) -> set:
+        """Return the subset of message IDs already processed (one MGET)"""
+        if not message_ids:
+            return set()
+        results = await self.redis.mget([f"msg:processed:{message_id}" for message_id in message_ids])
+        return {message_id for message_id, result in zip(message_ids, results) if result is not None}
+    
     async def cache_tweet(self, tweet_id: int, tweet_data: Dict[str, Any]):
         """Cache individual tweet"""
         key = f"tweet:{tweet_id}"
@@ -172,6 +214,54 @@ class CacheService:
         key = f"feed:buffer:{user_id}"
         await self.redis.delete(key)
     
+    async def remove_author_from_feed_cache(self, user_id: int, author_id: int):
+        """Drop an author's tweets from a cached feed, keeping the order of the rest"""
+        key = f"feed:buffer:{user_id}"
+        buffer_data = await self.redis.get(key)
+        if not buffer_data:
+            return
+        
+        cb = CircularBuffer.from_dict(json.loads(buffer_data))
+        kept = [item for item in cb.get_items(cb.count) if item["author_id"] != author_id]
+        if len(kept) == cb.count:
+            return
+        
+        # Re-add oldest first so the newest item ends up at the head
+        filtered = CircularBuffer(cb.size)
+        for item in reversed(kept):
+            filtered.add(item)
+        await self.redis.setex(key, self.feed_ttl, json.dumps(filtered.to_dict()))
+    
+    async def get_last_feed_read(self, user_id: int) -> Optional[datetime]:
+        """When the user last fetched their feed (UTC), None if not within the retention"""
+        last_read = await self.redis.zscore("users:last_read", str(user_id))
+        return datetime.utcfromtimestamp(last_read) if last_read is not None else None
+    
+    async def record_feed_read(self, user_id: int):
+        """Remember when the user last fetched their feed (drives fan-out lanes and dormancy)"""
+        now = datetime.now().timestamp()
+        # Reads older than both the active window and the dormancy window
+        # no longer matter; keep the set bounded
+        retention = max(settings.active_reader_window_seconds, settings.dormant_after_days * 86400)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd("users:last_read", {str(user_id): now})
+            pipe.zremrangebyscore("users:last_read", "-inf", now - retention)
+            await pipe.execute()
+    
+    async def get_active_readers(self, user_ids: List[int], window_seconds: int) -> set:
+        """Return the subset of users who fetched their feed within the window"""
+        cutoff = datetime.now().timestamp() - window_seconds
+        active = set()
+        chunk_size = 1000
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[i:i + chunk_size]
+            scores = await self.redis.zmscore("users:last_read", [str(user_id) for user_id in chunk])
+            active.update(
+                user_id for user_id, last_read in zip(chunk, scores)
+                if last_read is not None and last_read >= cutoff
+            )
+        return active
+    
     async def _mark_hot_user(self, user_id: int):
         """Track hot users for cache warming"""
         await self.redis.zincrby("users:hot", 1, str(user_id))
@@ -1,10 +1,13 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete, desc
 from sqlalchemy.orm import selectinload, joinedload
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 from common.models import FeedItem as FeedItemModel, Tweet, Subscription, User
 from common.schemas import FeedItem
+from common.feed_writer import feed_rows, insert_feed_items, write_feed_items, reset_feed_counts, delete_author_feed_items, merge_followed_tweets
+from common.fanout import message_user_ids
+from common.activity import is_dormant, record_feed_read
 from .cache_service import CacheService
 import logging
 
@@ -19,6 +22,25 @@ class FeedService:
 
     async def get_user_feed(self, user_id: int, skip: int = 0, limit: int = 20) -> List[FeedItem]:
         """Get user feed - try cache first, then database"""
+        # Returning dormant users missed fan-out: rebuild their feed first
+        if self.cache:
+            # Dormancy comes from the same Redis read log as the fan-out lanes
+            if is_dormant(await self.cache.get_last_feed_read(user_id)):
+                await self.rebuild_user_feed(user_id)
+            
+            # Reading the feed makes the user an active reader (fast fan-out
+            # lane); recorded after the rebuild so a failed one is retried
+            await self.cache.record_feed_read(user_id)
+        elif await record_feed_read(self.db, user_id):
+            await self.rebuild_user_feed(user_id)
+        
+        return await self.load_feed(user_id, skip, limit)
+
+    async def load_feed(self, user_id: int, skip: int = 0, limit: int = 20) -> List[FeedItem]:
+        """
+        Load the feed from cache or database (warming the cache on a miss)
+        without recording a read; only the API read path counts as one
+        """
         # Try cache first
         if self.cache:
             cached_items = await self.cache.get_feed_cache(user_id, limit, skip)
@@ -103,24 +125,11 @@ class FeedService:
                 return
             await self.cache.mark_message_processed(message_id)
         
-        # Check if already exists in DB
-        result = await self.db.execute(
-            select(FeedItemModel).filter(
-                FeedItemModel.user_id == user_id,
-                FeedItemModel.tweet_id == tweet_id
-            )
-        )
-        if result.scalar_one_or_none():
-            return
-        
-        # Add to database
-        feed_item = FeedItemModel(
-            user_id=user_id,
-            tweet_id=tweet_id,
-            created_at=created_at
-        )
-        self.db.add(feed_item)
+        # Add to database; no returned row means it was already in the feed
+        write_result = await insert_feed_items(self.db, feed_rows([user_id], tweet_id, created_at))
         await self.db.commit()
+        if not write_result.inserted:
+            return
         
         # Add to cache if available
         if self.cache:
@@ -135,31 +144,56 @@ class FeedService:
             
             # Also cache the tweet itself
             await self.cache.cache_tweet(tweet_id, cache_data)
-        
-        # Clean up old items
-        await self._cleanup_old_feed_items(user_id)
 
-    async def _cleanup_old_feed_items(self, user_id: int):
-        """Remove old feed items beyond max_feed_size"""
-        # Get the count of items
-        count_result = await self.db.execute(
-            select(FeedItemModel.id)
-            .filter(FeedItemModel.user_id == user_id)
-            .order_by(desc(FeedItemModel.created_at))
-            .offset(self.max_feed_size)
-            .limit(1)
-        )
-        oldest_to_keep_id = count_result.scalar_one_or_none()
-        
-        if oldest_to_keep_id:
-            await self.db.execute(
-                delete(FeedItemModel)
-                .filter(
-                    FeedItemModel.user_id == user_id,
-                    FeedItemModel.id < oldest_to_keep_id
-                )
+    async def add_tweets_to_user_feeds(self, batch: List[Tuple[Dict[str, Any], str]]):
+        """
+        Apply a batch of (tweet_data, message_id) fan-out messages: one DB
+        transaction and one cache pipeline for the whole batch.
+        """
+        # Drop messages that were already processed
+        if self.cache:
+            processed = await self.cache.get_processed_messages(
+                [message_id for _, message_id in batch if message_id]
+            )
+            if processed:
+                logger.info(f"Skipping {len(processed)} already processed messages")
+                batch = [(data, message_id) for data, message_id in batch if message_id not in processed]
+        
+        if not batch:
+            return
+        
+        rows = []
+        cache_entries = []
+        for tweet_data, _ in batch:
+            # Packed messages carry the tweet once for many recipients
+            user_ids = message_user_ids(tweet_data)
+            created_at = datetime.fromisoformat(tweet_data["created_at"])
+            rows.extend(feed_rows(user_ids, tweet_data["tweet_id"], created_at))
+            
+            cache_item = {
+                "tweet_id": tweet_data["tweet_id"],
+                "content": tweet_data.get("content", ""),
+                "author_id": tweet_data.get("author_id"),
+                "author_username": tweet_data.get("author_username", ""),
+                "created_at": created_at.isoformat()
+            }
+            cache_entries.extend((user_id, cache_item) for user_id in user_ids)
+        
+        # Add to database
+        write_result = await write_feed_items(self.db, rows)
+        await self.db.commit()
+        
+        # Add newly inserted items to cache and mark messages processed;
+        # rows that already existed are already in the cached feed
+        if self.cache:
+            inserted = set(write_result.inserted)
+            await self.cache.add_many_to_feed_caches(
+                [
+                    (user_id, item) for user_id, item in cache_entries
+                    if (user_id, item["tweet_id"]) in inserted
+                ],
+                processed_message_ids=[message_id for _, message_id in batch if message_id]
             )
-            await self.db.commit()
 
     async def rebuild_user_feed(self, user_id: int):
         """Rebuild user's feed and invalidate cache"""
@@ -171,6 +205,7 @@ class FeedService:
         await self.db.execute(
             delete(FeedItemModel).filter(FeedItemModel.user_id == user_id)
         )
+        await reset_feed_counts(self.db, [user_id])
         
         # Get users that this user follows
         result = await self.db.execute(
@@ -195,12 +230,11 @@ class FeedService:
         cache_items = []
         
         for tweet in tweets:
-            feed_item = FeedItemModel(
-                user_id=user_id,
-                tweet_id=tweet.id,
-                created_at=tweet.created_at
-            )
-            feed_items.append(feed_item)
+            feed_items.append({
+                "user_id": user_id,
+                "tweet_id": tweet.id,
+                "created_at": tweet.created_at
+            })
             
             # Prepare cache data
             if self.cache:
@@ -213,12 +247,59 @@ class FeedService:
                 })
         
         # Bulk insert
-        if feed_items:
-            self.db.add_all(feed_items)
+        await write_feed_items(self.db, feed_items)
         
         await self.db.commit()
         
         # Warm cache with rebuilt feed
         if self.cache and cache_items:
             for item in cache_items[:100]:  # Cache top 100 items
-                await self.cache.add_to_feed_cache(user_id, item)
\ No newline at end of file
+                await self.cache.add_to_feed_cache(user_id, item)
+
+    async def merge_author_into_feed(self, user_id: int, author_id: int):
+        """
+        Merge a newly followed author's recent tweets into the user's feed.
+        Costs O(author's tweets) instead of a full rebuild.
+        """
+        result = await self.db.execute(
+            select(Tweet.id, Tweet.created_at)
+            .filter(Tweet.author_id == author_id)
+            .order_by(desc(Tweet.created_at))
+            .limit(self.max_feed_size)
+        )
+        feed_items = [
+            {"user_id": user_id, "tweet_id": tweet_id, "created_at": created_at}
+            for tweet_id, created_at in result
+        ]
+        
+        # Rows already in the feed are skipped; oversized feeds are trimmed
+        # later by the background trimming job
+        write_result = await write_feed_items(self.db, feed_items)
+        await self.db.commit()
+        
+        # The circular buffer is kept in delivery order, so merged older
+        # tweets cannot be slotted in; the next read re-warms it from the DB
+        if self.cache and write_result.inserted:
+            await self.cache.invalidate_user_cache(user_id)
+
+    async def remove_author_from_feed(self, user_id: int, author_id: int):
+        """Delete an unfollowed author's tweets from the user's feed and cache"""
+        await delete_author_feed_items(self.db, user_id, author_id)
+        await self.db.commit()
+        
+        if self.cache:
+            await self.cache.remove_author_from_feed_cache(user_id, author_id)
+
+    async def reconcile_spilled_feeds(self, since_by_user: Dict[int, datetime]):
+        """
+        Merge everything the users' followed authors posted since their
+        watermark into their feeds (fan-out messages for them were dropped)
+        """
+        write_result = await merge_followed_tweets(self.db, since_by_user)
+        await self.db.commit()
+        
+        # Merged tweets are older than what the circular buffer holds; the
+        # next read re-warms it from the DB
+        if self.cache:
+            for user_id in write_result.feed_sizes:
+                await self.cache.invalidate_user_cache(user_id)
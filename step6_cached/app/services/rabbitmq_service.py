@@ -1,94 +1,198 @@
 import aio_pika
+from contextlib import asynccontextmanager
 from aio_pika import ExchangeType
-import json
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Set
 from common.config import get_settings
+from common.publisher_pool import PublisherPool
+from common.fanout import packed_fanout
+from common.event_codec import encode_event
+from common.sharding import publish_barrier
+from common.publishing import publish_batch, uses_publisher_confirms
+from common.feed_rebuilds import FEED_REBUILD_QUEUE, declare_feed_rebuild_queue, subscription_change_message
+from common.feed_spill import SPILL_QUEUE_ARGUMENTS, declare_spill_topology
 import uuid
 
 settings = get_settings()
 
+# Fan-out lanes: active readers are delivered on the fast lane, everyone
+# else on the bulk lane. Each lane has its own exchange, queues and workers,
+# so a backlog of bulk deliveries never delays active readers.
+#
+# Ordering is only guaranteed within a lane. When a user starts reading,
+# their new tweets take the fast lane while older ones may still sit in the
+# bulk backlog and arrive later. feed_items is ordered by created_at and
+# deduplicated, so the stored feed is unaffected; the Redis feed buffer
+# (kept in delivery order) can show such a late tweet above newer ones until
+# it expires or is re-warmed.
+FAST_LANE = "fast"
+BULK_LANE = "bulk"
+LANES = (FAST_LANE, BULK_LANE)
+
+# Worker queues drop their oldest messages beyond this length (to feed_spill)
+QUEUE_MAX_LENGTH = 500000
+
+
+def exchange_name(lane: str) -> str:
+    return "tweet_events_cached" if lane == BULK_LANE else f"tweet_events_cached_{lane}"
+
+
+def queue_name(lane: str, index: int) -> str:
+    return f"feed_updates_cached_{index}" if lane == BULK_LANE else f"feed_updates_cached_{lane}_{index}"
+
+
+def worker_queue_limits(queues: Optional[int] = None) -> Dict[str, int]:
+    """Length limit of every worker queue, by name (for admission control)"""
+    return {
+        queue_name(lane, i): QUEUE_MAX_LENGTH
+        for lane in LANES for i in range(queues or settings.feed_worker_queues)
+    }
+
 
 class RabbitMQService:
-    def __init__(self):
+    def __init__(self, pool: Optional[PublisherPool] = None):
+        self.pool = pool
         self.connection: Optional[aio_pika.Connection] = None
         self.channel: Optional[aio_pika.Channel] = None
-        self.exchange: Optional[aio_pika.Exchange] = None
+        self.exchanges: Dict[str, aio_pika.Exchange] = {}
 
     async def connect(self):
         """Connect to RabbitMQ"""
         self.connection = await aio_pika.connect_robust(settings.rabbitmq_url)
-        self.channel = await self.connection.channel()
+        # Confirm-mode and transactional publishing need differently configured channels
+        self.channel = await self.connection.channel(
+            publisher_confirms=uses_publisher_confirms(settings.publisher_mode)
+        )
         await self.channel.set_qos(prefetch_count=100)  # Higher prefetch for cache
 
     async def setup_exchanges(self):
-        """Set up exchanges for cached architecture"""
-        # Create consistent hash exchange
-        self.exchange = await self.channel.declare_exchange(
-            "tweet_events_cached",
-            ExchangeType.X_CONSISTENT_HASH,
-            durable=True,
-            arguments={
-                "hash-header": "routing_hash",
-                "hash-on": "header"
-            }
-        )
-        
-        # Create queues with cache-optimized settings
-        for i in range(4):
-            queue = await self.channel.declare_queue(
-                f"feed_updates_cached_{i}",
+        """Set up exchanges for cached architecture (one per fan-out lane)"""
+        for lane in LANES:
+            # Create consistent hash exchange
+            exchange = await self.channel.declare_exchange(
+                exchange_name(lane),
+                ExchangeType.X_CONSISTENT_HASH,
                 durable=True,
                 arguments={
-                    "x-max-length": 500000,      # Larger queue for burst handling
-                    "x-message-ttl": 7200000,    # 2 hour TTL
-                    "x-max-priority": 10         # Priority support
+                    "hash-header": "routing_hash",
+                    "hash-on": "header"
                 }
             )
-            
-            # Bind with optimized weight
-            await queue.bind(self.exchange, routing_key="25")
-
-    async def publish_tweet_event_batch(self, tweet_data: Dict[str, Any], follower_ids: List[int]):
-        """Publish with message IDs for deduplication"""
-        if not self.exchange:
-            await self.connect()
-            await self.setup_exchanges()
-        
-        # Batch messages with unique IDs
-        messages = []
-        base_message_id = str(uuid.uuid4())
-        
-        for idx, follower_id in enumerate(follower_ids):
-            message_data = {
-                **tweet_data,
-                "user_id": follower_id
+            self.exchanges[lane] = exchange
+
+            # One queue per worker; resized at runtime with rebalance_lane
+            for i in range(settings.feed_worker_queues):
+                await self.bind_worker_queue(lane, i)
+
+        # Queue for subscription changes (feed rebuild consumer)
+        await declare_feed_rebuild_queue(self.channel)
+
+        # Overflow of the worker queues (spill reconciler)
+        await declare_spill_topology(self.channel)
+
+    async def declare_worker_queue(self, lane: str, index: int) -> aio_pika.Queue:
+        """Declare a worker queue with cache-optimized settings"""
+        return await self.channel.declare_queue(
+            queue_name(lane, index),
+            durable=True,
+            arguments={
+                "x-max-length": QUEUE_MAX_LENGTH,  # Larger queue for burst handling
+                "x-message-ttl": 7200000,    # 2 hour TTL
+                "x-max-priority": 10,        # Priority support
+                **SPILL_QUEUE_ARGUMENTS      # Dropped and expired messages are reconciled
             }
-            
-            # Unique message ID for deduplication
-            message_id = f"{base_message_id}-{idx}"
-            routing_hash = str(follower_id % 25)
-            
-            message = aio_pika.Message(
-                body=json.dumps(message_data).encode(),
-                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                message_id=message_id,
-                headers={
-                    "routing_hash": routing_hash,
-                    "user_id": str(follower_id)
-                },
-                priority=5 if follower_id < 100 else 1  # Prioritize active users
+        )
+
+    async def bind_worker_queue(self, lane: str, index: int):
+        """Put a worker queue on the lane's hash ring (equal weights)"""
+        queue = await self.declare_worker_queue(lane, index)
+        await queue.bind(exchange_name(lane), routing_key=str(settings.routing_binding_weight))
+
+    async def unbind_worker_queue(self, lane: str, index: int):
+        """Take a worker queue off the hash ring; its shards move to the others"""
+        queue = await self.declare_worker_queue(lane, index)
+        await queue.unbind(exchange_name(lane), routing_key=str(settings.routing_binding_weight))
+
+    async def delete_worker_queue(self, lane: str, index: int):
+        """Delete a drained worker queue (refuses if messages are left)"""
+        queue = await self.declare_worker_queue(lane, index)
+        await queue.delete(if_unused=False, if_empty=True)
+
+    async def publish_barrier(self, lane: str, index: int, barrier_id: str):
+        """Queue a rebalance barrier behind everything already in a worker queue"""
+        await publish_barrier(self.channel, queue_name(lane, index), barrier_id)
+
+    @asynccontextmanager
+    async def _publishing_channel(self):
+        """Channel to publish on: checked out of the app pool, or a private connection"""
+        if self.pool:
+            async with self.pool.acquire() as channel:
+                yield channel
+        else:
+            if not self.exchanges:
+                await self.connect()
+                await self.setup_exchanges()
+            yield self.channel
+
+    async def publish_tweet_event_batch(self, tweet_data: Dict[str, Any], follower_ids: List[int],
+                                        active_ids: Optional[Set[int]] = None):
+        """
+        Publish with message IDs for deduplication.
+        Followers in active_ids (recent feed readers) go to the fast lane.
+        """
+        active_ids = active_ids or set()
+
+        # One message per lane and routing shard carrying the tweet once and
+        # the followers in that shard; unique message IDs for deduplication
+        lane_followers = {lane: [] for lane in LANES}
+        for follower_id in follower_ids:
+            lane_followers[FAST_LANE if follower_id in active_ids else BULK_LANE].append(follower_id)
+
+        messages = {lane: [] for lane in LANES}
+        base_message_id = str(uuid.uuid4())
+        idx = 0
+
+        for lane in LANES:
+            for bucket, user_ids in packed_fanout(lane_followers[lane], settings.routing_shards, settings.fanout_max_user_ids_per_message):
+                routing_hash = str(bucket)
+                body, content_type = encode_event({**tweet_data, "user_ids": user_ids}, settings.fanout_message_format)
+                message = aio_pika.Message(
+                    body=body,
+                    content_type=content_type,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                    message_id=f"{base_message_id}-{idx}",
+                    headers={
+                        "routing_hash": routing_hash
+                    }
+                )
+                messages[lane].append((message, routing_hash))
+                idx += 1
+
+        # Publish fast lane first
+        async with self._publishing_channel() as channel:
+            publishes = []
+            for lane in LANES:
+                exchange = await PublisherPool.get_exchange(channel, exchange_name(lane))
+                publishes.extend((exchange, message, routing_key) for message, routing_key in messages[lane])
+
+            # Pipelined with confirms (or larger transactions of 200 for cache)
+            await publish_batch(
+                channel,
+                publishes,
+                settings.publisher_mode,
+                batch_size=200,
+                window=settings.publisher_confirm_window
+            )
+
+    async def publish_subscription_change(self, user_id: int, author_id: int):
+        """Hand a follow/unfollow to the feed rebuild consumer"""
+        async with self._publishing_channel() as channel:
+            await publish_batch(
+                channel,
+                [(channel.default_exchange, subscription_change_message(user_id, author_id), FEED_REBUILD_QUEUE)],
+                settings.publisher_mode
             )
-            messages.append((message, routing_hash))
-        
-        # Publish in optimized batches
-        batch_size = 200  # Larger batches for cache
-        for i in range(0, len(messages), batch_size):
-            batch = messages[i:i + batch_size]
-            async with self.channel.transaction():
-                for message, routing_key in batch:
-                    await self.exchange.publish(message, routing_key=routing_key)
 
     async def close(self):
         """Close RabbitMQ connection"""
         if self.connection:
-            await self.connection.close()
\ No newline at end of file
+            await self.connection.close()
@@ -1,21 +1,30 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, func
 from sqlalchemy.orm import selectinload
 from typing import List, Optional
 from common.models import Tweet, User, Subscription
 from common.schemas import TweetCreate
+from common.config import get_settings
+from common.activity import filter_active_users
+from common.outbox import outbox_entry
+from common.publisher_pool import PublisherPool
 from .rabbitmq_service import RabbitMQService
 from .cache_service import CacheService
 
+settings = get_settings()
+
 
 class TweetService:
-    def __init__(self, db: AsyncSession, cache: Optional[CacheService] = None):
+    def __init__(self, db: AsyncSession, cache: Optional[CacheService] = None,
+                 publisher_pool: Optional[PublisherPool] = None):
         self.db = db
         self.cache = cache
+        self.publisher_pool = publisher_pool
 
     async def create_tweet(self, user_id: int, tweet_data: TweetCreate) -> Tweet:
         """
-        Step 6: Create tweet with caching support
+        Step 6: Create tweet with caching support. The fan-out event is
+        committed to the outbox with the tweet and published by the relay.
         """
         
         tweet = Tweet(
@@ -23,8 +32,7 @@ class TweetService:
             author_id=user_id
         )
         self.db.add(tweet)
-        await self.db.commit()
-        await self.db.refresh(tweet)
+        await self.db.flush()
         
         # Load author relationship
         result = await self.db.execute(
@@ -34,38 +42,51 @@ class TweetService:
         )
         tweet = result.scalar_one()
         
-        # Get followers count for metrics
+        entry = outbox_entry(tweet)
+        self.db.add(entry)
+        await self.db.commit()
+        
+        # Cache the tweet if cache available
+        if self.cache:
+            await self.cache.cache_tweet(tweet.id, entry.payload)
+        return tweet
+
+    async def publish_tweet_event(self, event: dict):
+        """Fan an outbox event out to the author's active followers"""
+        author_id = event["author_id"]
+        
         result = await self.db.execute(
             select(Subscription.follower_id)
-            .filter(Subscription.followed_id == user_id)
+            .filter(Subscription.followed_id == author_id)
         )
         follower_ids = [row[0] for row in result]
-        follower_ids.append(user_id)
+        follower_ids.append(author_id)
         
-        # Cache the tweet if cache available
+        # Dormant users are skipped; their feed is rebuilt when they return
+        if self.cache and settings.dormant_after_days > 0:
+            readers = await self.cache.get_active_readers(follower_ids, settings.dormant_after_days * 86400)
+            follower_ids = [follower_id for follower_id in follower_ids if follower_id in readers]
+        else:
+            follower_ids = await filter_active_users(self.db, follower_ids)
+        
+        active_ids = set()
         if self.cache:
-            await self.cache.cache_tweet(tweet.id, {
-                "tweet_id": tweet.id,
-                "content": tweet.content,
-                "author_id": tweet.author_id,
-                "author_username": tweet.author.username,
-                "created_at": tweet.created_at.isoformat()
-            })
+            # Followers who read their feed recently go to the fast lane
+            active_ids = await self.cache.get_active_readers(
+                follower_ids, settings.active_reader_window_seconds
+            )
         
         # Publish to RabbitMQ
-        rabbitmq = RabbitMQService()
-        await rabbitmq.publish_tweet_event_batch(
-            {
-                "tweet_id": tweet.id,
-                "content": tweet.content,
-                "author_id": tweet.author_id,
-                "author_username": tweet.author.username,
-                "created_at": tweet.created_at.isoformat()
-            },
-            follower_ids
-        )
+        rabbitmq = RabbitMQService(self.publisher_pool)
+        await rabbitmq.publish_tweet_event_batch(event, follower_ids, active_ids)
         await rabbitmq.close()
-        return tweet
+
+    async def count_followers(self, user_id: int) -> int:
+        """Size of the fan-out a tweet by this user would cause"""
+        result = await self.db.execute(
+            select(func.count()).select_from(Subscription).filter(Subscription.followed_id == user_id)
+        )
+        return result.scalar_one()
 
     async def get_tweet(self, tweet_id: int) -> Optional[Tweet]:
         result = await self.db.execute(
@@ -1,47 +1,99 @@
 import asyncio
 import aio_pika
-import json
 import logging
+import time
 import uuid
-from typing import Optional
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from common.database import async_session_maker
 from common.config import get_settings
+from common.feed_trimmer import get_feed_trimmer
+from common.feed_rebuilds import get_feed_rebuild_consumer
+from common.outbox import get_outbox_relay
+from common.feed_spill import get_spill_reconciler
+from common.flow_control import adaptive_prefetch, get_db_slots
+from common.keyed_executor import get_keyed_executor
+from common.batching import MessageBatcher
+from common.event_codec import decode_event
+from common.dead_letters import RetryHandler, declare_retry_topology
+from common.feed_writer import missing_users
+from common.fanout import message_bucket, message_user_ids
+from common.sharding import is_barrier
 from ..services.feed_service import FeedService
+from ..services.tweet_service import TweetService
 from ..services.cache_service import CacheService
+from ..services.rabbitmq_service import BULK_LANE, FAST_LANE, exchange_name, queue_name
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
 
 class FeedWorker:
-    def __init__(self, worker_id: int, cache_service: CacheService):
+    def __init__(self, worker_id: int, cache_service: CacheService, lane: str = BULK_LANE):
         self.worker_id = worker_id
+        self.lane = lane
         self.cache_service = cache_service
         self.connection: Optional[aio_pika.Connection] = None
         self.channel: Optional[aio_pika.Channel] = None
         self.queue: Optional[aio_pika.Queue] = None
+        self.consumer_tag: Optional[str] = None
+        self.retries: Optional[RetryHandler] = None
         self.running = False
+        # Rebalance barriers seen (or awaited) on this worker's queue
+        self._barriers: Dict[str, asyncio.Event] = {}
+        # Fast lane serves active readers, so it does not wait to fill a batch
+        self.linger_ms = (
+            settings.fast_lane_batch_linger_ms if lane == FAST_LANE
+            else settings.feed_worker_batch_linger_ms
+        )
+        self.batcher = MessageBatcher(
+            self.process_batch,
+            max_size=settings.feed_worker_batch_size,
+            linger_ms=self.linger_ms
+        )
+        # Starts at one full batch; adapts to the processing latency
+        self.prefetch = adaptive_prefetch(
+            max(50, settings.feed_worker_batch_size), f"feed_worker_{lane}_{worker_id}"
+        )
 
     async def start(self):
         """Start the feed worker with caching support"""
         self.running = True
-        logger.info(f"Starting cached feed worker {self.worker_id}...")
+        logger.info(f"Starting cached feed worker {self.worker_id} ({self.lane} lane)...")
         
         try:
             # Connect to RabbitMQ
             self.connection = await aio_pika.connect_robust(settings.rabbitmq_url)
             self.channel = await self.connection.channel()
-            await self.channel.set_qos(prefetch_count=50)
+            await self.prefetch.start(self.channel)
             
             # Connect to specific worker queue
             self.queue = await self.channel.declare_queue(
-                f"feed_updates_cached_{self.worker_id}",
+                queue_name(self.lane, self.worker_id),
                 durable=True
             )
             
-            # Start consuming messages
-            await self.queue.consume(self.process_message)
+            # Failed messages go through delayed retries to the dead-letter queue
+            await declare_retry_topology(self.channel, exchange_name(self.lane), settings.feed_retry_delays_ms)
+            self.retries = RetryHandler(self.channel, self.queue.name, exchange_name(self.lane), settings.feed_retry_delays_ms)
+            
+            # Trim oversized feeds in the background (shared per process)
+            get_feed_trimmer().start()
+            
+            # Apply subscription changes in the background (shared per process)
+            await get_feed_rebuild_consumer().start(lambda db: FeedService(db, self.cache_service))
+            
+            # Publish committed tweet events from the outbox (shared per process)
+            await get_outbox_relay().start(lambda db, pool: TweetService(db, self.cache_service, pool))
+            
+            # Reconcile feeds whose messages the queues dropped (shared per process)
+            await get_spill_reconciler().start(lambda db: FeedService(db, self.cache_service))
+            
+            # Start consuming messages in micro-batches
+            self.batcher.start()
+            self.consumer_tag = await self.queue.consume(self.batcher.put)
             
             logger.info(f"Cached feed worker {self.worker_id} started successfully")
             
@@ -53,6 +105,7 @@ class FeedWorker:
                 await asyncio.sleep(1)
             
             warmup_task.cancel()
+            await self.batcher.stop()
                 
         except Exception as e:
             logger.error(f"Feed worker {self.worker_id} error: {e}")
@@ -65,23 +118,144 @@ class FeedWorker:
         message_id = message.message_id or str(uuid.uuid4())
         
         async with message.process():
+            if is_barrier(message):
+                self.barrier(message.message_id).set()
+                return
+            
             try:
                 # Parse message
-                data = json.loads(message.body.decode())
-                user_id = data["user_id"]
+                data = decode_event(message.body, message.content_type)
+                user_ids = message_user_ids(data)
                 
-                logger.info(f"Worker {self.worker_id} processing tweet {data['tweet_id']} for user {user_id}")
+                logger.info(f"Worker {self.worker_id} processing tweet {data['tweet_id']} for {len(user_ids)} users")
                 
-                # Create database session
-                async with async_session_maker() as db:
-                    feed_service = FeedService(db, self.cache_service)
-                    await feed_service.add_tweet_to_user_feed(data, message_id)
+                # Write on the recipients' executor lane (ordered per user,
+                # also against the other lane's worker)
+                await self.write_message(message, data, message_id)
                 
-                logger.info(f"Worker {self.worker_id} successfully processed for user {user_id}")
+                logger.info(f"Worker {self.worker_id} successfully processed tweet {data['tweet_id']}")
                 
             except Exception as e:
                 logger.error(f"Worker {self.worker_id} error processing message: {e}")
+                if not self.retries:
+                    raise
+                
+                # Ack and schedule a delayed retry (or dead-letter) instead of rejecting
+                await self.retries.handle_failure(message, e)
+
+    async def process_batch(self, messages: List[aio_pika.IncomingMessage]):
+        """Process a micro-batch in one transaction and ack it with a single frame"""
+        start_time = time.monotonic()
+        try:
+            batch = [
+                (decode_event(message.body, message.content_type), message.message_id or str(uuid.uuid4()))
+                for message in messages if not is_barrier(message)
+            ]
+            
+            # One transaction per executor lane, lanes in parallel
+            executor = get_keyed_executor()
+            by_lane = defaultdict(list)
+            for item in batch:
+                by_lane[executor.lane_for(message_bucket(item[0], settings.routing_shards))].append(item)
+            results = await asyncio.gather(
+                *(executor.submit(lane, lambda items=items: self.write_feeds(items)) for lane, items in by_lane.items()),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            
+            # Batches are handled sequentially, so this acks exactly this batch
+            await messages[-1].ack(multiple=True)
+            
+            # Everything queued before a barrier is now applied
+            for message in messages:
+                if is_barrier(message):
+                    self.barrier(message.message_id).set()
+            
+        except Exception as e:
+            # Fall back to per-message processing to isolate the failing message
+            logger.warning(f"Worker {self.worker_id} batch of {len(messages)} failed ({e}), retrying one by one")
+            for message in messages:
+                try:
+                    await self.process_message(message)
+                except Exception as message_error:
+                    # process_message has already rejected it
+                    logger.error(f"Worker {self.worker_id} dropped message {message.message_id}: {message_error}")
+        
+        await self.prefetch.observe(time.monotonic() - start_time)
+
+    async def write_message(self, message: aio_pika.IncomingMessage, data: Dict[str, Any], message_id: str):
+        """
+        Write one fan-out message on its recipients' executor lane. Recipients
+        that no longer exist are dead-lettered on their own instead of failing
+        the whole packed message.
+        """
+        executor = get_keyed_executor()
+        bucket = message_bucket(data, settings.routing_shards)
+        try:
+            await executor.run(bucket, lambda: self.write_feeds([(data, message_id)]))
+        except IntegrityError as e:
+            if not self.retries:
+                raise
+            user_ids = message_user_ids(data)
+            async with get_db_slots():
+                async with async_session_maker() as db:
+                    missing = await missing_users(db, user_ids)
+            if not missing:
                 raise
+            
+            remaining = [user_id for user_id in user_ids if user_id not in missing]
+            if remaining:
+                data = {**data, "user_ids": remaining}
+                await executor.run(bucket, lambda: self.write_feeds([(data, message_id)]))
+            await self.retries.dead_letter(message, e, {**data, "user_ids": sorted(missing)})
+            logger.warning(f"Worker {self.worker_id} dead-lettered {len(missing)} missing recipients of tweet {data['tweet_id']}")
+
+    async def write_feeds(self, batch: List[Tuple[Dict[str, Any], str]]):
+        """Write (message, message_id) pairs to feeds and cache in one transaction"""
+        async with get_db_slots():
+            async with async_session_maker() as db:
+                feed_service = FeedService(db, self.cache_service)
+                await feed_service.add_tweets_to_user_feeds(batch)
+
+    def barrier(self, barrier_id: str) -> asyncio.Event:
+        """Event set once the barrier with this id has been processed"""
+        return self._barriers.setdefault(barrier_id, asyncio.Event())
+
+    def forget_barrier(self, barrier_id: str):
+        self._barriers.pop(barrier_id, None)
+
+    async def pause(self):
+        """Stop taking new deliveries (already delivered ones are still applied)"""
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
+
+    async def resume(self):
+        """Start taking deliveries again after pause()"""
+        if self.queue and not self.consumer_tag:
+            self.consumer_tag = await self.queue.consume(self.batcher.put)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Batching statistics for this worker"""
+        return {
+            "worker_id": self.worker_id,
+            "lane": self.lane,
+            "batches": self.batcher.batches,
+            "messages": self.batcher.items,
+            "last_batch_size": self.batcher.last_batch_size,
+            "avg_batch_size": round(self.batcher.average_batch_size, 2),
+            "max_batch_size": self.batcher.max_size,
+            "linger_ms": self.linger_ms,
+            "paused": self.running and self.consumer_tag is None,
+            "in_flight": self.batcher.pending,
+            "retried": self.retries.retried if self.retries else 0,
+            "dead_lettered": self.retries.dead_lettered if self.retries else 0,
+            **self.prefetch.get_stats(),
+            "db_slots": get_db_slots().get_stats(),
+            "executor": get_keyed_executor().get_stats()
+        }
 
     async def _periodic_cache_warmup(self):
         """Periodically warm cache for hot users"""
@@ -99,23 +273,35 @@ class FeedWorker:
                         feed_service = FeedService(db, self.cache_service)
                         
                         for user_id in hot_users:
-                            # Force cache refresh by getting feed
-                            await feed_service.get_user_feed(user_id, limit=100)
+                            # Load only: warming must not mark them as active readers
+                            await feed_service.load_feed(user_id, limit=100)
                 
             except Exception as e:
                 logger.error(f"Cache warmup error: {e}")
 
-    async def stop(self):
-        """Stop the feed worker gracefully"""
+    async def stop(self, timeout: Optional[float] = None):
+        """
+        Drain and stop: stop consuming, wait up to timeout (default
+        FEED_WORKER_DRAIN_TIMEOUT_SECONDS) for the batches already received
+        to be committed and acked, then close. Only what is still pending
+        at the deadline is redelivered.
+        """
         logger.info(f"Stopping cached feed worker {self.worker_id}...")
+        await self.pause()
+        timeout = settings.feed_worker_drain_timeout_seconds if timeout is None else timeout
+        if not await self.batcher.drain(timeout):
+            logger.warning(f"Worker {self.worker_id} drain timed out, {self.batcher.pending} messages will be redelivered")
         self.running = False
         await self.cleanup()
 
     async def cleanup(self):
         """Clean up resources"""
-        if self.queue:
-            await self.queue.cancel_consumer()
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
+            self.consumer_tag = None
         if self.channel:
             await self.channel.close()
+            self.channel = None
         if self.connection:
-            await self.connection.close()
\ No newline at end of file
+            await self.connection.close()
+            self.connection = None
\ No newline at end of file
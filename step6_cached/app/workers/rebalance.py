@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from common.config import get_settings
+from common.sharding import new_barrier_id, plan_rebalance
+from ..services.rabbitmq_service import RabbitMQService
+from .feed_worker import FeedWorker
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+async def rebalance_lane(
+    rabbitmq: RabbitMQService,
+    lane: str,
+    workers: Dict[int, FeedWorker],
+    target: int,
+    spawn: Callable[[int], FeedWorker],
+    retire: Callable[[FeedWorker], Awaitable[None]]
+) -> Dict[str, Any]:
+    """
+    Resize a fan-out lane to `target` worker queues without breaking
+    per-user ordering (drain-and-rebind, see common.sharding).
+
+    `workers` maps queue index -> running worker and is updated in place;
+    `spawn` starts a worker for a new queue, `retire` stops one.
+    A drain that times out is reported as "drained": False instead of raising.
+    """
+    current = len(workers)
+    target = max(1, target)
+    gaining, losing, added, removed = plan_rebalance(current, target)
+    if not added and not removed:
+        return {"from": current, "to": current, "drained": True}
+
+    logger.info(f"Rebalancing {lane} lane from {current} to {target} queues")
+    barrier_id = new_barrier_id()
+    drained = False
+
+    # 1. Queues that take over shards must not run ahead of the drain
+    for i in gaining:
+        if i in workers:
+            await workers[i].pause()
+
+    try:
+        # 2. Move shards on the hash ring
+        for i in added:
+            await rabbitmq.bind_worker_queue(lane, i)
+        for i in removed:
+            await rabbitmq.unbind_worker_queue(lane, i)
+
+        # 3. Wait until everything queued before the rebind has been applied
+        barriers = [workers[i].barrier(barrier_id).wait() for i in losing]
+        for i in losing:
+            await rabbitmq.publish_barrier(lane, i, barrier_id)
+        try:
+            await asyncio.wait_for(asyncio.gather(*barriers), settings.rebalance_drain_timeout_seconds)
+            drained = True
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        for i in losing:
+            workers[i].forget_barrier(barrier_id)
+
+        # 4. Drop removed queues (only once drained) and let the gaining ones go.
+        # Without a completed drain removed workers keep consuming their
+        # (unbound) queues and the rebalance can be retried.
+        if drained:
+            for i in removed:
+                await retire(workers.pop(i))
+                await rabbitmq.delete_worker_queue(lane, i)
+        else:
+            logger.warning(f"Rebalance of {lane} lane did not drain in time, resuming without ordering guarantee")
+        for i in gaining:
+            if i in workers:
+                await workers[i].resume()
+            else:
+                workers[i] = spawn(i)
+
+    return {"from": current, "to": len(workers), "drained": drained}
@@ -2,23 +2,53 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from contextlib import asynccontextmanager
 import asyncio
 from common.database import engine
 from common.models import Base
+from common.config import get_settings
+from common.publisher_pool import PublisherPool
+from common.publishing import uses_publisher_confirms
+from common.admission import AdmissionController
+from common.feed_rebuilds import get_feed_rebuild_consumer
+from common.outbox import get_outbox_relay
+from common.feed_spill import get_spill_reconciler
+from common.draining import stop_background
 from app.api import users, tweets, subscriptions, feed
 from app.services.cache_service import CacheService
-from app.services.rabbitmq_service import RabbitMQService
+from app.services.rabbitmq_service import RabbitMQService, LANES, worker_queue_limits
 from app.workers.feed_worker import FeedWorker
+from app.workers.rebalance import rebalance_lane
 
 # Global instances
 cache_service = None
 workers = []
+rebalance_lock = asyncio.Lock()
+
+
+def start_worker(index: int, lane: str) -> FeedWorker:
+    worker = FeedWorker(index, cache_service, lane)
+    worker_task = asyncio.create_task(worker.start())
+    workers.append((worker, worker_task))
+    return worker
+
+
+async def stop_worker(worker: FeedWorker):
+    for entry in list(workers):
+        if entry[0] is worker:
+            workers.remove(entry)
+            await worker.stop()
+            entry[1].cancel()
+            try:
+                await entry[1]
+            except asyncio.CancelledError:
+                pass
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global cache_service, workers
+    global cache_service
     
     # Startup
     async with engine.begin() as conn:
@@ -35,24 +65,44 @@ async def lifespan(app: FastAPI):
     await rabbitmq.setup_exchanges()
     await rabbitmq.close()
     
-    # Start multiple workers
-    for i in range(4):
-        worker = FeedWorker(i, cache_service)
-        worker_task = asyncio.create_task(worker.start())
-        workers.append((worker, worker_task))
+    # Long-lived publisher connection and channels shared by all requests
+    publisher_pool = PublisherPool(
+        get_settings().rabbitmq_url,
+        size=get_settings().publisher_pool_size,
+        publisher_confirms=uses_publisher_confirms(get_settings().publisher_mode)
+    )
+    await publisher_pool.start()
+    app.state.publisher_pool = publisher_pool
+    
+    # Refuse writes before the worker queues overflow and drop updates
+    admission = AdmissionController(
+        get_settings().rabbitmq_url,
+        worker_queue_limits(),
+        interval=get_settings().admission_poll_interval_seconds,
+        soft_ratio=get_settings().admission_soft_ratio,
+        hard_ratio=get_settings().admission_hard_ratio,
+        large_fanout=get_settings().admission_large_fanout,
+        stale_after_failures=get_settings().admission_stale_after_failures
+    )
+    await admission.start()
+    app.state.admission = admission
+    
+    # Start one worker per queue and fan-out lane, unless the workers run
+    # as a separate service and this process only serves HTTP
+    if get_settings().feed_workers_in_api:
+        for lane in LANES:
+            for i in range(get_settings().feed_worker_queues):
+                start_worker(i, lane)
     
     yield
     
-    # Shutdown
-    for worker, task in workers:
-        await worker.stop()
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
+    # Shutdown: drain all workers at once (each waits for its own deliveries)
+    await asyncio.gather(*(stop_worker(worker) for worker, _ in list(workers)))
     
+    await admission.stop()
+    await stop_background(get_settings().feed_worker_drain_timeout_seconds)
     await cache_service.close()
+    await publisher_pool.close()
     await engine.dispose()
 
 
@@ -81,7 +131,8 @@ async def root():
             "Cache warming strategies",
             "Automatic cache invalidation",
             "10x performance improvement"
-        ]
+        ],
+        "feed_workers": "in-process" if get_settings().feed_workers_in_api else "separate service"
     }
 
 
@@ -90,4 +141,63 @@ async def cache_stats():
     """Get cache statistics"""
     if cache_service:
         return await cache_service.get_stats()
-    return {"error": "Cache not initialized"}
\ No newline at end of file
+    return {"error": "Cache not initialized"}
+
+
+@app.get("/workers/stats")
+async def workers_stats():
+    """Get feed worker batching statistics"""
+    return [worker.get_stats() for worker, _ in workers]
+
+
+@app.post("/workers/rebalance")
+async def rebalance_workers(queues: int):
+    """
+    Resize every fan-out lane to `queues` worker queues (drain-and-rebind).
+    Set FEED_WORKER_QUEUES to the same value so restarts keep the topology.
+    """
+    if queues < 1:
+        raise HTTPException(status_code=400, detail="queues must be at least 1")
+    if not get_settings().feed_workers_in_api:
+        raise HTTPException(status_code=409, detail="Feed workers do not run in the API process")
+    
+    async with rebalance_lock:
+        rabbitmq = RabbitMQService()
+        await rabbitmq.connect()
+        try:
+            result = {}
+            for lane in LANES:
+                lane_workers = {worker.worker_id: worker for worker, _ in workers if worker.lane == lane}
+                result[lane] = await rebalance_lane(
+                    rabbitmq, lane, lane_workers, queues,
+                    spawn=lambda i, lane=lane: start_worker(i, lane),
+                    retire=stop_worker
+                )
+        finally:
+            await rabbitmq.close()
+        app.state.admission.set_queue_limits(worker_queue_limits(queues))
+    return result
+
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Get worker queue fill level and refused writes"""
+    return app.state.admission.get_stats()
+
+
+@app.get("/feed-rebuilds/stats")
+async def feed_rebuilds_stats():
+    """Get rebuild queue depth and coalescing statistics"""
+    return await get_feed_rebuild_consumer().get_stats()
+
+
+@app.get("/outbox/stats")
+async def outbox_stats():
+    """Get outbox backlog and relay statistics"""
+    return await get_outbox_relay().get_stats()
+
+
+@app.get("/feed-spill/stats")
+async def feed_spill_stats():
+    """Get dropped-message spill and feed reconciliation statistics"""
+    return await get_spill_reconciler().get_stats()
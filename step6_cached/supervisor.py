@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Multi-process worker runner for Step 6.
+
+Starts N processes (default: one per core), each with its own event loop,
+Redis connection and the cached feed workers for its share of the
+FEED_WORKER_QUEUES queues of both fan-out lanes. Crashed processes are
+restarted and the aggregate throughput is logged periodically.
+
+  python supervisor.py --processes 4
+"""
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+from typing import List, Tuple
+
+from common.config import get_settings
+from common.draining import stop_background
+from common.supervisor import WorkerSupervisor, report_progress, shard_assignments
+from app.services.cache_service import CacheService
+from app.services.rabbitmq_service import LANES
+from app.workers.feed_worker import FeedWorker
+
+settings = get_settings()
+
+
+def configure_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+
+async def serve(queues: List[Tuple[str, int]], counter):
+    """Run the workers of one child process until they stop"""
+    cache_service = CacheService()
+    await cache_service.initialize()
+    workers = [FeedWorker(index, cache_service, lane) for lane, index in queues]
+
+    shutdown_task = None
+
+    async def shutdown():
+        # Drain all workers at once, then the background consumers
+        await asyncio.gather(*(worker.stop() for worker in workers))
+        await stop_background(settings.feed_worker_drain_timeout_seconds)
+
+    def stop_workers():
+        nonlocal shutdown_task
+        if shutdown_task is None:
+            shutdown_task = asyncio.create_task(shutdown())
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_workers)
+
+    progress = asyncio.create_task(
+        report_progress(counter, lambda: sum(worker.batcher.items for worker in workers))
+    )
+    try:
+        await asyncio.gather(*(worker.start() for worker in workers))
+        if shutdown_task:
+            await shutdown_task
+    finally:
+        progress.cancel()
+        await cache_service.close()
+
+
+def run_worker_process(queues: List[Tuple[str, int]], counter):
+    """Child process entry point"""
+    configure_logging()
+    asyncio.run(serve(queues, counter))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=settings.feed_worker_processes or os.cpu_count())
+    parser.add_argument("--report-interval", type=float, default=10.0, help="seconds between throughput reports")
+    args = parser.parse_args()
+    configure_logging()
+
+    queues = [(lane, i) for i in range(settings.feed_worker_queues) for lane in LANES]
+    WorkerSupervisor(
+        run_worker_process,
+        shard_assignments(queues, args.processes),
+        name="cached-feed-worker",
+        report_interval=args.report_interval,
+        # Worker drain, then background consumer drain, plus slack
+        stop_timeout=2 * settings.feed_worker_drain_timeout_seconds + 10
+    ).run()
+
+
+if __name__ == "__main__":
+    main()